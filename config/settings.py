@@ -14,6 +14,7 @@ class BotConfig:
     
     # Database Settings
     DATABASE_URL: str = os.getenv('DATABASE_URL', 'sqlite+aiosqlite:///./telebot.db')
+    RUN_DB_INIT: bool = os.getenv('RUN_DB_INIT', '1') == '1'  # 0 skips startup table creation
     
     # Webhook Settings
     USE_WEBHOOK: bool = os.getenv('USE_WEBHOOK', 'false').lower() == 'true'
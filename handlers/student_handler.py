@@ -489,6 +489,8 @@ class StudentHandler:
         """Update user's section"""
         try:
             await self.db.update_student_section(user_id, section)
+            if self.learning_service:
+                self.learning_service.invalidate_student()
             
             keyboard = [[InlineKeyboardButton("🔙 الإعدادات", callback_data="settings_menu")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
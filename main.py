@@ -49,6 +49,9 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class TelegramBot:
+    # Only the update types _setup_handlers consumes; Telegram drops the rest server-side
+    ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+    
     def __init__(self):
         try:
             self.config = BotConfig()
@@ -74,9 +77,10 @@ class TelegramBot:
         try:
             # Initialize database with circuit breaker protection
             logger.info("Initializing database connection...")
-            self.db_manager = get_database_manager()
+            if self.db_manager is None:
+                self.db_manager = get_database_manager()
             logger.info(f"Using database manager: {type(self.db_manager).__name__}")
-            await self.db_manager.initialize()
+            await self.db_manager.initialize(create_tables=self.config.RUN_DB_INIT)
             logger.info("Database tables created/verified successfully")
             
             # Skip cache for now
@@ -116,7 +120,11 @@ class TelegramBot:
             # Setup FastAPI webhook endpoint
             self._setup_webhook_endpoint()
             
-            # Start scheduler
+            # Migrate legacy content hashes and warm the duplicate-content index,
+            # then start analytics workers and scheduler
+            await self.content_service.rehash_legacy_materials()
+            await self.content_service.load_hash_index()
+            await self.analytics_service.start()
             await self.scheduler.start()
             
             # Skip monitoring for now
@@ -242,7 +250,7 @@ class TelegramBot:
         try:
             success = await self.app.bot.set_webhook(
                 url=webhook_url,
-                allowed_updates=["message", "callback_query", "inline_query"]
+                allowed_updates=self.ALLOWED_UPDATES
             )
             
             if success:
@@ -269,7 +277,7 @@ class TelegramBot:
         logger.info("Starting bot in polling mode...")
         await self.app.initialize()
         await self.app.start()
-        await self.app.updater.start_polling(drop_pending_updates=True)
+        await self.app.updater.start_polling(drop_pending_updates=True, allowed_updates=self.ALLOWED_UPDATES)
 
     async def start_webhook(self, host="0.0.0.0", port=8000):
         """Start bot in webhook mode"""
@@ -291,7 +299,7 @@ class TelegramBot:
             
             # Start polling in background
             import asyncio
-            asyncio.create_task(self.app.updater.start_polling(drop_pending_updates=True))
+            asyncio.create_task(self.app.updater.start_polling(drop_pending_updates=True, allowed_updates=self.ALLOWED_UPDATES))
         
         # Start FastAPI server (always serve HTTP endpoints for health checks)
         config = uvicorn.Config(
@@ -423,6 +431,9 @@ class TelegramBot:
             if self.scheduler:
                 await self.scheduler.stop()
             
+            if self.analytics_service:
+                await self.analytics_service.stop()
+            
             if self.app:
                 await self.app.stop()
                 await self.app.shutdown()
@@ -445,10 +456,11 @@ def setup_signal_handlers(bot: TelegramBot):
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
-async def main():
-    """Main application entry point"""
+async def main(db_manager=None):
+    """Main application entry point (db_manager: an already-opened manager to reuse)"""
     try:
         bot = TelegramBot()
+        bot.db_manager = db_manager
         setup_signal_handlers(bot)
     except ValueError as config_error:
         # Configuration error - start minimal health server
@@ -493,7 +505,7 @@ async def main():
         # Start bot polling
         await bot.app.initialize()
         await bot.app.start()
-        await bot.app.updater.start_polling(drop_pending_updates=True)
+        await bot.app.updater.start_polling(drop_pending_updates=True, allowed_updates=bot.ALLOWED_UPDATES)
         logger.info("✅ Bot polling started successfully")
         
         # Start health server for Railway
@@ -528,6 +540,13 @@ async def main():
         await bot.shutdown()
 
 if __name__ == "__main__":
+    # Use uvloop's libuv-based event loop when installed; stdlib loop otherwise
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -19,10 +19,11 @@ class DatabaseManager:
         
         logger.info(f"Using SQLite database: {self.db_path}")
 
-    async def initialize(self):
-        """Initialize database and create tables"""
+    async def initialize(self, create_tables: bool = True):
+        """Initialize database and create tables (unless create_tables is False)"""
         try:
-            await self._create_tables()
+            if create_tables:
+                await self._create_tables()
             logger.info("Database initialized successfully")
         except Exception as e:
             logger.error(f"Database initialization failed: {e}")
@@ -211,6 +212,31 @@ class DatabaseManager:
             await db.commit()
             return cursor.lastrowid
 
+    async def bulk_insert_materials(self, materials: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Insert many materials in one transaction, returning content_hash -> id"""
+        inserted = {}
+        async with aiosqlite.connect(self.db_path) as db:
+            for material_data in materials:
+                cursor = await db.execute('''
+                    INSERT INTO materials (title, description, content, section, subject, week_number, 
+                                         content_type, difficulty_level, estimated_duration, content_hash)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    material_data['title'],
+                    material_data.get('description', ''),
+                    material_data.get('content', ''),
+                    material_data['section'],
+                    material_data['subject'],
+                    material_data['week_number'],
+                    material_data.get('content_type', 'text'),
+                    material_data.get('difficulty_level', 'medium'),
+                    material_data.get('estimated_duration', 30),
+                    material_data.get('content_hash', '')
+                ))
+                inserted[material_data.get('content_hash', '')] = cursor.lastrowid
+            await db.commit()
+        return inserted
+
     async def get_materials_by_section_and_week(self, section: str, week_number: int) -> List[Dict[str, Any]]:
         """Get materials for section and week"""
         async with aiosqlite.connect(self.db_path) as db:
@@ -287,22 +313,26 @@ class DatabaseManager:
             ''', (student_id, activity_type, json.dumps(metadata or {})))
             await db.commit()
 
-    async def bulk_insert_activities(self, activities: List[Dict[str, Any]]):
-        """Bulk insert activities"""
+    async def bulk_insert_activities(self, activities: List[tuple]):
+        """Bulk insert activities as (student_id, activity_type, timestamp, metadata_json, session_id) rows"""
         async with aiosqlite.connect(self.db_path) as db:
-            for activity in activities:
-                await db.execute('''
-                    INSERT INTO student_activities (student_id, activity_type, metadata, session_id)
-                    VALUES (?, ?, ?, ?)
-                ''', (
-                    activity['student_id'],
-                    activity['activity_type'],
-                    activity.get('metadata', '{}'),
-                    activity.get('session_id')
-                ))
+            await db.executemany('''
+                INSERT INTO student_activities (student_id, activity_type, timestamp, metadata, session_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', activities)
             await db.commit()
 
     # Statistics and analytics
+    async def student_activity_exists(self, student_id: int, activity_type: str, week: int) -> bool:
+        """Check whether a student has an activity of this type for a week"""
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute('''
+                SELECT 1 FROM student_activities
+                WHERE student_id = ? AND activity_type = ? AND json_extract(metadata, '$.week') = ?
+                LIMIT 1
+            ''', (student_id, activity_type, week)) as cursor:
+                return await cursor.fetchone() is not None
+
     async def get_user_statistics(self) -> Dict[str, Any]:
         """Get user statistics"""
         async with aiosqlite.connect(self.db_path) as db:
@@ -359,12 +389,90 @@ class DatabaseManager:
     async def get_material_by_hash(self, content_hash: str):
         return None
     
+    async def get_materials_by_hashes(self, content_hashes: List[str]) -> Dict[str, int]:
+        return {}
+    
+    async def get_all_material_hashes(self) -> List[str]:
+        return []
+    
     async def update_material(self, material_id: int, updates: Dict[str, Any]) -> bool:
         return True
     
+    async def get_material_hash_fields(self) -> List[Dict[str, Any]]:
+        return []
+    
+    async def update_material_hashes(self, updates: List[tuple]):
+        pass
+    
+    async def migration_applied(self, name: str) -> bool:
+        return True
+    
+    async def record_migration(self, name: str):
+        pass
+    
     async def get_material_view_stats(self, material_id: int) -> Dict[str, Any]:
         return {'view_count': 0, 'unique_viewers': 0}
     
+    async def get_material_files_bulk(self, material_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        return {}
+    
+    async def get_material_view_stats_bulk(self, material_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        return {}
+    
+    async def delete_material_files_bulk(self, file_ids: List[int]) -> int:
+        return len(file_ids)
+    
+    async def create_material_file_and_touch(self, file_info: Dict[str, Any]) -> int:
+        return 0
+    
+    async def bulk_create_questions(self, questions: List[Dict[str, Any]]):
+        pass
+    
+    async def create_quiz_bundle(self, quiz_data: Dict[str, Any], questions: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {**quiz_data, 'id': 0, 'total_questions': len(questions)}
+    
+    async def get_attempt_context(self, attempt_id: int) -> Optional[Dict[str, Any]]:
+        return None
+    
+    async def get_attempt_summary(self, attempt_id: int) -> Dict[str, Any]:
+        return {'total_questions': 0, 'correct_answers': 0, 'points_earned': 0}
+    
+    async def get_student_attempt_stats(self, student_id: int, quiz_id: int) -> Dict[str, Any]:
+        return {'attempt_count': 0, 'has_active': False}
+    
+    async def get_quiz_analytics(self, quiz_id: int) -> Dict[str, Any]:
+        return {}
+    
+    async def get_student_phase_state(self, student_id: int) -> Optional[Dict[str, Any]]:
+        if not await self.get_student_by_id(student_id):
+            return None
+        return {'week': 1, 'content_completed': False,
+                'weekly_quiz_completed': False, 'cumulative_quiz_completed': False}
+    
+    async def get_week_completion_bulk(self, student_ids: List[int], week: int) -> Dict[int, Dict[str, bool]]:
+        return {}
+    
+    async def get_inactive_students_count(self, days: int = 7) -> int:
+        return 0
+    
+    async def get_declining_performance_count(self) -> int:
+        return 0
+    
+    async def get_student_activities(self, student_id: int, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
+        return []
+    
+    async def get_student_material_views(self, student_id: int) -> List[Dict[str, Any]]:
+        return []
+    
+    async def get_student_quiz_results(self, student_id: int, quiz_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        return []
+    
+    async def get_student_recent_quiz_scores(self, student_id: int, limit: int = 10) -> List[float]:
+        return []
+    
+    async def get_student_streaks(self, student_id: int, days: int = 60) -> Dict[str, Any]:
+        return {'current_streak': 0, 'longest_streak': 0, 'last_activity': None}
+    
     async def get_student_notification_setting(self, telegram_id: int) -> bool:
         return True
     
@@ -3,6 +3,7 @@ import asyncpg
 import asyncio
 from typing import Dict, List, Optional, Any, Union
 from datetime import datetime, timedelta
+import hashlib
 import json
 import os
 from contextlib import asynccontextmanager
@@ -12,6 +13,47 @@ logger = logging.getLogger(__name__)
 class PostgreSQLManager:
     """Production-ready PostgreSQL database manager for Telegram bot"""
     
+    # Hot per-student analytics queries, run through the connection statement cache
+    PREPARED_QUERIES = {
+        'student_quiz_results': '''
+            SELECT qa.*, q.title AS quiz_title, q.subject AS subject, q.subject AS quiz_subject
+            FROM quiz_attempts qa
+            JOIN quizzes q ON q.id = qa.quiz_id
+            WHERE qa.student_id = $1 AND qa.status = 'completed'
+            AND ($2::int IS NULL OR qa.quiz_id = $2)
+            ORDER BY qa.end_time
+        ''',
+        'student_recent_quiz_scores': '''
+            SELECT total_score FROM (
+                SELECT total_score, end_time FROM quiz_attempts
+                WHERE student_id = $1 AND status = 'completed'
+                ORDER BY end_time DESC
+                LIMIT $2
+            ) recent
+            ORDER BY end_time
+        ''',
+        'student_activities': '''
+            SELECT activity_type, timestamp, metadata, session_id FROM student_activities
+            WHERE student_id = $1 AND timestamp >= $2 AND timestamp <= $3
+            ORDER BY timestamp
+        ''',
+        'student_material_views': '''
+            SELECT sa.timestamp, v.material_id,
+                   CASE WHEN sa.metadata->>'view_duration' ~ '^[0-9]+([.][0-9]+)?$'
+                        THEN (sa.metadata->>'view_duration')::float ELSE 0 END AS view_duration,
+                   m.title, m.subject
+            FROM student_activities sa
+            -- Malformed ids become NULL instead of failing the whole query
+            CROSS JOIN LATERAL (
+                SELECT CASE WHEN sa.metadata->>'material_id' ~ '^[0-9]{1,9}$'
+                            THEN (sa.metadata->>'material_id')::int END AS material_id
+            ) v
+            LEFT JOIN materials m ON m.id = v.material_id
+            WHERE sa.student_id = $1 AND sa.activity_type = 'view_material'
+            ORDER BY sa.timestamp
+        ''',
+    }
+    
     def __init__(self, database_url: str):
         # Ensure proper postgresql:// format for asyncpg
         if database_url.startswith('postgres://'):
@@ -22,25 +64,21 @@ class PostgreSQLManager:
         # Production-optimized connection pool for 7000+ concurrent users
         self.max_connections = int(os.getenv('DB_MAX_CONNECTIONS', '50'))
         self.min_connections = int(os.getenv('DB_MIN_CONNECTIONS', '10'))
+        # Prepared statements are cached per connection; pgbouncer in transaction
+        # mode cannot keep them, so the cache is disabled there
+        if os.getenv('DB_PGBOUNCER_TRANSACTION_MODE', 'false').lower() == 'true':
+            self.statement_cache_size = 0
+        else:
+            self.statement_cache_size = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '100'))
         
-    async def initialize(self):
-        """Initialize database connection pool and create tables"""
+    async def initialize(self, create_tables: bool = True):
+        """Initialize database connection pool and create tables (unless create_tables is False)"""
         try:
             logger.info(f"Connecting to PostgreSQL database...")
             logger.info(f"Database URL: {self.database_url[:30]}...")  # Log first 30 chars only
             
-            # Create connection pool
-            self.pool = await asyncpg.create_pool(
-                self.database_url,
-                min_size=self.min_connections,
-                max_size=self.max_connections,
-                command_timeout=60,
-                server_settings={
-                    'application_name': 'educational_telegram_bot',
-                }
-            )
-            
-            logger.info("Database connection pool created successfully")
+            # Create connection pool (unless the startup script already opened it)
+            await self.open_pool()
             
             # Test connection
             async with self.get_connection() as conn:
@@ -48,8 +86,11 @@ class PostgreSQLManager:
                 logger.info(f"Connected to: {result}")
             
             # Create tables
-            logger.info("Creating database tables...")
-            await self._create_tables()
+            if create_tables:
+                logger.info("Creating database tables...")
+                await self._create_tables()
+            else:
+                logger.info("Skipping table creation (RUN_DB_INIT=0)")
             
             logger.info("PostgreSQL database initialized successfully")
             
@@ -58,6 +99,22 @@ class PostgreSQLManager:
             logger.error(f"Database URL format: {self.database_url.split('@')[0] if '@' in self.database_url else 'Invalid URL'}")
             raise
 
+    async def open_pool(self) -> asyncpg.Pool:
+        """Create the connection pool if it is not open yet"""
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(
+                self.database_url,
+                min_size=self.min_connections,
+                max_size=self.max_connections,
+                command_timeout=60,
+                statement_cache_size=self.statement_cache_size,
+                server_settings={
+                    'application_name': 'educational_telegram_bot',
+                }
+            )
+            logger.info("Database connection pool created successfully")
+        return self.pool
+
     async def close(self):
         """Close database connection pool"""
         if self.pool:
@@ -73,171 +130,231 @@ class PostgreSQLManager:
         async with self.pool.acquire() as connection:
             yield connection
 
+    async def fetch_prepared(self, name: str, *args) -> List[asyncpg.Record]:
+        """Run a named query from PREPARED_QUERIES.
+
+        asyncpg keeps a per-connection LRU of prepared statements keyed by
+        query text, so after the first call on a connection the statement is
+        only bound and executed, not parsed and planned again.
+        """
+        async with self.get_connection() as conn:
+            return await conn.fetch(self.PREPARED_QUERIES[name], *args)
+
     async def _create_tables(self):
-        """Create all necessary tables"""
-        try:
-            async with self.get_connection() as conn:
-                # Students table
-                await conn.execute('''
-                CREATE TABLE IF NOT EXISTS students (
-                    id SERIAL PRIMARY KEY,
-                    telegram_id BIGINT UNIQUE NOT NULL,
-                    username VARCHAR(255),
-                    name VARCHAR(255) NOT NULL,
-                    phone VARCHAR(50),
-                    section VARCHAR(100),
-                    registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    notification_enabled BOOLEAN DEFAULT TRUE,
-                    current_week INTEGER DEFAULT 1,
-                    completed_weeks INTEGER DEFAULT 0,
-                    engagement_score FLOAT DEFAULT 50.0
-                );
-            ''')
+        """Create all necessary tables (skipped when this exact schema was already applied)"""
+        statements = [
+            # Students table
+            '''
+                    CREATE TABLE IF NOT EXISTS students (
+                        id SERIAL PRIMARY KEY,
+                        telegram_id BIGINT UNIQUE NOT NULL,
+                        username VARCHAR(255),
+                        name VARCHAR(255) NOT NULL,
+                        phone VARCHAR(50),
+                        section VARCHAR(100),
+                        registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        is_active BOOLEAN DEFAULT TRUE,
+                        notification_enabled BOOLEAN DEFAULT TRUE,
+                        current_week INTEGER DEFAULT 1,
+                        completed_weeks INTEGER DEFAULT 0,
+                        engagement_score FLOAT DEFAULT 50.0
+                    );
+            ''',
             
-            # Create index for telegram_id
-                await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_students_telegram_id ON students(telegram_id);
-                CREATE INDEX IF NOT EXISTS idx_students_section ON students(section);
-                CREATE INDEX IF NOT EXISTS idx_students_activity ON students(last_activity);
-            ''')
+            # Student indexes
+            '''
+                    CREATE INDEX IF NOT EXISTS idx_students_telegram_id ON students(telegram_id);
+                    CREATE INDEX IF NOT EXISTS idx_students_section ON students(section);
+                    CREATE INDEX IF NOT EXISTS idx_students_activity ON students(last_activity);
+            ''',
             
             # Materials table
-                await conn.execute('''
-                CREATE TABLE IF NOT EXISTS materials (
-                    id SERIAL PRIMARY KEY,
-                    title VARCHAR(500) NOT NULL,
-                    description TEXT,
-                    content TEXT,
-                    section VARCHAR(100) NOT NULL,
-                    subject VARCHAR(100) NOT NULL,
-                    week_number INTEGER NOT NULL,
-                    date_published TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    content_type VARCHAR(50) DEFAULT 'text',
-                    difficulty_level VARCHAR(20) DEFAULT 'medium',
-                    estimated_duration INTEGER DEFAULT 30,
-                    content_hash VARCHAR(64),
-                    has_files BOOLEAN DEFAULT FALSE,
-                    last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    view_count INTEGER DEFAULT 0
-                );
-            ''')
+            '''
+                    CREATE TABLE IF NOT EXISTS materials (
+                        id SERIAL PRIMARY KEY,
+                        title VARCHAR(500) NOT NULL,
+                        description TEXT,
+                        content TEXT,
+                        section VARCHAR(100) NOT NULL,
+                        subject VARCHAR(100) NOT NULL,
+                        week_number INTEGER NOT NULL,
+                        date_published TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        is_active BOOLEAN DEFAULT TRUE,
+                        content_type VARCHAR(50) DEFAULT 'text',
+                        difficulty_level VARCHAR(20) DEFAULT 'medium',
+                        estimated_duration INTEGER DEFAULT 30,
+                        content_hash VARCHAR(64),
+                        has_files BOOLEAN DEFAULT FALSE,
+                        last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        view_count INTEGER DEFAULT 0
+                    );
+            ''',
             
-                await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_materials_section_week ON materials(section, week_number);
-                CREATE INDEX IF NOT EXISTS idx_materials_hash ON materials(content_hash);
-            ''')
+            '''
+                    CREATE INDEX IF NOT EXISTS idx_materials_section_week ON materials(section, week_number);
+                    CREATE INDEX IF NOT EXISTS idx_materials_hash ON materials(content_hash);
+            ''',
             
             # Quizzes table
-                await conn.execute('''
-                CREATE TABLE IF NOT EXISTS quizzes (
-                    id SERIAL PRIMARY KEY,
-                    title VARCHAR(500) NOT NULL,
-                    description TEXT,
-                    section VARCHAR(100) NOT NULL,
-                    subject VARCHAR(100) NOT NULL,
-                    time_limit INTEGER DEFAULT 30,
-                    max_attempts INTEGER DEFAULT 3,
-                    passing_score INTEGER DEFAULT 60,
-                    total_points FLOAT DEFAULT 0,
-                    total_questions INTEGER DEFAULT 0,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    randomize_questions BOOLEAN DEFAULT FALSE,
-                    show_results_immediately BOOLEAN DEFAULT TRUE,
-                    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    difficulty_level VARCHAR(20) DEFAULT 'medium',
-                    available_from_week INTEGER DEFAULT 1,
-                    quiz_type VARCHAR(20) DEFAULT 'regular',
-                    week_number INTEGER,
-                    start_week INTEGER,
-                    end_week INTEGER
-                );
-            ''')
+            '''
+                    CREATE TABLE IF NOT EXISTS quizzes (
+                        id SERIAL PRIMARY KEY,
+                        title VARCHAR(500) NOT NULL,
+                        description TEXT,
+                        section VARCHAR(100) NOT NULL,
+                        subject VARCHAR(100) NOT NULL,
+                        time_limit INTEGER DEFAULT 30,
+                        max_attempts INTEGER DEFAULT 3,
+                        passing_score INTEGER DEFAULT 60,
+                        total_points FLOAT DEFAULT 0,
+                        total_questions INTEGER DEFAULT 0,
+                        is_active BOOLEAN DEFAULT TRUE,
+                        randomize_questions BOOLEAN DEFAULT FALSE,
+                        show_results_immediately BOOLEAN DEFAULT TRUE,
+                        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        difficulty_level VARCHAR(20) DEFAULT 'medium',
+                        available_from_week INTEGER DEFAULT 1,
+                        quiz_type VARCHAR(20) DEFAULT 'regular',
+                        week_number INTEGER,
+                        start_week INTEGER,
+                        end_week INTEGER
+                    );
+            ''',
             
-                await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_quizzes_type_week ON quizzes(quiz_type, week_number);
-                CREATE INDEX IF NOT EXISTS idx_quizzes_section_week ON quizzes(section, week_number);
-            ''')
+            '''
+                    CREATE INDEX IF NOT EXISTS idx_quizzes_type_week ON quizzes(quiz_type, week_number);
+                    CREATE INDEX IF NOT EXISTS idx_quizzes_section_week ON quizzes(section, week_number);
+            ''',
             
             # Questions table
-                await conn.execute('''
-                CREATE TABLE IF NOT EXISTS questions (
-                    id SERIAL PRIMARY KEY,
-                    quiz_id INTEGER REFERENCES quizzes(id) ON DELETE CASCADE,
-                    question_text TEXT NOT NULL,
-                    question_type VARCHAR(50) NOT NULL,
-                    options JSONB,
-                    correct_answer TEXT,
-                    explanation TEXT,
-                    points FLOAT DEFAULT 1,
-                    order_index INTEGER DEFAULT 0,
-                    is_required BOOLEAN DEFAULT TRUE,
-                    difficulty VARCHAR(20) DEFAULT 'medium'
-                );
-            ''')
+            '''
+                    CREATE TABLE IF NOT EXISTS questions (
+                        id SERIAL PRIMARY KEY,
+                        quiz_id INTEGER REFERENCES quizzes(id) ON DELETE CASCADE,
+                        question_text TEXT NOT NULL,
+                        question_type VARCHAR(50) NOT NULL,
+                        options JSONB,
+                        correct_answer TEXT,
+                        explanation TEXT,
+                        points FLOAT DEFAULT 1,
+                        order_index INTEGER DEFAULT 0,
+                        is_required BOOLEAN DEFAULT TRUE,
+                        difficulty VARCHAR(20) DEFAULT 'medium'
+                    );
+            ''',
             
-                await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_questions_quiz ON questions(quiz_id);
-            ''')
+            '''
+                    CREATE INDEX IF NOT EXISTS idx_questions_quiz ON questions(quiz_id);
+            ''',
             
             # Quiz attempts table
-                await conn.execute('''
-                CREATE TABLE IF NOT EXISTS quiz_attempts (
-                    id SERIAL PRIMARY KEY,
-                    student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
-                    quiz_id INTEGER REFERENCES quizzes(id) ON DELETE CASCADE,
-                    start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    end_time TIMESTAMP,
-                    status VARCHAR(20) DEFAULT 'in_progress',
-                    total_score FLOAT DEFAULT 0,
-                    points_earned FLOAT DEFAULT 0,
-                    passed BOOLEAN DEFAULT FALSE,
-                    attempt_number INTEGER DEFAULT 1,
-                    answers_data JSONB
-                );
-            ''')
+            '''
+                    CREATE TABLE IF NOT EXISTS quiz_attempts (
+                        id SERIAL PRIMARY KEY,
+                        student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
+                        quiz_id INTEGER REFERENCES quizzes(id) ON DELETE CASCADE,
+                        start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        end_time TIMESTAMP,
+                        status VARCHAR(20) DEFAULT 'in_progress',
+                        total_score FLOAT DEFAULT 0,
+                        points_earned FLOAT DEFAULT 0,
+                        passed BOOLEAN DEFAULT FALSE,
+                        attempt_number INTEGER DEFAULT 1,
+                        answers_data JSONB
+                    );
+            ''',
             
-                await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_quiz_attempts_student ON quiz_attempts(student_id);
-                CREATE INDEX IF NOT EXISTS idx_quiz_attempts_quiz ON quiz_attempts(quiz_id);
-            ''')
+            '''
+                    CREATE INDEX IF NOT EXISTS idx_quiz_attempts_student ON quiz_attempts(student_id);
+                    CREATE INDEX IF NOT EXISTS idx_quiz_attempts_quiz ON quiz_attempts(quiz_id);
+            ''',
             
             # Student activities table
-                await conn.execute('''
-                CREATE TABLE IF NOT EXISTS student_activities (
-                    id SERIAL PRIMARY KEY,
-                    student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
-                    activity_type VARCHAR(50) NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    metadata JSONB,
-                    session_id VARCHAR(100)
-                );
-            ''')
+            '''
+                    CREATE TABLE IF NOT EXISTS student_activities (
+                        id SERIAL PRIMARY KEY,
+                        student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
+                        activity_type VARCHAR(50) NOT NULL,
+                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        metadata JSONB,
+                        session_id VARCHAR(100),
+                        week INTEGER
+                    );
+            ''',
             
-                await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_activities_student ON student_activities(student_id);
-                CREATE INDEX IF NOT EXISTS idx_activities_timestamp ON student_activities(timestamp);
-                CREATE INDEX IF NOT EXISTS idx_activities_type ON student_activities(activity_type);
-            ''')
+            # Older deployments predate the week column
+            '''
+                    ALTER TABLE student_activities ADD COLUMN IF NOT EXISTS week INTEGER;
+            ''',
+            
+            # Student activity indexes
+            '''
+                    CREATE INDEX IF NOT EXISTS idx_activities_student ON student_activities(student_id);
+                    CREATE INDEX IF NOT EXISTS idx_activities_timestamp ON student_activities(timestamp);
+                    CREATE INDEX IF NOT EXISTS idx_activities_type ON student_activities(activity_type);
+                    DROP INDEX IF EXISTS idx_activities_student_type_week;
+                    CREATE INDEX IF NOT EXISTS idx_activities_student_type_week_col
+                        ON student_activities(student_id, activity_type, week) WHERE week IS NOT NULL;
+            ''',
             
             # Material files table
-                await conn.execute('''
-                CREATE TABLE IF NOT EXISTS material_files (
-                    id SERIAL PRIMARY KEY,
-                    material_id INTEGER REFERENCES materials(id) ON DELETE CASCADE,
-                    original_filename VARCHAR(255) NOT NULL,
-                    stored_filename VARCHAR(255) NOT NULL,
-                    file_path TEXT NOT NULL,
-                    file_size INTEGER NOT NULL,
-                    file_type VARCHAR(10),
-                    mime_type VARCHAR(100),
-                    upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    file_hash VARCHAR(64)
-                );
-            ''')
+            '''
+                    CREATE TABLE IF NOT EXISTS material_files (
+                        id SERIAL PRIMARY KEY,
+                        material_id INTEGER REFERENCES materials(id) ON DELETE CASCADE,
+                        original_filename VARCHAR(255) NOT NULL,
+                        stored_filename VARCHAR(255) NOT NULL,
+                        file_path TEXT NOT NULL,
+                        file_size INTEGER NOT NULL,
+                        file_type VARCHAR(10),
+                        mime_type VARCHAR(100),
+                        upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        file_hash VARCHAR(64)
+                    );
+            ''',
             
+            # Applied-schema hashes and one-time data migrations
+            '''
+                    CREATE TABLE IF NOT EXISTS schema_version (hash TEXT PRIMARY KEY);
+                    CREATE TABLE IF NOT EXISTS migrations (
+                        name TEXT PRIMARY KEY,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+            ''',
+        ]
+        
+        # One multi-statement script; its hash in schema_version means it already ran
+        ddl = ";\n".join(statements)
+        digest = hashlib.sha256(ddl.encode()).hexdigest()
+        
+        try:
+            async with self.get_connection() as conn:
+                try:
+                    applied = await conn.fetchval('SELECT 1 FROM schema_version WHERE hash = $1', digest)
+                except asyncpg.UndefinedTableError:
+                    applied = None
+                
+                if applied:
+                    logger.info("Database schema unchanged, skipping table creation")
+                    return
+                
+                async with conn.transaction():
+                    await conn.execute(ddl)
+                    
+                    # One-time backfill of the week column from metadata (older deployments)
+                    first_run = await conn.fetchval(
+                        'INSERT INTO migrations (name) VALUES ($1) ON CONFLICT DO NOTHING RETURNING 1',
+                        'backfill:student_activities.week'
+                    )
+                    if first_run:
+                        await conn.execute('''
+                            UPDATE student_activities SET week = (metadata->>'week')::int
+                            WHERE week IS NULL AND metadata->>'week' ~ '^[0-9]{1,9}$'
+                        ''')
+                    
+                    await conn.execute('INSERT INTO schema_version VALUES ($1) ON CONFLICT DO NOTHING', digest)
+                
                 logger.info("All database tables created successfully")
                 
         except Exception as e:
@@ -345,13 +462,19 @@ class PostgreSQLManager:
 
     # Material operations
     async def create_material(self, material_data: Dict[str, Any]) -> int:
-        """Create a new material"""
+        """Create a new material, or return the id of one already stored with the same content hash"""
         async with self.get_connection() as conn:
             query = '''
-                INSERT INTO materials (title, description, content, section, subject, week_number, 
-                                     content_type, difficulty_level, estimated_duration, content_hash)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
-                RETURNING id
+                WITH existing AS (
+                    SELECT id FROM materials WHERE content_hash = $10 ORDER BY id LIMIT 1
+                ), inserted AS (
+                    INSERT INTO materials (title, description, content, section, subject, week_number, 
+                                         content_type, difficulty_level, estimated_duration, content_hash)
+                    SELECT $1, $2, $3, $4, $5, $6, $7, $8, $9, $10
+                    WHERE NOT EXISTS (SELECT 1 FROM existing)
+                    RETURNING id
+                )
+                SELECT id FROM inserted UNION ALL SELECT id FROM existing
             '''
             material_id = await conn.fetchval(
                 query,
@@ -368,11 +491,85 @@ class PostgreSQLManager:
             )
             return material_id
 
+    async def bulk_insert_materials(self, materials: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Insert many materials in one statement, returning content_hash -> id
+        (rows whose content hash is already stored are skipped and left out of the result)"""
+        async with self.get_connection() as conn:
+            query = '''
+                INSERT INTO materials (title, description, content, section, subject, week_number,
+                                     content_type, difficulty_level, estimated_duration, content_hash,
+                                     date_published)
+                SELECT * FROM unnest($1::varchar[], $2::text[], $3::text[], $4::varchar[], $5::varchar[],
+                                     $6::int[], $7::varchar[], $8::varchar[], $9::int[], $10::varchar[],
+                                     $11::timestamp[])
+                    AS u(title, description, content, section, subject, week_number, content_type,
+                         difficulty_level, estimated_duration, content_hash, date_published)
+                WHERE NOT EXISTS (SELECT 1 FROM materials m WHERE m.content_hash = u.content_hash)
+                RETURNING id, content_hash
+            '''
+            rows = await conn.fetch(
+                query,
+                [m['title'] for m in materials],
+                [m.get('description', '') for m in materials],
+                [m.get('content', '') for m in materials],
+                [m['section'] for m in materials],
+                [m['subject'] for m in materials],
+                [m['week_number'] for m in materials],
+                [m.get('content_type', 'text') for m in materials],
+                [m.get('difficulty_level', 'medium') for m in materials],
+                [m.get('estimated_duration', 30) for m in materials],
+                [m.get('content_hash', '') for m in materials],
+                [m.get('date_published') or datetime.now() for m in materials]
+            )
+            return {row['content_hash']: row['id'] for row in rows}
+
+    async def get_all_material_hashes(self) -> List[str]:
+        """Get every stored material content hash"""
+        async with self.get_connection() as conn:
+            rows = await conn.fetch('SELECT DISTINCT content_hash FROM materials WHERE content_hash IS NOT NULL')
+            return [row['content_hash'] for row in rows]
+
+    async def get_materials_by_hashes(self, content_hashes: List[str]) -> Dict[str, int]:
+        """Get ids of existing materials for many content hashes"""
+        async with self.get_connection() as conn:
+            query = '''
+                SELECT DISTINCT ON (content_hash) content_hash, id FROM materials
+                WHERE content_hash = ANY($1::varchar[])
+                ORDER BY content_hash, id
+            '''
+            rows = await conn.fetch(query, content_hashes)
+            return {row['content_hash']: row['id'] for row in rows}
+
+    async def get_material_hash_fields(self) -> List[Dict[str, Any]]:
+        """Get id, hashed fields and stored content hash of every material"""
+        async with self.get_connection() as conn:
+            rows = await conn.fetch('SELECT id, title, content, section, content_hash FROM materials')
+            return [dict(row) for row in rows]
+
+    async def update_material_hashes(self, updates: List[tuple]):
+        """Rewrite content hashes as (content_hash, material_id) rows"""
+        if not updates:
+            return
+        
+        async with self.get_connection() as conn:
+            await conn.executemany('UPDATE materials SET content_hash = $1 WHERE id = $2', updates)
+
+    async def migration_applied(self, name: str) -> bool:
+        """Check whether a one-time data migration is recorded in migrations"""
+        async with self.get_connection() as conn:
+            return bool(await conn.fetchval('SELECT 1 FROM migrations WHERE name = $1', name))
+
+    async def record_migration(self, name: str):
+        """Mark a one-time data migration as done"""
+        async with self.get_connection() as conn:
+            await conn.execute('INSERT INTO migrations (name) VALUES ($1) ON CONFLICT DO NOTHING', name)
+
     async def get_materials_by_section_and_week(self, section: str, week_number: int) -> List[Dict[str, Any]]:
         """Get materials for section and week"""
         async with self.get_connection() as conn:
             query = '''
-                SELECT * FROM materials 
+                SELECT *, EXTRACT(EPOCH FROM date_published)::float8 AS date_published_ts
+                FROM materials 
                 WHERE section = $1 AND week_number = $2 AND is_active = TRUE
                 ORDER BY date_published DESC
             '''
@@ -382,10 +579,85 @@ class PostgreSQLManager:
     async def get_material_by_id(self, material_id: int) -> Optional[Dict[str, Any]]:
         """Get material by ID"""
         async with self.get_connection() as conn:
-            query = 'SELECT * FROM materials WHERE id = $1'
+            query = '''
+                SELECT *, EXTRACT(EPOCH FROM date_published)::float8 AS date_published_ts
+                FROM materials WHERE id = $1
+            '''
             row = await conn.fetchrow(query, material_id)
             return dict(row) if row else None
 
+    async def get_material_files_bulk(self, material_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """Get files for many materials, keyed by material_id"""
+        async with self.get_connection() as conn:
+            query = '''
+                SELECT * FROM material_files
+                WHERE material_id = ANY($1::int[])
+                ORDER BY material_id, upload_date
+            '''
+            rows = await conn.fetch(query, material_ids)
+            files_map: Dict[int, List[Dict[str, Any]]] = {}
+            for row in rows:
+                files_map.setdefault(row['material_id'], []).append(dict(row))
+            return files_map
+
+    async def get_material_view_stats_bulk(self, material_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Get view counts for many materials, keyed by material_id"""
+        async with self.get_connection() as conn:
+            # Compared as text so a non-integer material_id in any row cannot fail the cast
+            query = '''
+                SELECT metadata->>'material_id' AS material_id,
+                       COUNT(*) AS view_count,
+                       COUNT(DISTINCT student_id) AS unique_viewers
+                FROM student_activities
+                WHERE activity_type = 'view_material'
+                AND metadata->>'material_id' = ANY($1::text[])
+                GROUP BY 1
+            '''
+            rows = await conn.fetch(query, [str(material_id) for material_id in material_ids])
+            return {
+                int(row['material_id']): {
+                    'view_count': row['view_count'],
+                    'unique_viewers': row['unique_viewers']
+                }
+                for row in rows
+            }
+
+    async def create_material_file_and_touch(self, file_info: Dict[str, Any]) -> int:
+        """Insert a material file and flag its material as having files, in one statement"""
+        async with self.get_connection() as conn:
+            query = '''
+                WITH new_file AS (
+                    INSERT INTO material_files (material_id, original_filename, stored_filename, file_path,
+                                                file_size, file_type, mime_type, upload_date, file_hash)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                    RETURNING id, material_id
+                ), touched AS (
+                    UPDATE materials SET has_files = TRUE, last_modified = $8
+                    WHERE id = (SELECT material_id FROM new_file)
+                )
+                SELECT id FROM new_file
+            '''
+            return await conn.fetchval(
+                query,
+                file_info['material_id'],
+                file_info['original_filename'],
+                file_info['stored_filename'],
+                file_info['file_path'],
+                file_info['file_size'],
+                file_info.get('file_type'),
+                file_info.get('mime_type'),
+                file_info.get('upload_date') or datetime.now(),
+                file_info.get('file_hash')
+            )
+
+    async def delete_material_files_bulk(self, file_ids: List[int]) -> int:
+        """Delete many material file records, returning the number removed"""
+        async with self.get_connection() as conn:
+            result = await conn.execute(
+                'DELETE FROM material_files WHERE id = ANY($1::int[])', file_ids
+            )
+            return int(result.split()[-1])
+
     # Quiz operations
     async def create_quiz(self, quiz_data: Dict[str, Any]) -> int:
         """Create a new quiz"""
@@ -393,8 +665,9 @@ class PostgreSQLManager:
             query = '''
                 INSERT INTO quizzes (title, description, section, subject, time_limit, 
                                    max_attempts, passing_score, total_points, is_active,
-                                   randomize_questions, show_results_immediately, difficulty_level)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
+                                   randomize_questions, show_results_immediately, difficulty_level,
+                                   total_questions)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13)
                 RETURNING id
             '''
             quiz_id = await conn.fetchval(
@@ -410,10 +683,66 @@ class PostgreSQLManager:
                 quiz_data.get('is_active', True),
                 quiz_data.get('randomize_questions', False),
                 quiz_data.get('show_results_immediately', True),
-                quiz_data.get('difficulty_level', 'medium')
+                quiz_data.get('difficulty_level', 'medium'),
+                quiz_data.get('total_questions', 0)
             )
             return quiz_id
 
+    async def create_quiz_bundle(self, quiz_data: Dict[str, Any], questions: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Create a quiz, its questions and totals in one statement, returning the quiz row"""
+        async with self.get_connection() as conn:
+            query = '''
+                WITH q AS (
+                    INSERT INTO quizzes (title, description, section, subject, time_limit, max_attempts,
+                                       passing_score, total_points, total_questions, difficulty_level,
+                                       quiz_type, week_number, start_week, end_week)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14)
+                    RETURNING *
+                ), ins AS (
+                    INSERT INTO questions (quiz_id, question_text, question_type, options,
+                                         correct_answer, explanation, points, order_index, difficulty)
+                    SELECT q.id, x.question_text, x.question_type, x.options::jsonb,
+                           x.correct_answer, x.explanation, x.points, x.order_index, x.difficulty
+                    FROM q, jsonb_to_recordset($15::jsonb) AS x(
+                        question_text text, question_type text, options text, correct_answer text,
+                        explanation text, points float, order_index int, difficulty text
+                    )
+                )
+                SELECT * FROM q
+            '''
+            questions_json = json.dumps([
+                {
+                    'question_text': question_data['question_text'],
+                    'question_type': question_data['question_type'],
+                    'options': self._options_json(question_data.get('options', {})),
+                    'correct_answer': question_data.get('correct_answer', ''),
+                    'explanation': question_data.get('explanation', ''),
+                    'points': question_data.get('points', 1),
+                    'order_index': question_data.get('order_index', 0),
+                    'difficulty': question_data.get('difficulty', 'medium')
+                }
+                for question_data in questions
+            ], ensure_ascii=False)
+            row = await conn.fetchrow(
+                query,
+                quiz_data['title'],
+                quiz_data.get('description', ''),
+                quiz_data['section'],
+                quiz_data['subject'],
+                quiz_data.get('time_limit', 30),
+                quiz_data.get('max_attempts', 3),
+                quiz_data.get('passing_score', 60),
+                sum(question_data.get('points', 1) for question_data in questions),
+                len(questions),
+                quiz_data.get('difficulty_level', 'medium'),
+                quiz_data.get('quiz_type', 'regular'),
+                quiz_data.get('week_number'),
+                quiz_data.get('start_week'),
+                quiz_data.get('end_week'),
+                questions_json
+            )
+            return dict(row)
+
     async def get_active_quizzes_by_section(self, section: str) -> List[Dict[str, Any]]:
         """Get active quizzes for section"""
         async with self.get_connection() as conn:
@@ -436,32 +765,28 @@ class PostgreSQLManager:
     async def log_activity(self, student_id: int, activity_type: str, metadata: Dict[str, Any] = None):
         """Log student activity"""
         async with self.get_connection() as conn:
+            metadata = metadata or {}
+            week = metadata.get('week')
             query = '''
-                INSERT INTO student_activities (student_id, activity_type, metadata)
-                VALUES ($1, $2, $3)
+                INSERT INTO student_activities (student_id, activity_type, metadata, week)
+                VALUES ($1, $2, $3, $4)
             '''
-            await conn.execute(query, student_id, activity_type, json.dumps(metadata or {}))
+            await conn.execute(query, student_id, activity_type, json.dumps(metadata),
+                               week if isinstance(week, int) else None)
 
-    async def bulk_insert_activities(self, activities: List[Dict[str, Any]]):
-        """Bulk insert activities"""
+    async def bulk_insert_activities(self, activities: List[tuple]):
+        """Bulk insert activities as (student_id, activity_type, timestamp, metadata_json, session_id) rows"""
         if not activities:
             return
         
         async with self.get_connection() as conn:
+            # week is derived from the metadata here so rows never need a later backfill
             query = '''
-                INSERT INTO student_activities (student_id, activity_type, metadata, session_id)
-                VALUES ($1, $2, $3, $4)
+                INSERT INTO student_activities (student_id, activity_type, timestamp, metadata, session_id, week)
+                VALUES ($1, $2, $3, $4::jsonb, $5,
+                        CASE WHEN $4::jsonb->>'week' ~ '^[0-9]{1,9}$' THEN ($4::jsonb->>'week')::int END)
             '''
-            values = [
-                (
-                    activity['student_id'],
-                    activity['activity_type'],
-                    activity.get('metadata', '{}'),
-                    activity.get('session_id')
-                )
-                for activity in activities
-            ]
-            await conn.executemany(query, values)
+            await conn.executemany(query, activities)
 
     # Statistics and analytics
     async def get_user_statistics(self) -> Dict[str, Any]:
@@ -560,6 +885,37 @@ class PostgreSQLManager:
             rows = await conn.fetch(query)
             return [dict(row) for row in rows]
 
+    async def get_inactive_students_count(self, days: int = 7) -> int:
+        """Count students inactive for specified days"""
+        async with self.get_connection() as conn:
+            query = '''
+                SELECT COUNT(*) FROM students
+                WHERE is_active = TRUE
+                AND last_activity < CURRENT_TIMESTAMP - make_interval(days => $1)
+            '''
+            return await conn.fetchval(query, days)
+
+    async def get_declining_performance_count(self) -> int:
+        """Count students whose last 3 scores average 5+ points below their earlier ones (last 10)"""
+        async with self.get_connection() as conn:
+            query = '''
+                WITH ranked AS (
+                    SELECT student_id, total_score,
+                           ROW_NUMBER() OVER (PARTITION BY student_id ORDER BY end_time DESC) AS rn
+                    FROM quiz_attempts
+                    WHERE status = 'completed'
+                )
+                SELECT COUNT(*) FROM (
+                    SELECT student_id FROM ranked
+                    WHERE rn <= 10
+                    GROUP BY student_id
+                    HAVING COUNT(*) > 3
+                    AND AVG(total_score) FILTER (WHERE rn <= 3)
+                        < AVG(total_score) FILTER (WHERE rn > 3) - 5
+                ) declining
+            '''
+            return await conn.fetchval(query)
+
     # Additional methods for production features
     async def create_question(self, question_data: Dict[str, Any]) -> int:
         """Create a quiz question"""
@@ -575,7 +931,7 @@ class PostgreSQLManager:
                 question_data['quiz_id'],
                 question_data['question_text'],
                 question_data['question_type'],
-                json.dumps(question_data.get('options', {})),
+                self._options_json(question_data.get('options', {})),
                 question_data.get('correct_answer', ''),
                 question_data.get('explanation', ''),
                 question_data.get('points', 1),
@@ -584,6 +940,34 @@ class PostgreSQLManager:
             )
             return question_id
 
+    @staticmethod
+    def _options_json(options: Union[Dict[str, Any], str]) -> str:
+        """JSONB text for question options; pre-serialized strings pass through"""
+        return options if isinstance(options, str) else json.dumps(options)
+
+    async def bulk_create_questions(self, questions: List[Dict[str, Any]]):
+        """Create many quiz questions with a single executemany"""
+        async with self.get_connection() as conn:
+            query = '''
+                INSERT INTO questions (quiz_id, question_text, question_type, options, 
+                                     correct_answer, explanation, points, order_index, difficulty)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+            '''
+            await conn.executemany(query, [
+                (
+                    question_data['quiz_id'],
+                    question_data['question_text'],
+                    question_data['question_type'],
+                    self._options_json(question_data.get('options', {})),
+                    question_data.get('correct_answer', ''),
+                    question_data.get('explanation', ''),
+                    question_data.get('points', 1),
+                    question_data.get('order_index', 0),
+                    question_data.get('difficulty', 'medium')
+                )
+                for question_data in questions
+            ])
+
     async def create_quiz_attempt(self, attempt_data: Dict[str, Any]) -> int:
         """Create a quiz attempt"""
         async with self.get_connection() as conn:
@@ -602,6 +986,63 @@ class PostgreSQLManager:
             )
             return attempt_id
     
+    async def get_attempt_context(self, attempt_id: int) -> Optional[Dict[str, Any]]:
+        """Get a quiz attempt together with its quiz's time limit"""
+        async with self.get_connection() as conn:
+            query = '''
+                SELECT qa.*, q.time_limit
+                FROM quiz_attempts qa
+                JOIN quizzes q ON q.id = qa.quiz_id
+                WHERE qa.id = $1
+            '''
+            row = await conn.fetchrow(query, attempt_id)
+            return dict(row) if row else None
+    
+    async def get_student_attempt_stats(self, student_id: int, quiz_id: int) -> Dict[str, Any]:
+        """Get a student's attempt count for a quiz and whether one is still in progress"""
+        async with self.get_connection() as conn:
+            query = '''
+                SELECT COUNT(*) AS attempt_count,
+                       COALESCE(bool_or(status = 'in_progress'), FALSE) AS has_active
+                FROM quiz_attempts
+                WHERE student_id = $1 AND quiz_id = $2
+            '''
+            row = await conn.fetchrow(query, student_id, quiz_id)
+            return dict(row)
+    
+    async def get_attempt_summary(self, attempt_id: int) -> Dict[str, Any]:
+        """Get answer count, correct count and points for an attempt, aggregated from answers_data"""
+        async with self.get_connection() as conn:
+            query = '''
+                SELECT COUNT(a.answer) AS total_questions,
+                       COUNT(*) FILTER (WHERE (a.answer->>'is_correct')::boolean) AS correct_answers,
+                       COALESCE(SUM((a.answer->>'points_earned')::float8), 0) AS points_earned
+                FROM quiz_attempts qa
+                LEFT JOIN LATERAL jsonb_array_elements(
+                    CASE WHEN jsonb_typeof(qa.answers_data) = 'array' THEN qa.answers_data ELSE '[]'::jsonb END
+                ) AS a(answer) ON TRUE
+                WHERE qa.id = $1
+            '''
+            row = await conn.fetchrow(query, attempt_id)
+            return dict(row)
+    
+    async def get_quiz_analytics(self, quiz_id: int) -> Dict[str, Any]:
+        """Get attempt totals, average score, pass rate and completion time for a quiz in one scan"""
+        async with self.get_connection() as conn:
+            query = '''
+                SELECT COUNT(*) AS total_attempts,
+                       COUNT(*) FILTER (WHERE status = 'completed') AS completed_attempts,
+                       COALESCE(AVG(total_score) FILTER (WHERE status = 'completed'), 0)::float8 AS average_score,
+                       COALESCE(AVG(passed::int) FILTER (WHERE status = 'completed') * 100, 0)::float8 AS pass_rate,
+                       COALESCE(AVG(EXTRACT(EPOCH FROM end_time - start_time) / 60)
+                                FILTER (WHERE status = 'completed' AND end_time IS NOT NULL), 0)::float8
+                           AS average_completion_time
+                FROM quiz_attempts
+                WHERE quiz_id = $1
+            '''
+            row = await conn.fetchrow(query, quiz_id)
+            return dict(row)
+    
     # Learning progression methods
     async def get_student_activities_by_type(self, student_id: int, activity_type: str) -> List[Dict[str, Any]]:
         """Get student activities filtered by type"""
@@ -614,6 +1055,64 @@ class PostgreSQLManager:
             rows = await conn.fetch(query, student_id, activity_type)
             return [dict(row) for row in rows]
     
+    async def student_activity_exists(self, student_id: int, activity_type: str, week: int) -> bool:
+        """Check whether a student has an activity of this type for a week"""
+        async with self.get_connection() as conn:
+            query = '''
+                SELECT EXISTS(
+                    SELECT 1 FROM student_activities
+                    WHERE student_id = $1 AND activity_type = $2 AND week = $3
+                )
+            '''
+            return await conn.fetchval(query, student_id, activity_type, week)
+    
+    async def get_student_phase_state(self, student_id: int) -> Optional[Dict[str, Any]]:
+        """Get a student's actual week and its three completion flags in one round trip"""
+        async with self.get_connection() as conn:
+            query = '''
+                WITH s AS (
+                    SELECT LEAST(COALESCE(current_week, 1), COALESCE(completed_weeks, 0) + 1) AS week
+                    FROM students WHERE id = $1
+                )
+                SELECT s.week,
+                       EXISTS(SELECT 1 FROM student_activities a
+                              WHERE a.student_id = $1 AND a.activity_type = 'content_completed'
+                              AND a.week = s.week) AS content_completed,
+                       EXISTS(SELECT 1 FROM student_activities a
+                              WHERE a.student_id = $1 AND a.activity_type = 'weekly_quiz_completed'
+                              AND a.week = s.week) AS weekly_quiz_completed,
+                       EXISTS(SELECT 1 FROM student_activities a
+                              WHERE a.student_id = $1 AND a.activity_type = 'cumulative_quiz_completed'
+                              AND a.week = s.week) AS cumulative_quiz_completed
+                FROM s
+            '''
+            row = await conn.fetchrow(query, student_id)
+            return dict(row) if row else None
+    
+    async def get_week_completion_bulk(self, student_ids: List[int], week: int) -> Dict[int, Dict[str, bool]]:
+        """Get week completion flags for many students in one scan, keyed by student_id"""
+        async with self.get_connection() as conn:
+            query = '''
+                SELECT student_id,
+                       bool_or(activity_type = 'content_completed') AS content_completed,
+                       bool_or(activity_type = 'weekly_quiz_completed') AS weekly_quiz_completed,
+                       bool_or(activity_type = 'cumulative_quiz_completed') AS cumulative_quiz_completed
+                FROM student_activities
+                WHERE student_id = ANY($1::int[])
+                AND activity_type IN ('content_completed', 'weekly_quiz_completed', 'cumulative_quiz_completed')
+                AND week = $2
+                GROUP BY student_id
+            '''
+            rows = await conn.fetch(query, student_ids, week)
+            return {
+                row['student_id']: {
+                    'content_completed': row['content_completed'],
+                    'weekly_quiz_completed': row['weekly_quiz_completed'],
+                    'cumulative_quiz_completed': row['cumulative_quiz_completed']
+                }
+                for row in rows
+            }
+    
     async def get_student_recent_activities(self, student_id: int, days: int = 7) -> List[Dict[str, Any]]:
         """Get recent student activities"""
         async with self.get_connection() as conn:
@@ -626,6 +1125,53 @@ class PostgreSQLManager:
             rows = await conn.fetch(query, student_id)
             return [dict(row) for row in rows]
     
+    async def get_student_quiz_results(self, student_id: int, quiz_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get completed quiz attempts for a student with quiz title and subject"""
+        rows = await self.fetch_prepared('student_quiz_results', student_id, quiz_id)
+        return [dict(row) for row in rows]
+    
+    async def get_student_recent_quiz_scores(self, student_id: int, limit: int = 10) -> List[float]:
+        """Get the latest completed quiz scores for a student, oldest first"""
+        rows = await self.fetch_prepared('student_recent_quiz_scores', student_id, limit)
+        return [row['total_score'] for row in rows]
+    
+    async def get_student_activities(self, student_id: int, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
+        """Get student activities within a date range"""
+        rows = await self.fetch_prepared('student_activities', student_id, start_date, end_date)
+        return [dict(row) for row in rows]
+    
+    async def get_student_material_views(self, student_id: int) -> List[Dict[str, Any]]:
+        """Get material view activities for a student with material subject"""
+        rows = await self.fetch_prepared('student_material_views', student_id)
+        return [dict(row) for row in rows]
+    
+    async def get_student_streaks(self, student_id: int, days: int = 60) -> Dict[str, Any]:
+        """Get current and longest daily activity streaks (gaps-and-islands over distinct days)"""
+        async with self.get_connection() as conn:
+            query = '''
+                WITH days AS (
+                    SELECT DISTINCT DATE(timestamp) AS d FROM student_activities
+                    WHERE student_id = $1
+                    AND timestamp >= CURRENT_TIMESTAMP - make_interval(days => $2)
+                ),
+                runs AS (
+                    SELECT MAX(d) AS end_day, COUNT(*) AS length
+                    FROM (SELECT d, d - (ROW_NUMBER() OVER (ORDER BY d))::int AS grp FROM days) g
+                    GROUP BY grp
+                )
+                SELECT
+                    COALESCE(MAX(length), 0) AS longest_streak,
+                    COALESCE((
+                        SELECT length FROM runs
+                        WHERE end_day >= CURRENT_DATE - 1
+                        ORDER BY end_day DESC LIMIT 1
+                    ), 0) AS current_streak,
+                    MAX(end_day) AS last_activity
+                FROM runs
+            '''
+            row = await conn.fetchrow(query, student_id, days)
+            return dict(row) if row else {'current_streak': 0, 'longest_streak': 0, 'last_activity': None}
+
     async def get_quiz_by_type_and_week(self, section: str, quiz_type: str, week_number: int) -> Optional[Dict[str, Any]]:
         """Get quiz by type and week"""
         async with self.get_connection() as conn:
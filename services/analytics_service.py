@@ -1,14 +1,16 @@
 import logging
-from typing import Dict, List, Optional, Any, Union
+from typing import Dict, List, Optional, Any, Union, AsyncIterator, Tuple
 from datetime import datetime, timedelta
 import asyncio
 import json
 import os
-from collections import defaultdict, Counter
+import time
+from collections import defaultdict, Counter, deque
 from dataclasses import dataclass
 from enum import Enum
 
 from models import get_database_manager
+from utils.ttl_cache import TTLCache, register_invalidator, ttl_cached
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +22,7 @@ class ActivityType(Enum):
     REGISTRATION = "registration"
     SETTINGS_CHANGE = "settings_change"
 
-@dataclass
+@dataclass(slots=True)
 class StudentActivity:
     student_id: int
     activity_type: str
@@ -31,46 +33,168 @@ class StudentActivity:
 class AnalyticsService:
     """Service for analytics, progress tracking, and real-time dashboard"""
     
+    # Buffer size is checked once per this many appends (power of two)
+    BUFFER_CHECK_INTERVAL = 64
+    
     def __init__(self, db_manager):
         self.db = db_manager
-        self.activity_buffer = []
+        self.activity_buffer: deque = deque()
         # Production-optimized buffer size for 7000+ users
         self.buffer_size = int(os.getenv('ANALYTICS_BUFFER_SIZE', '500'))
         self.max_buffer_size = int(os.getenv('ANALYTICS_MAX_BUFFER_SIZE', '2000'))  # Emergency limit
         self.realtime_subscribers = set()
         self._flush_lock = asyncio.Lock()  # Prevent concurrent flushes
+        self._append_count = 0
+        
+        # Background flusher wakes on a linger timer or when the buffer fills;
+        # the interval backs off when idle and tightens under load
+        self.flush_interval_min = int(os.getenv('ANALYTICS_FLUSH_MIN_INTERVAL_MS', '10')) / 1000
+        self.flush_interval_max = int(os.getenv('ANALYTICS_FLUSH_MAX_INTERVAL_MS', '500')) / 1000
+        self._flush_wake = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+        
+        # Database writes run as tasks so the next batch can be taken while one drains
+        self._flush_slots = asyncio.Semaphore(int(os.getenv('ANALYTICS_MAX_INFLIGHT_FLUSHES', '2')))
+        self._inflight_flushes: set = set()
+        
+        # Free-list of flushed StudentActivity objects reused by log_student_activity
+        self._activity_pool: deque = deque(maxlen=4096)
+        
+        # Real-time notifications are fanned out by a background worker
+        self._notify_queue: asyncio.Queue = asyncio.Queue(maxsize=10000)
+        self._notify_task: Optional[asyncio.Task] = None
+        
+        # Wall-clock anchor for activity timestamps: (monotonic ns, datetime)
+        self._wall_anchor = (time.monotonic_ns(), datetime.now())
+        
+        # Short-lived per-student stats bundle shared by progress and recommendations;
+        # dropped when the student logs activity or completes a quiz
+        self.stats_cache_ttl = int(os.getenv('ANALYTICS_STATS_CACHE_TTL', '60'))
+        self._stats_cache = TTLCache(ttl=self.stats_cache_ttl, maxsize=10000)
+        register_invalidator('student_stats', self.invalidate_student_stats)
+        
+        # Recommendation rules evaluated in order against the stats bundle
+        self._reco_rules = [
+            (lambda s: s['quiz']['average_score'] < 70,
+             "راجع المواد الدراسية قبل حل الاختبارات لتحسين درجاتك"),
+            (lambda s: s['quiz'].get('improvement_trend') == 'declining',
+             "درجاتك في تراجع - حاول التركيز أكثر على المواضيع الصعبة"),
+            (lambda s: s['activity']['activity_level'] == 'low',
+             "حاول زيادة نشاطك اليومي على المنصة لتحقيق أفضل النتائج"),
+            (lambda s: s['material']['total_materials_viewed'] < 5,
+             "استكشف المزيد من المواد التعليمية المتاحة"),
+            (lambda s: bool(self._weak_subjects(s)),
+             lambda s: f"ركز على تحسين أدائك في: {', '.join(self._weak_subjects(s))}"),
+        ]
         
     async def log_student_activity(self, student_id: int, activity_type: str, 
                                  metadata: Optional[Dict[str, Any]] = None, 
                                  session_id: Optional[str] = None):
         """Log student activity for analytics"""
         try:
-            activity = StudentActivity(
-                student_id=student_id,
-                activity_type=activity_type,
-                timestamp=datetime.now(),
-                metadata=metadata or {},
-                session_id=session_id
-            )
+            # Reuse a flushed activity object when one is available
+            if self._activity_pool:
+                activity = self._activity_pool.pop()
+            else:
+                activity = StudentActivity.__new__(StudentActivity)
+            activity.student_id = student_id
+            activity.activity_type = activity_type
+            activity.timestamp = self._now()
+            activity.metadata = metadata or {}
+            activity.session_id = session_id
+            self._stats_cache.invalidate(student_id)
             
             # Add to buffer with overflow protection
             self.activity_buffer.append(activity)
             
-            # Emergency flush if buffer exceeds maximum size
-            if len(self.activity_buffer) >= self.max_buffer_size:
-                logger.warning(f"Analytics buffer overflow: {len(self.activity_buffer)} items, forcing flush")
-                await self._flush_activity_buffer()
-            
-            # Normal flush when buffer reaches target size
-            elif len(self.activity_buffer) >= self.buffer_size:
-                await self._flush_activity_buffer()
+            # Size checks are sampled every BUFFER_CHECK_INTERVAL appends; the
+            # background flusher covers the gap, so limits may overshoot by < 64
+            self._append_count += 1
+            if self._append_count & (self.BUFFER_CHECK_INTERVAL - 1) == 0:
+                buffered = len(self.activity_buffer)
+                
+                # Emergency flush if buffer exceeds maximum size
+                if buffered >= self.max_buffer_size:
+                    logger.warning(f"Analytics buffer overflow: {buffered} items, forcing flush")
+                    await self._flush_activity_buffer()
+                
+                # Wake the background flusher when buffer reaches target size
+                elif buffered >= self.buffer_size:
+                    self._flush_wake.set()
             
-            # Send real-time updates
-            await self._notify_realtime_subscribers(activity)
+            # Hand real-time updates to the notification worker
+            if self.realtime_subscribers:
+                try:
+                    self._notify_queue.put_nowait(activity)
+                except asyncio.QueueFull:
+                    logger.warning("Real-time notification queue full, dropping event")
             
         except Exception as e:
             logger.error(f"Error logging activity: {e}")
 
+    async def start(self):
+        """Start background workers"""
+        if self._flush_task and not self._flush_task.done():
+            return
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        self._notify_task = asyncio.create_task(self._notify_worker())
+        logger.info("Analytics service workers started")
+
+    async def stop(self):
+        """Stop background workers and flush pending activities"""
+        for task in (self._flush_task, self._notify_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        
+        await self._flush_activity_buffer()
+        if self._inflight_flushes:
+            await asyncio.gather(*self._inflight_flushes, return_exceptions=True)
+        logger.info("Analytics service workers stopped")
+
+    async def _flush_loop(self):
+        """Flush the activity buffer on a self-tuning linger interval"""
+        interval = self.flush_interval_min
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wake.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wake.clear()
+            
+            pending = len(self.activity_buffer)
+            if pending:
+                await self._flush_activity_buffer()
+            
+            # Back off while idle, tighten while batches come in full
+            if pending == 0:
+                interval = min(interval * 2, self.flush_interval_max)
+            elif pending >= self.buffer_size:
+                interval = max(interval / 2, self.flush_interval_min)
+
+    async def _notify_worker(self):
+        """Drain the notification queue so subscribers never block producers"""
+        while True:
+            activity = await self._notify_queue.get()
+            try:
+                await self._notify_realtime_subscribers(activity)
+            finally:
+                self._notify_queue.task_done()
+
+    def _now(self) -> datetime:
+        """Current wall-clock time derived from a monotonic anchor refreshed every 100ms"""
+        mono = time.monotonic_ns()
+        anchor_mono, anchor_wall = self._wall_anchor
+        elapsed_ns = mono - anchor_mono
+        if elapsed_ns >= 100_000_000:
+            anchor_wall = datetime.now()
+            self._wall_anchor = (mono, anchor_wall)
+            return anchor_wall
+        return anchor_wall + timedelta(microseconds=elapsed_ns // 1000)
+
     async def get_student_progress(self, student_id: int) -> Dict[str, Any]:
         """Get comprehensive progress data for a student"""
         try:
@@ -79,14 +203,11 @@ class AnalyticsService:
             if not student:
                 return {}
             
-            # Get quiz statistics
-            quiz_stats = await self._get_student_quiz_stats(student_id)
-            
-            # Get material engagement
-            material_stats = await self._get_student_material_stats(student_id)
-            
-            # Get activity patterns
-            activity_stats = await self._get_student_activity_stats(student_id)
+            # Get quiz, material and activity statistics
+            stats = await self._get_cached_stats_bundle(student_id)
+            quiz_stats = stats['quiz']
+            material_stats = stats['material']
+            activity_stats = stats['activity']
             
             # Calculate overall performance metrics
             performance_metrics = await self._calculate_performance_metrics(student_id)
@@ -115,7 +236,7 @@ class AnalyticsService:
                     'overall_score': performance_metrics.get('overall_score', 0),
                     'improvement_trend': performance_metrics.get('improvement_trend', 'stable'),
                     'activity_level': activity_stats.get('activity_level', 'low'),
-                    'recommendations': await self._generate_recommendations(student_id)
+                    'recommendations': self._apply_recommendation_rules(stats)
                 }
             }
             
@@ -176,160 +297,170 @@ class AnalyticsService:
             return {}
 
     async def get_bot_statistics(self) -> Dict[str, Any]:
-        """Get overall bot statistics"""
+        """Get overall bot statistics (cached for 5 seconds; treat as read-only)"""
         try:
-            # User statistics
-            user_stats = await self.db.get_user_statistics()
-            
-            # Content statistics
-            content_stats = await self.db.get_content_statistics()
-            
-            # Quiz statistics
-            quiz_stats = await self.db.get_quiz_statistics()
-            
-            # Activity statistics
-            activity_stats = await self._get_overall_activity_stats()
-            
-            # Performance trends
-            performance_trends = await self._get_performance_trends()
-            
-            # System health metrics
-            system_health = await self._get_system_health_metrics()
-            
-            return {
-                'timestamp': datetime.now().isoformat(),
-                'users': {
-                    'total_registered': user_stats.get('total_users', 0),
-                    'active_today': user_stats.get('active_today', 0),
-                    'active_this_week': user_stats.get('active_this_week', 0),
-                    'new_registrations_today': user_stats.get('new_today', 0),
-                    'sections_distribution': user_stats.get('sections_distribution', {})
-                },
-                'content': {
-                    'total_materials': content_stats.get('total_materials', 0),
-                    'materials_published_today': content_stats.get('published_today', 0),
-                    'total_file_size_mb': content_stats.get('total_file_size', 0) / (1024*1024),
-                    'materials_by_subject': content_stats.get('by_subject', {})
-                },
-                'quizzes': {
-                    'total_quizzes': quiz_stats.get('total_quizzes', 0),
-                    'total_attempts': quiz_stats.get('total_attempts', 0),
-                    'attempts_today': quiz_stats.get('attempts_today', 0),
-                    'average_score': quiz_stats.get('average_score', 0),
-                    'completion_rate': quiz_stats.get('completion_rate', 0)
-                },
-                'activity': activity_stats,
-                'trends': performance_trends,
-                'system_health': system_health
-            }
+            return await self._collect_bot_statistics()
             
         except Exception as e:
             logger.error(f"Error getting bot statistics: {e}")
             return {}
 
+    @ttl_cached(ttl=5, maxsize=4)
+    async def _collect_bot_statistics(self) -> Dict[str, Any]:
+        """Collect overall bot statistics; shared by all admins polling within the TTL"""
+        # User statistics
+        user_stats = await self.db.get_user_statistics()
+        
+        # Content statistics
+        content_stats = await self.db.get_content_statistics()
+        
+        # Quiz statistics
+        quiz_stats = await self.db.get_quiz_statistics()
+        
+        # Activity statistics
+        activity_stats = await self._get_overall_activity_stats()
+        
+        # Performance trends
+        performance_trends = await self._get_performance_trends()
+        
+        # System health metrics
+        system_health = await self._get_system_health_metrics()
+        
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'users': {
+                'total_registered': user_stats.get('total_users', 0),
+                'active_today': user_stats.get('active_today', 0),
+                'active_this_week': user_stats.get('active_this_week', 0),
+                'new_registrations_today': user_stats.get('new_today', 0),
+                'sections_distribution': user_stats.get('sections_distribution', {})
+            },
+            'content': {
+                'total_materials': content_stats.get('total_materials', 0),
+                'materials_published_today': content_stats.get('published_today', 0),
+                'total_file_size_mb': content_stats.get('total_file_size', 0) / (1024*1024),
+                'materials_by_subject': content_stats.get('by_subject', {})
+            },
+            'quizzes': {
+                'total_quizzes': quiz_stats.get('total_quizzes', 0),
+                'total_attempts': quiz_stats.get('total_attempts', 0),
+                'attempts_today': quiz_stats.get('attempts_today', 0),
+                'average_score': quiz_stats.get('average_score', 0),
+                'completion_rate': quiz_stats.get('completion_rate', 0)
+            },
+            'activity': activity_stats,
+            'trends': performance_trends,
+            'system_health': system_health
+        }
+
     async def get_realtime_dashboard_data(self) -> Dict[str, Any]:
-        """Get real-time dashboard data"""
+        """Get real-time dashboard data (cached for 2 seconds; treat as read-only)"""
         try:
-            now = datetime.now()
-            
-            # Current active users (last 5 minutes)
-            active_users = await self.db.get_active_users_count(minutes=5)
-            
-            # Recent activities (last hour)
-            recent_activities = await self.db.get_recent_activities(hours=1, limit=50)
-            
-            # Live quiz attempts
-            live_quiz_attempts = await self.db.get_active_quiz_attempts()
-            
-            # Current system load
-            system_metrics = await self._get_current_system_metrics()
-            
-            # Today's highlights
-            daily_highlights = await self._get_daily_highlights()
-            
-            return {
-                'timestamp': now.isoformat(),
-                'live_metrics': {
-                    'active_users_5min': active_users,
-                    'quiz_attempts_active': len(live_quiz_attempts),
-                    'system_load': system_metrics.get('load_percentage', 0),
-                    'response_time_ms': system_metrics.get('avg_response_time', 0)
-                },
-                'recent_activities': [
-                    {
-                        'type': activity['activity_type'],
-                        'student_name': activity.get('student_name', 'Unknown'),
-                        'timestamp': activity['timestamp'].isoformat(),
-                        'details': activity.get('metadata', {})
-                    }
-                    for activity in recent_activities
-                ],
-                'live_quizzes': [
-                    {
-                        'quiz_title': attempt['quiz_title'],
-                        'student_name': attempt['student_name'],
-                        'start_time': attempt['start_time'].isoformat(),
-                        'progress': attempt.get('progress_percentage', 0)
-                    }
-                    for attempt in live_quiz_attempts
-                ],
-                'daily_highlights': daily_highlights,
-                'alerts': await self._get_system_alerts()
-            }
+            return await self._collect_realtime_dashboard_data()
             
         except Exception as e:
             logger.error(f"Error getting realtime dashboard data: {e}")
             return {}
 
+    @ttl_cached(ttl=2, maxsize=4)
+    async def _collect_realtime_dashboard_data(self) -> Dict[str, Any]:
+        """Collect real-time dashboard data; shared by all pollers within the TTL"""
+        now = datetime.now()
+        
+        # Current active users (last 5 minutes)
+        active_users = await self.db.get_active_users_count(minutes=5)
+        
+        # Recent activities (last hour)
+        recent_activities = await self.db.get_recent_activities(hours=1, limit=50)
+        
+        # Live quiz attempts
+        live_quiz_attempts = await self.db.get_active_quiz_attempts()
+        
+        # Current system load
+        system_metrics = await self._get_current_system_metrics()
+        
+        # Today's highlights
+        daily_highlights = await self._get_daily_highlights()
+        
+        return {
+            'timestamp': now.isoformat(),
+            'live_metrics': {
+                'active_users_5min': active_users,
+                'quiz_attempts_active': len(live_quiz_attempts),
+                'system_load': system_metrics.get('load_percentage', 0),
+                'response_time_ms': system_metrics.get('avg_response_time', 0)
+            },
+            'recent_activities': [
+                {
+                    'type': activity['activity_type'],
+                    'student_name': activity.get('student_name', 'Unknown'),
+                    'timestamp': activity['timestamp'].isoformat(),
+                    'details': activity.get('metadata', {})
+                }
+                for activity in recent_activities
+            ],
+            'live_quizzes': [
+                {
+                    'quiz_title': attempt['quiz_title'],
+                    'student_name': attempt['student_name'],
+                    'start_time': attempt['start_time'].isoformat(),
+                    'progress': attempt.get('progress_percentage', 0)
+                }
+                for attempt in live_quiz_attempts
+            ],
+            'daily_highlights': daily_highlights,
+            'alerts': await self._get_system_alerts()
+        }
+
     async def generate_performance_report(self, section: Optional[str] = None, 
                                         date_range: int = 30) -> Dict[str, Any]:
         """Generate comprehensive performance report"""
         try:
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=date_range)
-            
-            # Base query filters
-            filters = {'start_date': start_date, 'end_date': end_date}
-            if section:
-                filters['section'] = section
-            
-            # Executive summary
-            executive_summary = await self._generate_executive_summary(filters)
-            
-            # Detailed analytics
-            detailed_analytics = await self._generate_detailed_analytics(filters)
-            
-            # Student performance analysis
-            student_analysis = await self._generate_student_performance_analysis(filters)
-            
-            # Content effectiveness analysis
-            content_analysis = await self._generate_content_effectiveness_analysis(filters)
-            
-            # Recommendations
-            recommendations = await self._generate_actionable_recommendations(filters)
-            
-            # Visual data for charts
-            chart_data = await self._generate_chart_data(filters)
-            
-            return {
-                'report_metadata': {
-                    'generated_at': datetime.now().isoformat(),
-                    'date_range': f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}",
-                    'section': section or 'All Sections',
-                    'report_type': 'Performance Analysis'
-                },
-                'executive_summary': executive_summary,
-                'detailed_analytics': detailed_analytics,
-                'student_analysis': student_analysis,
-                'content_analysis': content_analysis,
-                'recommendations': recommendations,
-                'chart_data': chart_data
-            }
+            report = {}
+            async for name, data in self.generate_performance_report_stream(section, date_range):
+                report[name] = data
+            return report
             
         except Exception as e:
             logger.error(f"Error generating performance report: {e}")
             return {}
 
+    async def generate_performance_report_stream(self, section: Optional[str] = None,
+                                               date_range: int = 30) -> AsyncIterator[Tuple[str, Any]]:
+        """Yield performance report sections as (name, data) pairs as soon as each is ready"""
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=date_range)
+        
+        # Base query filters
+        filters = {'start_date': start_date, 'end_date': end_date}
+        if section:
+            filters['section'] = section
+        
+        yield 'report_metadata', {
+            'generated_at': datetime.now().isoformat(),
+            'date_range': f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}",
+            'section': section or 'All Sections',
+            'report_type': 'Performance Analysis'
+        }
+        
+        # Executive summary
+        yield 'executive_summary', await self._generate_executive_summary(filters)
+        
+        # Detailed analytics
+        yield 'detailed_analytics', await self._generate_detailed_analytics(filters)
+        
+        # Student performance analysis
+        yield 'student_analysis', await self._generate_student_performance_analysis(filters)
+        
+        # Content effectiveness analysis
+        yield 'content_analysis', await self._generate_content_effectiveness_analysis(filters)
+        
+        # Recommendations
+        yield 'recommendations', await self._generate_actionable_recommendations(filters)
+        
+        # Visual data for charts
+        yield 'chart_data', await self._generate_chart_data(filters)
+
     async def _get_student_quiz_stats(self, student_id: int) -> Dict[str, Any]:
         """Get quiz statistics for a student"""
         quiz_results = await self.db.get_student_quiz_results(student_id)
@@ -344,28 +475,39 @@ class AnalyticsService:
                 'subjects_performance': {}
             }
         
-        # Calculate statistics
+        # Single pass over results: totals, best score and per-subject buckets
         total_taken = len(quiz_results)
-        total_passed = sum(1 for result in quiz_results if result.get('passed', False))
-        scores = [result.get('total_score', 0) for result in quiz_results]
-        average_score = sum(scores) / len(scores) if scores else 0
-        best_score = max(scores) if scores else 0
-        recent_scores = scores[-10:]  # Last 10 scores
-        
-        # Performance by subject
+        total_passed = 0
+        total_score = 0
+        best_score = None
+        scores = []
         subjects_performance = {}
         for result in quiz_results:
+            score = result.get('total_score', 0)
+            scores.append(score)
+            total_score += score
+            if best_score is None or score > best_score:
+                best_score = score
+            if result.get('passed', False):
+                total_passed += 1
+
             subject = result.get('subject', 'Unknown')
-            if subject not in subjects_performance:
-                subjects_performance[subject] = {'scores': [], 'count': 0}
-            subjects_performance[subject]['scores'].append(result.get('total_score', 0))
-            subjects_performance[subject]['count'] += 1
-        
-        # Calculate subject averages
-        for subject, data in subjects_performance.items():
-            data['average'] = sum(data['scores']) / len(data['scores']) if data['scores'] else 0
-            data['best'] = max(data['scores']) if data['scores'] else 0
-        
+            data = subjects_performance.get(subject)
+            if data is None:
+                data = subjects_performance[subject] = {'scores': [], 'count': 0, 'sum': 0, 'best': score}
+            data['scores'].append(score)
+            data['count'] += 1
+            data['sum'] += score
+            if score > data['best']:
+                data['best'] = score
+
+        average_score = total_score / total_taken
+        recent_scores = scores[-10:]  # Last 10 scores
+
+        # Calculate subject averages from the running sums
+        for data in subjects_performance.values():
+            data['average'] = data.pop('sum') / data['count']
+
         return {
             'total_quizzes_taken': total_taken,
             'total_quizzes_passed': total_passed,
@@ -391,24 +533,29 @@ class AnalyticsService:
             }
         
         total_views = len(material_views)
-        unique_materials = len(set(view['material_id'] for view in material_views))
-        total_view_time = sum(view.get('view_duration', 0) for view in material_views)
-        
-        # Engagement by subject
-        subjects_engagement = {}
+        total_view_time = 0
+        all_materials = set()
+
+        # Totals and engagement by subject in a single pass
+        subjects_engagement = defaultdict(lambda: {'views': 0, 'time': 0, 'materials': set()})
         for view in material_views:
-            subject = view.get('subject', 'Unknown')
-            if subject not in subjects_engagement:
-                subjects_engagement[subject] = {'views': 0, 'time': 0, 'materials': set()}
-            subjects_engagement[subject]['views'] += 1
-            subjects_engagement[subject]['time'] += view.get('view_duration', 0)
-            subjects_engagement[subject]['materials'].add(view['material_id'])
-        
+            material_id = view['material_id']
+            duration = view.get('view_duration', 0)
+            total_view_time += duration
+            all_materials.add(material_id)
+
+            data = subjects_engagement[view.get('subject', 'Unknown')]
+            data['views'] += 1
+            data['time'] += duration
+            data['materials'].add(material_id)
+
+        unique_materials = len(all_materials)
+
         # Convert sets to counts
-        for subject, data in subjects_engagement.items():
-            data['unique_materials'] = len(data['materials'])
-            del data['materials']
-        
+        for data in subjects_engagement.values():
+            data['unique_materials'] = len(data.pop('materials'))
+        subjects_engagement = dict(subjects_engagement)
+
         recent_activity = material_views[-10:] if material_views else []
         
         return {
@@ -436,10 +583,17 @@ class AnalyticsService:
                 'activity_types': {}
             }
         
-        # Calculate active days
-        active_dates = set(activity['timestamp'].date() for activity in activities)
+        # Collect active dates, hour histogram and type counts in one pass
+        active_dates = set()
+        hour_counts = [0] * 24
+        activity_types = Counter()
+        for activity in activities:
+            timestamp = activity['timestamp']
+            active_dates.add(timestamp.date())
+            hour_counts[timestamp.hour] += 1
+            activity_types[activity['activity_type']] += 1
         active_days = len(active_dates)
-        
+
         # Activity level classification
         activity_level = 'low'
         if active_days >= 20:
@@ -447,14 +601,12 @@ class AnalyticsService:
         elif active_days >= 10:
             activity_level = 'medium'
         
-        # Peak hours analysis
-        hours = [activity['timestamp'].hour for activity in activities]
-        hour_counts = Counter(hours)
-        peak_hours = [hour for hour, count in hour_counts.most_common(3)]
-        
-        # Activity types distribution
-        activity_types = Counter(activity['activity_type'] for activity in activities)
-        
+        # Peak hours analysis (top 3 non-empty hours)
+        peak_hours = sorted(
+            (hour for hour in range(24) if hour_counts[hour]),
+            key=hour_counts.__getitem__, reverse=True
+        )[:3]
+
         return {
             'total_activities': len(activities),
             'active_days': active_days,
@@ -478,23 +630,26 @@ class AnalyticsService:
                     'performance_category': 'beginner'
                 }
             
-            # Calculate overall score (weighted average, recent scores have more weight)
-            weights = [i + 1 for i in range(len(recent_scores))]
-            weighted_sum = sum(score * weight for score, weight in zip(recent_scores, weights))
-            weight_sum = sum(weights)
-            overall_score = weighted_sum / weight_sum
-            
+            # Weighted sum, plain sum and sum of squares in one pass
+            # (weights 1..n, recent scores have more weight)
+            n = len(recent_scores)
+            weighted_sum = 0
+            total = 0
+            total_sq = 0
+            for weight, score in enumerate(recent_scores, 1):
+                weighted_sum += score * weight
+                total += score
+                total_sq += score * score
+            overall_score = weighted_sum / (n * (n + 1) / 2)
+
             # Calculate improvement trend
             improvement_trend = self._calculate_score_trend(recent_scores)
-            
-            # Calculate consistency (standard deviation)
-            if len(recent_scores) > 1:
-                mean_score = sum(recent_scores) / len(recent_scores)
-                variance = sum((score - mean_score) ** 2 for score in recent_scores) / len(recent_scores)
-                std_dev = variance ** 0.5
-                consistency_score = max(0, 100 - std_dev)  # Higher is more consistent
-            else:
-                consistency_score = 100
+
+            # Calculate consistency (population standard deviation)
+            mean_score = total / n
+            variance = max(0.0, total_sq / n - mean_score * mean_score)
+            std_dev = variance ** 0.5
+            consistency_score = max(0, 100 - std_dev)  # Higher is more consistent
             
             # Performance category
             if overall_score >= 90:
@@ -525,9 +680,11 @@ class AnalyticsService:
         if len(scores) < 3:
             return 'insufficient_data'
         
-        # Simple linear trend calculation
-        recent_avg = sum(scores[-3:]) / 3
-        older_avg = sum(scores[:-3]) / len(scores[:-3]) if len(scores) > 3 else sum(scores[:3]) / 3
+        # Simple linear trend calculation: last three scores vs the rest
+        n = len(scores)
+        tail = scores[-3] + scores[-2] + scores[-1]
+        recent_avg = tail / 3
+        older_avg = (sum(scores) - tail) / (n - 3) if n > 3 else recent_avg
         
         diff = recent_avg - older_avg
         
@@ -541,43 +698,14 @@ class AnalyticsService:
     async def _calculate_learning_streak(self, student_id: int) -> Dict[str, Any]:
         """Calculate learning streak for student"""
         try:
-            # Get recent activity dates
-            activities = await self.db.get_student_recent_activities(student_id, days=60)
-            
-            if not activities:
-                return {'current_streak': 0, 'longest_streak': 0, 'last_activity': None}
-            
-            # Extract unique activity dates
-            activity_dates = sorted(set(
-                activity['timestamp'].date() for activity in activities
-            ), reverse=True)
-            
-            # Calculate current streak
-            current_streak = 0
-            today = datetime.now().date()
-            
-            for i, date in enumerate(activity_dates):
-                expected_date = today - timedelta(days=i)
-                if date == expected_date or (i == 0 and date == today - timedelta(days=1)):
-                    current_streak += 1
-                else:
-                    break
-            
-            # Calculate longest streak
-            longest_streak = 0
-            temp_streak = 1
-            
-            for i in range(1, len(activity_dates)):
-                if activity_dates[i-1] - activity_dates[i] == timedelta(days=1):
-                    temp_streak += 1
-                    longest_streak = max(longest_streak, temp_streak)
-                else:
-                    temp_streak = 1
-            
+            # Streaks are computed in the database over the last 60 days
+            streaks = await self.db.get_student_streaks(student_id, days=60)
+            last_activity = streaks.get('last_activity')
+
             return {
-                'current_streak': current_streak,
-                'longest_streak': max(longest_streak, current_streak),
-                'last_activity': activity_dates[0].isoformat() if activity_dates else None
+                'current_streak': streaks.get('current_streak', 0),
+                'longest_streak': streaks.get('longest_streak', 0),
+                'last_activity': last_activity.isoformat() if last_activity else None
             }
             
         except Exception as e:
@@ -590,7 +718,7 @@ class AnalyticsService:
             achievements = []
             
             # Quiz-based achievements
-            quiz_stats = await self._get_student_quiz_stats(student_id)
+            quiz_stats = (await self._get_cached_stats_bundle(student_id))['quiz']
             
             if quiz_stats['total_quizzes_taken'] >= 10:
                 achievements.append({
@@ -625,45 +753,50 @@ class AnalyticsService:
             logger.error(f"Error getting student achievements: {e}")
             return []
 
+    async def _get_cached_stats_bundle(self, student_id: int) -> Dict[str, Any]:
+        """Get quiz, material and activity stats for a student, cached for a short TTL"""
+        bundle = self._stats_cache.get(student_id)
+        if bundle is None:
+            quiz, material, activity = await asyncio.gather(
+                self._get_student_quiz_stats(student_id),
+                self._get_student_material_stats(student_id),
+                self._get_student_activity_stats(student_id)
+            )
+            bundle = {'quiz': quiz, 'material': material, 'activity': activity}
+            self._stats_cache.set(student_id, bundle)
+        return bundle
+
+    def invalidate_student_stats(self, student_id: int):
+        """Drop a student's cached stats bundle"""
+        self._stats_cache.invalidate(student_id)
+
+    @staticmethod
+    def _weak_subjects(stats: Dict[str, Any]) -> List[str]:
+        """Subjects with an average quiz score below 70"""
+        return [
+            subject for subject, data in stats['quiz'].get('subjects_performance', {}).items()
+            if data['average'] < 70
+        ]
+
+    def _apply_recommendation_rules(self, stats: Dict[str, Any]) -> List[str]:
+        """Evaluate the recommendation rules against a stats bundle"""
+        recommendations = [
+            message(stats) if callable(message) else message
+            for predicate, message in self._reco_rules
+            if predicate(stats)
+        ]
+        
+        # Default encouragement
+        if not recommendations:
+            recommendations.append("أداؤك جيد! استمر في التعلم وحل الاختبارات")
+        
+        return recommendations[:5]  # Limit to 5 recommendations
+
     async def _generate_recommendations(self, student_id: int) -> List[str]:
         """Generate personalized recommendations for student"""
         try:
-            recommendations = []
-            
-            # Get student data
-            quiz_stats = await self._get_student_quiz_stats(student_id)
-            material_stats = await self._get_student_material_stats(student_id)
-            activity_stats = await self._get_student_activity_stats(student_id)
-            
-            # Performance-based recommendations
-            if quiz_stats['average_score'] < 70:
-                recommendations.append("راجع المواد الدراسية قبل حل الاختبارات لتحسين درجاتك")
-            
-            if quiz_stats.get('improvement_trend') == 'declining':
-                recommendations.append("درجاتك في تراجع - حاول التركيز أكثر على المواضيع الصعبة")
-            
-            # Activity-based recommendations
-            if activity_stats['activity_level'] == 'low':
-                recommendations.append("حاول زيادة نشاطك اليومي على المنصة لتحقيق أفضل النتائج")
-            
-            if material_stats['total_materials_viewed'] < 5:
-                recommendations.append("استكشف المزيد من المواد التعليمية المتاحة")
-            
-            # Subject-specific recommendations
-            subjects_performance = quiz_stats.get('subjects_performance', {})
-            weak_subjects = [
-                subject for subject, data in subjects_performance.items() 
-                if data['average'] < 70
-            ]
-            
-            if weak_subjects:
-                recommendations.append(f"ركز على تحسين أدائك في: {', '.join(weak_subjects)}")
-            
-            # Default encouragement
-            if not recommendations:
-                recommendations.append("أداؤك جيد! استمر في التعلم وحل الاختبارات")
-            
-            return recommendations[:5]  # Limit to 5 recommendations
+            stats = await self._get_cached_stats_bundle(student_id)
+            return self._apply_recommendation_rules(stats)
             
         except Exception as e:
             logger.error(f"Error generating recommendations: {e}")
@@ -676,46 +809,66 @@ class AnalyticsService:
             if not self.activity_buffer:
                 return
             
-            buffer_copy = self.activity_buffer.copy()
-            buffer_size = len(buffer_copy)
+            # Bound the number of inserts in flight before taking a new batch
+            await self._flush_slots.acquire()
+            
+            buffer = self.activity_buffer
+            batch = [buffer.popleft() for _ in range(len(buffer))]
             
+            # Submit the write and return; the next flush pipelines behind it
+            task = asyncio.create_task(self._write_activity_batch(batch))
+            self._inflight_flushes.add(task)
+            task.add_done_callback(self._inflight_flushes.discard)
+
+    async def _write_activity_batch(self, batch: List[StudentActivity]):
+        """Write one flushed batch, putting it back at the buffer head on failure"""
+        try:
+            # Rows in bulk_insert_activities column order
+            activities_data = [
+                (
+                    activity.student_id,
+                    activity.activity_type,
+                    activity.timestamp,
+                    json.dumps(activity.metadata),
+                    activity.session_id
+                )
+                for activity in batch
+            ]
+            
+            # Use circuit breaker for database operations if available
             try:
-                activities_data = []
-                for activity in buffer_copy:
-                    activities_data.append({
-                        'student_id': activity.student_id,
-                        'activity_type': activity.activity_type,
-                        'timestamp': activity.timestamp,
-                        'metadata': json.dumps(activity.metadata),
-                        'session_id': activity.session_id
-                    })
+                from utils.circuit_breaker import with_database_circuit_breaker
                 
-                # Use circuit breaker for database operations if available
-                try:
-                    from utils.circuit_breaker import with_database_circuit_breaker
-                    
-                    @with_database_circuit_breaker
-                    async def flush_to_db():
-                        return await self.db.bulk_insert_activities(activities_data)
-                    
-                    await flush_to_db()
-                except ImportError:
-                    # Direct database call if circuit breaker not available
-                    await self.db.bulk_insert_activities(activities_data)
+                @with_database_circuit_breaker
+                async def flush_to_db():
+                    return await self.db.bulk_insert_activities(activities_data)
                 
-                # Only clear buffer after successful database write
-                self.activity_buffer = self.activity_buffer[buffer_size:]
-                
-                logger.info(f"Successfully flushed {buffer_size} activities to database")
-            
-            except Exception as e:
-                logger.error(f"Error flushing activity buffer: {e}")
-                # Keep failed items in buffer for retry, but limit buffer size
-                if len(self.activity_buffer) > self.max_buffer_size:
-                    # Drop oldest items if buffer is too large to prevent memory issues
-                    overflow = len(self.activity_buffer) - self.buffer_size
-                    self.activity_buffer = self.activity_buffer[overflow:]
-                    logger.warning(f"Dropped {overflow} old activities due to persistent flush failures")
+                await flush_to_db()
+            except ImportError:
+                # Direct database call if circuit breaker not available
+                await self.db.bulk_insert_activities(activities_data)
+            
+            # Recycle flushed objects unless the notification worker may still hold them
+            if self._notify_queue.empty():
+                for activity in batch:
+                    activity.metadata = None
+                self._activity_pool.extend(batch)
+            
+            logger.info(f"Successfully flushed {len(batch)} activities to database")
+        
+        except Exception as e:
+            logger.error(f"Error flushing activity buffer: {e}")
+            # Keep failed items in buffer for retry, but limit buffer size
+            self.activity_buffer.extendleft(reversed(batch))
+            if len(self.activity_buffer) > self.max_buffer_size:
+                # Drop oldest items if buffer is too large to prevent memory issues
+                overflow = len(self.activity_buffer) - self.buffer_size
+                for _ in range(overflow):
+                    self.activity_buffer.popleft()
+                logger.warning(f"Dropped {overflow} old activities due to persistent flush failures")
+        
+        finally:
+            self._flush_slots.release()
 
     async def _notify_realtime_subscribers(self, activity: StudentActivity):
         """Notify real-time dashboard subscribers"""
@@ -746,12 +899,20 @@ class AnalyticsService:
         today = datetime.now().date()
         
         try:
+            # Independent queries - issue them together
+            registrations, quizzes, materials, active, top_performers = await asyncio.gather(
+                self.db.get_registrations_count(today),
+                self.db.get_quizzes_completed_count(today),
+                self.db.get_materials_viewed_count(today),
+                self.db.get_active_students_count(today),
+                self.db.get_top_performers(today, limit=5)
+            )
             return {
-                'new_registrations': await self.db.get_registrations_count(today),
-                'quizzes_completed': await self.db.get_quizzes_completed_count(today),
-                'materials_viewed': await self.db.get_materials_viewed_count(today),
-                'active_students': await self.db.get_active_students_count(today),
-                'top_performers': await self.db.get_top_performers(today, limit=5)
+                'new_registrations': registrations,
+                'quizzes_completed': quizzes,
+                'materials_viewed': materials,
+                'active_students': active,
+                'top_performers': top_performers
             }
         except Exception as e:
             logger.error(f"Error getting daily highlights: {e}")
@@ -762,23 +923,27 @@ class AnalyticsService:
         alerts = []
         
         try:
+            # Only counts are needed here; full lists are fetched when an action is taken
+            declining_count, inactive_count = await asyncio.gather(
+                self.db.get_declining_performance_count(),
+                self.db.get_inactive_students_count(days=7)
+            )
+            
             # Check for students with declining performance
-            declining_students = await self.db.get_students_with_declining_performance()
-            if declining_students:
+            if declining_count:
                 alerts.append({
                     'type': 'warning',
                     'title': 'Students with Declining Performance',
-                    'message': f"{len(declining_students)} students showing performance decline",
+                    'message': f"{declining_count} students showing performance decline",
                     'action': 'review_students'
                 })
             
             # Check for inactive students
-            inactive_students = await self.db.get_inactive_students(days=7)
-            if len(inactive_students) > 10:
+            if inactive_count > 10:
                 alerts.append({
                     'type': 'info',
                     'title': 'Inactive Students',
-                    'message': f"{len(inactive_students)} students inactive for 7+ days",
+                    'message': f"{inactive_count} students inactive for 7+ days",
                     'action': 'send_reminders'
                 })
             
@@ -793,8 +958,11 @@ class AnalyticsService:
         try:
             cutoff_date = datetime.now() - timedelta(days=days_to_keep)
             
-            deleted_activities = await self.db.delete_activities_before_date(cutoff_date)
-            deleted_sessions = await self.db.delete_sessions_before_date(cutoff_date)
+            # Independent tables, separate statements - safe to run concurrently
+            deleted_activities, deleted_sessions = await asyncio.gather(
+                self.db.delete_activities_before_date(cutoff_date),
+                self.db.delete_sessions_before_date(cutoff_date)
+            )
             
             logger.info(f"Cleaned up {deleted_activities} activities and {deleted_sessions} sessions")
             
@@ -1,20 +1,51 @@
 import logging
-from typing import Dict, List, Optional, Any
-from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Union, AsyncIterator, Tuple
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
 import asyncio
 import aiofiles
 import os
 from pathlib import Path
 import hashlib
-import mimetypes
+import time
+import uuid
 
 from models import get_database_manager
+from utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Supported file extensions (lowercase, without the dot) and their MIME types
+EXT_TO_MIME = {
+    'pdf': 'application/pdf',
+    'doc': 'application/msword',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'ppt': 'application/vnd.ms-powerpoint',
+    'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'txt': 'text/plain',
+    'md': 'text/markdown',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'mp4': 'video/mp4',
+    'mp3': 'audio/mpeg',
+    'zip': 'application/zip',
+    'rar': 'application/vnd.rar',
+}
+SUPPORTED_FILE_TYPES = frozenset(EXT_TO_MIME)
+
 class ContentService:
     """Service for managing educational content and weekly materials"""
     
+    # Files unlinked per worker-thread job in cleanup_old_files
+    UNLINK_BATCH_SIZE = 256
+    
+    # Material fields covered by the duplicate-detection hash, in hash order
+    CONTENT_HASH_FIELDS = ('title', 'content', 'section')
+    
+    # migrations-table name of the one-time move off the legacy sha256 content hash
+    CONTENT_REHASH_MIGRATION = 'rehash:materials.content_hash'
+    
     def __init__(self, db_manager):
         self.db = db_manager
         self.content_dir = Path("content")
@@ -24,48 +55,44 @@ class ContentService:
         self.content_dir.mkdir(exist_ok=True)
         self.uploads_dir.mkdir(exist_ok=True)
         
-        # Supported file types
-        self.supported_file_types = {
-            '.pdf', '.doc', '.docx', '.ppt', '.pptx', 
-            '.txt', '.md', '.jpg', '.jpeg', '.png', 
-            '.mp4', '.mp3', '.zip', '.rar'
-        }
-        
         # Max file size (50MB)
         self.max_file_size = 50 * 1024 * 1024
+        
+        # Material upload directories already created by this process
+        self._created_dirs: set = set()
+        
+        # 64-bit fingerprints of stored content hashes; a miss skips the duplicate
+        # query. None until load_hash_index() runs, in which case every check hits the DB
+        self._hash_index: Optional[set] = None
+        
+        # The index only sees this process's inserts, so it is reloaded after this many
+        # seconds to pick up materials added by other replicas, start.py or imports
+        self.hash_index_ttl = int(os.getenv('CONTENT_HASH_INDEX_TTL', '300'))
+        self._hash_index_loaded_at = 0.0
+        
+        # Dashboard read caches; material lists are invalidated on writes
+        self._materials_cache = TTLCache(ttl=int(os.getenv('CONTENT_MATERIALS_CACHE_TTL', '60')))
+        self._stats_cache = TTLCache(ttl=int(os.getenv('CONTENT_STATS_CACHE_TTL', '300')), maxsize=1)
 
     async def create_material(self, material_data: Dict[str, Any]) -> int:
         """Create a new educational material"""
         try:
-            # Validate required fields
-            required_fields = ['title', 'description', 'section', 'subject', 'week_number']
-            for field in required_fields:
-                if field not in material_data:
-                    raise ValueError(f"Missing required field: {field}")
-            
-            # Set default values
-            material_data.setdefault('date_published', datetime.now())
-            material_data.setdefault('is_active', True)
-            material_data.setdefault('content_type', 'text')
-            material_data.setdefault('difficulty_level', 'medium')
-            material_data.setdefault('estimated_duration', 30)  # minutes
-            
-            # Generate content hash for duplicate detection
-            content_hash = self._generate_content_hash(material_data)
-            material_data['content_hash'] = content_hash
-            
-            # Check for duplicates
-            existing = await self.db.get_material_by_hash(content_hash)
-            if existing:
-                logger.warning(f"Duplicate material detected: {material_data['title']}")
-                return existing['id']
-            
-            # Insert into database
+            # Validate, fill defaults and hash for duplicate detection
+            content_hash = self._prepare_material_data(material_data)
+            
+            # Check for duplicates (only when the fingerprint index reports a possible hit)
+            await self._refresh_stale_hash_index()
+            if self._hash_may_exist(content_hash):
+                existing_id = (await self.db.get_materials_by_hashes([content_hash])).get(content_hash)
+                if existing_id:
+                    logger.warning(f"Duplicate material detected: {material_data['title']}")
+                    return existing_id
+            
+            # Insert into database (its upload directory is created on first upload). The insert
+            # itself skips stored hashes, so an index miss for another replica's row is still safe
             material_id = await self.db.create_material(material_data)
-            
-            # Create content directory for this material
-            material_dir = self.content_dir / str(material_id)
-            material_dir.mkdir(exist_ok=True)
+            self._remember_hash(content_hash)
+            self._invalidate_content_caches((material_data['section'], material_data['week_number']))
             
             logger.info(f"Created material: {material_data['title']} (ID: {material_id})")
             return material_id
@@ -74,20 +101,122 @@ class ContentService:
             logger.error(f"Error creating material: {e}")
             raise
 
+    def _prepare_material_data(self, material_data: Dict[str, Any]) -> str:
+        """Validate a material, fill in defaults and set its content hash"""
+        # Validate required fields
+        required_fields = ['title', 'description', 'section', 'subject', 'week_number']
+        for field in required_fields:
+            if field not in material_data:
+                raise ValueError(f"Missing required field: {field}")
+        
+        # Set default values
+        material_data.setdefault('date_published', datetime.now())
+        material_data.setdefault('is_active', True)
+        material_data.setdefault('content_type', 'text')
+        material_data.setdefault('difficulty_level', 'medium')
+        material_data.setdefault('estimated_duration', 30)  # minutes
+        
+        # Generate content hash for duplicate detection
+        content_hash = self._generate_content_hash(material_data)
+        material_data['content_hash'] = content_hash
+        return content_hash
+
+    async def _create_materials_bulk(self, materials: List[Dict[str, Any]]) -> List[int]:
+        """Create many materials with one duplicate check and one insert"""
+        hashes = [self._prepare_material_data(material_data) for material_data in materials]
+        
+        # One lookup for the hashes the fingerprint index cannot rule out
+        await self._refresh_stale_hash_index()
+        candidates = [content_hash for content_hash in set(hashes) if self._hash_may_exist(content_hash)]
+        existing = await self.db.get_materials_by_hashes(candidates) if candidates else {}
+        
+        new_rows = []
+        seen = set(existing)
+        for material_data, content_hash in zip(materials, hashes):
+            if content_hash in seen:
+                logger.warning(f"Duplicate material detected: {material_data['title']}")
+                continue
+            seen.add(content_hash)
+            new_rows.append(material_data)
+        
+        inserted = await self.db.bulk_insert_materials(new_rows) if new_rows else {}
+        # Rows the insert skipped were stored meanwhile (or by a process the index has not seen)
+        skipped = [row['content_hash'] for row in new_rows if row['content_hash'] not in inserted]
+        if skipped:
+            inserted.update(await self.db.get_materials_by_hashes(skipped))
+        for material_data in new_rows:
+            self._remember_hash(material_data['content_hash'])
+            self._invalidate_content_caches((material_data['section'], material_data['week_number']))
+        
+        return [existing.get(content_hash) or inserted[content_hash] for content_hash in hashes]
+
+    async def rehash_legacy_materials(self):
+        """Rewrite content hashes stored by the legacy sha256 scheme (once per database)"""
+        try:
+            if await self.db.migration_applied(self.CONTENT_REHASH_MIGRATION):
+                return
+            
+            updates = []
+            for material in await self.db.get_material_hash_fields():
+                content_hash = self._hash_content_fields(*(
+                    material.get(field) or '' for field in self.CONTENT_HASH_FIELDS
+                ))
+                if content_hash != material['content_hash']:
+                    updates.append((content_hash, material['id']))
+            
+            # Marker goes in last, so a failed run is simply repeated on the next start
+            await self.db.update_material_hashes(updates)
+            await self.db.record_migration(self.CONTENT_REHASH_MIGRATION)
+            logger.info(f"Rehashed {len(updates)} materials to the current content hash")
+        except Exception as e:
+            logger.error(f"Error rehashing legacy materials: {e}")
+
+    async def load_hash_index(self):
+        """Load fingerprints of all stored content hashes for duplicate pre-checks"""
+        try:
+            hashes = await self.db.get_all_material_hashes()
+            self._hash_index = {self._hash_fingerprint(h) for h in hashes if h}
+            self._hash_index_loaded_at = time.monotonic()
+            logger.info(f"Loaded {len(self._hash_index)} material hash fingerprints")
+        except Exception as e:
+            logger.error(f"Error loading material hash index: {e}")
+            self._hash_index = None
+
+    async def _refresh_stale_hash_index(self):
+        """Reload the fingerprint index once it is older than hash_index_ttl"""
+        if self._hash_index is not None and time.monotonic() - self._hash_index_loaded_at > self.hash_index_ttl:
+            await self.load_hash_index()
+
+    @staticmethod
+    def _hash_fingerprint(content_hash: str) -> int:
+        """First 64 bits of a hex content hash"""
+        return int(content_hash[:16], 16)
+
+    def _hash_may_exist(self, content_hash: str) -> bool:
+        """False only when the hash is certainly not stored yet"""
+        return self._hash_index is None or self._hash_fingerprint(content_hash) in self._hash_index
+
+    def _remember_hash(self, content_hash: str):
+        """Record a newly stored content hash in the fingerprint index"""
+        if self._hash_index is not None:
+            self._hash_index.add(self._hash_fingerprint(content_hash))
+
     async def get_weekly_materials(self, section: str, week_number: Optional[int] = None) -> List[Dict[str, Any]]:
-        """Get materials for a specific section and week"""
+        """Get materials for a specific section and week (cached briefly; treat as read-only)"""
         try:
             if week_number is None:
                 # Get current week number (you can customize this logic)
                 week_number = self._get_current_week_number()
             
+            cache_key = (section, week_number)
+            cached = self._materials_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
             materials = await self.db.get_materials_by_section_and_week(section, week_number)
             
             # Enrich materials with additional metadata
-            enriched_materials = []
-            for material in materials:
-                enriched_material = await self._enrich_material_data(material)
-                enriched_materials.append(enriched_material)
+            enriched_materials = await self._enrich_materials(materials)
             
             # Sort by priority and date
             enriched_materials.sort(
@@ -95,6 +224,7 @@ class ContentService:
                 reverse=True
             )
             
+            self._materials_cache.set(cache_key, enriched_materials)
             return enriched_materials
             
         except Exception as e:
@@ -121,13 +251,19 @@ class ContentService:
             if 'content' in updates or 'title' in updates:
                 material = await self.db.get_material_by_id(material_id)
                 if material:
-                    updated_data = {**material, **updates}
-                    updates['content_hash'] = self._generate_content_hash(updated_data)
+                    # Hash the three fields directly, updates taking precedence
+                    updates['content_hash'] = self._hash_content_fields(*(
+                        updates[field] if field in updates else material.get(field, '')
+                        for field in self.CONTENT_HASH_FIELDS
+                    ))
             
             updates['last_modified'] = datetime.now()
             success = await self.db.update_material(material_id, updates)
             
             if success:
+                if 'content_hash' in updates:
+                    self._remember_hash(updates['content_hash'])
+                self._invalidate_content_caches()
                 logger.info(f"Updated material {material_id}")
             
             return success
@@ -145,6 +281,7 @@ class ContentService:
             })
             
             if success:
+                self._invalidate_content_caches()
                 logger.info(f"Deleted material {material_id}")
             
             return success
@@ -153,52 +290,54 @@ class ContentService:
             logger.error(f"Error deleting material {material_id}: {e}")
             return False
 
-    async def upload_file(self, material_id: int, file_data: bytes, filename: str) -> Optional[Dict[str, Any]]:
-        """Upload and associate a file with a material"""
+    async def upload_file(self, material_id: int, file_data: Union[bytes, AsyncIterator[bytes]],
+                          filename: str) -> Optional[Dict[str, Any]]:
+        """Upload and associate a file with a material (raw bytes or an async stream of chunks)"""
         try:
             # Validate file
-            file_extension = Path(filename).suffix.lower()
-            if file_extension not in self.supported_file_types:
+            file_extension = filename.rpartition('.')[2].lower()
+            if file_extension not in SUPPORTED_FILE_TYPES:
                 raise ValueError(f"Unsupported file type: {file_extension}")
             
-            if len(file_data) > self.max_file_size:
+            is_bytes = isinstance(file_data, (bytes, bytearray, memoryview))
+            if is_bytes and len(file_data) > self.max_file_size:
                 raise ValueError(f"File too large: {len(file_data)} bytes")
             
-            # Generate unique filename
-            file_hash = hashlib.md5(file_data).hexdigest()
-            safe_filename = f"{file_hash}_{filename}"
-            
-            # Create material directory
+            # Create material directory on first upload (off the event loop)
             material_dir = self.uploads_dir / str(material_id)
-            material_dir.mkdir(exist_ok=True)
-            
-            file_path = material_dir / safe_filename
-            
-            # Save file
-            async with aiofiles.open(file_path, 'wb') as f:
-                await f.write(file_data)
+            if material_id not in self._created_dirs:
+                await asyncio.to_thread(material_dir.mkdir, exist_ok=True)
+                self._created_dirs.add(material_id)
+            
+            if is_bytes:
+                # Generate unique filename (hash off the event loop; up to 50MB)
+                file_hash = await asyncio.to_thread(self._hash_file_data, file_data)
+                file_size = len(file_data)
+                file_path = material_dir / f"{file_hash}_{filename}"
+                
+                # Save file (open, write and close in a single worker-thread hop)
+                await asyncio.to_thread(file_path.write_bytes, file_data)
+            else:
+                # Hash and write each chunk as it arrives; only one chunk is held at a time
+                file_hash, file_size, file_path = await self._write_stream(material_dir, file_data, filename)
             
             # Create file record
             file_info = {
                 'material_id': material_id,
                 'original_filename': filename,
-                'stored_filename': safe_filename,
+                'stored_filename': file_path.name,
                 'file_path': str(file_path),
-                'file_size': len(file_data),
+                'file_size': file_size,
                 'file_type': file_extension,
-                'mime_type': mimetypes.guess_type(filename)[0],
+                'mime_type': EXT_TO_MIME.get(file_extension, 'application/octet-stream'),
                 'upload_date': datetime.now(),
                 'file_hash': file_hash
             }
             
-            file_id = await self.db.create_material_file(file_info)
+            # Insert the file record and flag the material in one round trip
+            file_id = await self.db.create_material_file_and_touch(file_info)
             file_info['id'] = file_id
-            
-            # Update material with file reference
-            await self.db.update_material(material_id, {
-                'has_files': True,
-                'last_modified': datetime.now()
-            })
+            self._invalidate_content_caches()
             
             logger.info(f"Uploaded file {filename} for material {material_id}")
             return file_info
@@ -207,6 +346,31 @@ class ContentService:
             logger.error(f"Error uploading file: {e}")
             return None
 
+    async def _write_stream(self, material_dir: Path, stream: AsyncIterator[bytes],
+                            filename: str) -> Tuple[str, int, Path]:
+        """Hash and write a chunk stream in one pass, publishing it by atomic rename"""
+        hasher = hashlib.blake2b(digest_size=16)
+        file_size = 0
+        tmp_path = material_dir / f".{uuid.uuid4().hex}.part"
+        try:
+            async with aiofiles.open(tmp_path, 'wb') as f:
+                async for chunk in stream:
+                    file_size += len(chunk)
+                    if file_size > self.max_file_size:
+                        raise ValueError(f"File too large: more than {self.max_file_size} bytes")
+                    hasher.update(chunk)
+                    await f.write(chunk)
+            
+            # The final name depends on the hash, so rename once it is known
+            file_hash = hasher.hexdigest()
+            file_path = material_dir / f"{file_hash}_{filename}"
+            await asyncio.to_thread(os.replace, tmp_path, file_path)
+            return file_hash, file_size, file_path
+        
+        except BaseException:
+            await asyncio.to_thread(tmp_path.unlink, missing_ok=True)
+            raise
+
     async def get_material_files(self, material_id: int) -> List[Dict[str, Any]]:
         """Get all files associated with a material"""
         try:
@@ -215,20 +379,45 @@ class ContentService:
             logger.error(f"Error fetching files for material {material_id}: {e}")
             return []
 
-    async def get_file_content(self, file_id: int) -> Optional[bytes]:
-        """Get file content by file ID"""
+    async def get_file_path(self, file_id: int) -> Optional[Path]:
+        """Get the on-disk path of a stored file (for FileResponse/sendfile streaming)"""
         try:
             file_info = await self.db.get_material_file_by_id(file_id)
             if not file_info:
                 return None
             
             file_path = Path(file_info['file_path'])
-            if not file_path.exists():
+            if not await asyncio.to_thread(file_path.is_file):
                 logger.error(f"File not found: {file_path}")
                 return None
             
-            async with aiofiles.open(file_path, 'rb') as f:
-                return await f.read()
+            return file_path
+            
+        except Exception as e:
+            logger.error(f"Error locating file {file_id}: {e}")
+            return None
+
+    async def iter_file_content(self, file_id: int, chunk_size: int = 65536) -> AsyncIterator[bytes]:
+        """Stream file content by file ID in chunks instead of buffering the whole file"""
+        file_path = await self.get_file_path(file_id)
+        if file_path is None:
+            return
+        
+        async with aiofiles.open(file_path, 'rb') as f:
+            while True:
+                chunk = await f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    async def get_file_content(self, file_id: int) -> Optional[bytes]:
+        """Get file content by file ID (whole file; prefer iter_file_content/get_file_path)"""
+        try:
+            file_path = await self.get_file_path(file_id)
+            if file_path is None:
+                return None
+            
+            return await asyncio.to_thread(file_path.read_bytes)
                 
         except Exception as e:
             logger.error(f"Error reading file {file_id}: {e}")
@@ -241,12 +430,7 @@ class ContentService:
             materials = await self.db.search_materials(query, section, subject, limit)
             
             # Enrich search results
-            enriched_results = []
-            for material in materials:
-                enriched_material = await self._enrich_material_data(material)
-                enriched_results.append(enriched_material)
-            
-            return enriched_results
+            return await self._enrich_materials(materials)
             
         except Exception as e:
             logger.error(f"Error searching materials: {e}")
@@ -257,12 +441,7 @@ class ContentService:
         try:
             materials = await self.db.get_materials_by_subject(subject, section)
             
-            enriched_materials = []
-            for material in materials:
-                enriched_material = await self._enrich_material_data(material)
-                enriched_materials.append(enriched_material)
-            
-            return enriched_materials
+            return await self._enrich_materials(materials)
             
         except Exception as e:
             logger.error(f"Error fetching materials by subject: {e}")
@@ -274,22 +453,21 @@ class ContentService:
             since_date = datetime.now() - timedelta(days=days)
             materials = await self.db.get_materials_since_date(section, since_date)
             
-            enriched_materials = []
-            for material in materials:
-                enriched_material = await self._enrich_material_data(material)
-                enriched_materials.append(enriched_material)
-            
-            return enriched_materials
+            return await self._enrich_materials(materials)
             
         except Exception as e:
             logger.error(f"Error fetching recent materials: {e}")
             return []
 
     async def get_content_statistics(self) -> Dict[str, Any]:
-        """Get content statistics"""
+        """Get content statistics (cached; treat as read-only)"""
         try:
+            cached = self._stats_cache.get('stats')
+            if cached is not None:
+                return cached
+            
             stats = await self.db.get_content_statistics()
-            return {
+            content_stats = {
                 'total_materials': stats.get('total_materials', 0),
                 'materials_by_section': stats.get('materials_by_section', {}),
                 'materials_by_subject': stats.get('materials_by_subject', {}),
@@ -297,51 +475,100 @@ class ContentService:
                 'total_file_size': stats.get('total_file_size', 0),
                 'recent_uploads': stats.get('recent_uploads', 0)
             }
+            self._stats_cache.set('stats', content_stats)
+            return content_stats
         except Exception as e:
             logger.error(f"Error fetching content statistics: {e}")
             return {}
 
     async def publish_weekly_batch(self, section: str, week_number: int, materials: List[Dict[str, Any]]) -> List[int]:
         """Publish a batch of materials for a specific week"""
-        created_materials = []
-        
         try:
+            now = datetime.now()
             for material_data in materials:
                 material_data.update({
                     'section': section,
                     'week_number': week_number,
-                    'date_published': datetime.now(),
+                    'date_published': now,
                     'is_active': True
                 })
-                
-                material_id = await self.create_material(material_data)
-                created_materials.append(material_id)
+            
+            # Single multi-row insert: the batch lands entirely or not at all
+            created_materials = await self._create_materials_bulk(materials)
             
             logger.info(f"Published {len(created_materials)} materials for {section}, week {week_number}")
             return created_materials
             
         except Exception as e:
             logger.error(f"Error publishing weekly batch: {e}")
-            # Rollback created materials
-            for material_id in created_materials:
-                await self.delete_material(material_id)
             return []
 
+    def _invalidate_content_caches(self, materials_key: Optional[tuple] = None):
+        """Drop cached material lists (one section/week, or all) and content statistics"""
+        if materials_key is None:
+            self._materials_cache.invalidate()
+        else:
+            self._materials_cache.invalidate(materials_key)
+        self._stats_cache.invalidate()
+
+    @staticmethod
+    def _hash_file_data(file_data: Union[bytes, memoryview]) -> str:
+        """Fast non-cryptographic fingerprint for stored file names (md5-sized hex)"""
+        return hashlib.blake2b(file_data, digest_size=16).hexdigest()
+
     def _generate_content_hash(self, material_data: Dict[str, Any]) -> str:
         """Generate hash for content deduplication"""
-        content_string = f"{material_data.get('title', '')}{material_data.get('content', '')}{material_data.get('section', '')}"
-        return hashlib.sha256(content_string.encode()).hexdigest()
+        return self._hash_content_fields(*(material_data.get(field, '') for field in self.CONTENT_HASH_FIELDS))
+
+    @staticmethod
+    def _hash_content_fields(*values: Any) -> str:
+        """blake2b over the CONTENT_HASH_FIELDS values"""
+        # Feed fields separately (no concatenated copy of the content); the unit
+        # separator keeps ("ab", "c") and ("a", "bc") from colliding
+        hasher = hashlib.blake2b(digest_size=32)
+        for value in values:
+            hasher.update(str(value).encode('utf-8'))
+            hasher.update(b'\x1f')
+        return hasher.hexdigest()
+
+    async def _enrich_materials(self, materials: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Enrich a list of materials with two bulk queries instead of two per material"""
+        if not materials:
+            return materials
+        
+        material_ids = [material['id'] for material in materials]
+        try:
+            files_map, views_map = await asyncio.gather(
+                self.db.get_material_files_bulk(material_ids),
+                self.db.get_material_view_stats_bulk(material_ids)
+            )
+        except Exception as e:
+            logger.error(f"Error fetching material files/view stats: {e}")
+            files_map, views_map = {}, {}
+        
+        now_ts = self._epoch_seconds(datetime.now())
+        for material in materials:
+            self._apply_material_metadata(
+                material,
+                files_map.get(material['id'], []),
+                views_map.get(material['id'], {}),
+                now_ts
+            )
+        return materials
 
     async def _enrich_material_data(self, material: Dict[str, Any]) -> Dict[str, Any]:
         """Enrich material data with additional metadata"""
+        return (await self._enrich_materials([material]))[0]
+
+    def _apply_material_metadata(self, material: Dict[str, Any], files: List[Dict[str, Any]],
+                                 view_stats: Dict[str, Any], now_ts: float):
+        """Attach files, view stats, content metrics and relative time to a material"""
         try:
             # Add file information
-            files = await self.get_material_files(material['id'])
             material['files'] = files
             material['file_count'] = len(files)
             
             # Add view statistics if available
-            view_stats = await self.db.get_material_view_stats(material['id'])
             material['view_count'] = view_stats.get('view_count', 0)
             material['unique_viewers'] = view_stats.get('unique_viewers', 0)
             
@@ -350,39 +577,48 @@ class ContentService:
             material['content_length'] = content_length
             material['estimated_read_time'] = max(1, content_length // 200)  # ~200 words per minute
             
-            # Add relative time
-            now = datetime.now()
-            pub_date = material['date_published']
-            if isinstance(pub_date, str):
-                pub_date = datetime.fromisoformat(pub_date.replace('Z', '+00:00'))
-            
-            time_diff = now - pub_date
-            if time_diff.days > 0:
-                material['relative_time'] = f"منذ {time_diff.days} يوم"
-            elif time_diff.seconds > 3600:
-                hours = time_diff.seconds // 3600
-                material['relative_time'] = f"منذ {hours} ساعة"
-            else:
-                minutes = max(1, time_diff.seconds // 60)
-                material['relative_time'] = f"منذ {minutes} دقيقة"
+            # Add relative time (PostgreSQL rows carry date_published_ts already)
+            pub_ts = material.get('date_published_ts')
+            if pub_ts is None:
+                pub_ts = self._epoch_seconds(material['date_published'])
             
-            return material
+            diff = int(now_ts - pub_ts)
+            if diff >= 86400:
+                material['relative_time'] = f"منذ {diff // 86400} يوم"
+            elif diff > 3600:
+                material['relative_time'] = f"منذ {diff // 3600} ساعة"
+            else:
+                material['relative_time'] = f"منذ {max(1, diff // 60)} دقيقة"
             
         except Exception as e:
             logger.error(f"Error enriching material data: {e}")
-            return material
+
+    @staticmethod
+    def _epoch_seconds(value: Union[datetime, str]) -> float:
+        """Seconds since the epoch, matching EXTRACT(EPOCH ...) (naive values are read as UTC)"""
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
 
     def _get_current_week_number(self) -> int:
         """Get current academic week number"""
+        return self._week_for_day(date.today().toordinal())
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def _week_for_day(day_ordinal: int) -> int:
+        """Academic week for a date ordinal; keyed by day so it recomputes at rollover"""
         # This is a simple implementation - you can customize based on your academic calendar
-        now = datetime.now()
+        today = date.fromordinal(day_ordinal)
         # Assuming academic year starts in September
-        if now.month >= 9:
-            start_date = datetime(now.year, 9, 1)
+        if today.month >= 9:
+            start_date = date(today.year, 9, 1)
         else:
-            start_date = datetime(now.year - 1, 9, 1)
+            start_date = date(today.year - 1, 9, 1)
         
-        week_number = ((now - start_date).days // 7) + 1
+        week_number = ((today - start_date).days // 7) + 1
         return max(1, min(week_number, 36))  # Academic year typically has ~36 weeks
 
     async def cleanup_old_files(self, days_old: int = 90) -> int:
@@ -390,23 +626,43 @@ class ContentService:
         try:
             cutoff_date = datetime.now() - timedelta(days=days_old)
             old_files = await self.db.get_files_older_than(cutoff_date)
-            
-            deleted_count = 0
-            for file_info in old_files:
-                try:
-                    file_path = Path(file_info['file_path'])
-                    if file_path.exists():
-                        file_path.unlink()
-                    
-                    await self.db.delete_material_file(file_info['id'])
-                    deleted_count += 1
-                    
-                except Exception as e:
-                    logger.error(f"Error deleting file {file_info['id']}: {e}")
+            if not old_files:
+                return 0
+            
+            # Unlink in batches, one worker-thread hop per batch, batches in parallel
+            paths = [file_info['file_path'] for file_info in old_files]
+            batch_results = await asyncio.gather(*(
+                asyncio.to_thread(self._unlink_batch, paths[i:i + self.UNLINK_BATCH_SIZE])
+                for i in range(0, len(paths), self.UNLINK_BATCH_SIZE)
+            ))
+            results = [result for batch in batch_results for result in batch]
+            
+            # A missing file counts as removed
+            removed_ids = []
+            for file_info, result in zip(old_files, results):
+                if result is not None and not isinstance(result, FileNotFoundError):
+                    logger.error(f"Error deleting file {file_info['id']}: {result}")
+                else:
+                    removed_ids.append(file_info['id'])
+            
+            # One statement for all file records
+            deleted_count = await self.db.delete_material_files_bulk(removed_ids) if removed_ids else 0
             
             logger.info(f"Cleaned up {deleted_count} old files")
             return deleted_count
             
         except Exception as e:
             logger.error(f"Error during file cleanup: {e}")
-            return 0
\ No newline at end of file
+            return 0
+
+    @staticmethod
+    def _unlink_batch(paths: List[str]) -> List[Optional[OSError]]:
+        """Unlink each path, returning None or the error for each (runs in a worker thread)"""
+        results = []
+        for path in paths:
+            try:
+                os.unlink(path)
+                results.append(None)
+            except OSError as e:
+                results.append(e)
+        return results
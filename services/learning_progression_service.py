@@ -3,14 +3,66 @@ Learning Progression Service
 Manages the 2-year sustainable learning flow with weekly content and progressive quizzes
 """
 
+import asyncio
+import json
 import logging
+import os
 from typing import Dict, List, Optional, Any, Tuple
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from enum import Enum
+from functools import lru_cache
+
+from utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
 
+def _now_iso() -> str:
+    """UTC timestamp for activity metadata, second precision"""
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+@lru_cache(maxsize=256)
+def _next_milestone(current_week: int, week_index: int, weeks_per_cycle: int) -> Dict[str, Any]:
+    """Next cumulative-quiz milestone for a week; memoized, treat as read-only"""
+    weeks_to_cumulative = weeks_per_cycle - 1 - week_index
+    if weeks_to_cumulative == 0:
+        return {
+            'type': 'cumulative_quiz',
+            'description': f'اختبار شامل للأسابيع {current_week - 2}-{current_week}',
+            'weeks_away': 0
+        }
+    else:
+        target_week = current_week + weeks_to_cumulative
+        return {
+            'type': 'cumulative_quiz',
+            'description': f'اختبار شامل قادم في الأسبوع {target_week}',
+            'weeks_away': weeks_to_cumulative
+        }
+
+
+@lru_cache(maxsize=256)
+def _cumulative_options_json(week: int) -> str:
+    """Serialized options of a generated cumulative question for a week, shared across quizzes"""
+    return json.dumps({
+        'A': f'الخيار الأول للأسبوع {week}',
+        'B': f'الخيار الثاني للأسبوع {week}',
+        'C': f'الخيار الثالث للأسبوع {week}',
+        'D': f'الخيار الرابع للأسبوع {week}'
+    }, ensure_ascii=False)
+
+
+@lru_cache(maxsize=512)
+def _describe(template: str, *args) -> str:
+    """Fill a description template; repeated requests for a week share one string"""
+    return template.format(*args)
+
+
+async def _false() -> bool:
+    """Awaitable stand-in for a check that does not apply"""
+    return False
+
+
 class QuizType(Enum):
     """Types of quizzes in the learning system"""
     WEEKLY = "weekly"           # Single question after each week
@@ -35,6 +87,20 @@ class LearningProgressionService:
     - Repeat cycle with increasing complexity
     """
     
+    # Options of the generated weekly question never change; serialize them once
+    _WEEKLY_OPTIONS_JSON = json.dumps({
+        'A': 'الخيار الأول',
+        'B': 'الخيار الثاني',
+        'C': 'الخيار الثالث',
+        'D': 'الخيار الرابع'
+    }, ensure_ascii=False)
+    
+    # Description templates for phases and placeholder content
+    _DESC_CONTENT = 'مراجعة محتوى الأسبوع {}'
+    _DESC_WEEKLY = 'اختبار الأسبوع {} (سؤال واحد)'
+    _DESC_CUMULATIVE = 'اختبار شامل للأسابيع {}-{} ({}-{} أسئلة)'
+    _DESC_PLACEHOLDER = 'المحتوى التعليمي للأسبوع {} - سيتم إضافته قريباً'
+    
     def __init__(self, db_manager, content_service, quiz_service):
         self.db = db_manager
         self.content_service = content_service
@@ -46,74 +112,110 @@ class LearningProgressionService:
         self.CUMULATIVE_QUIZ_MIN_QUESTIONS = 5
         self.CUMULATIVE_QUIZ_MAX_QUESTIONS = 10
         
+        # Percent of the programme covered per completed week
+        self._percent_scale = 100 / self.MAX_WEEKS
+        
+        # Difficulty by week, indexed directly (weeks past MAX_WEEKS use the last entry)
+        self._difficulty_for_week = (
+            ['easy'] * 11 + ['medium'] * 20 + ['hard'] * 30 + ['expert'] * (self.MAX_WEEKS + 1 - 61)
+        )
+        
+        # Cumulative-quiz weeks (every WEEKS_PER_CYCLE-th week), indexed directly
+        self._cumulative_weeks = tuple(
+            w > 0 and w % self.WEEKS_PER_CYCLE == 0 for w in range(self.MAX_WEEKS + 2)
+        )
+        
+        # Generated quizzes do not change; every student in a section shares these lookups
+        self._quiz_cache = TTLCache(ttl=int(os.getenv('LEARNING_QUIZ_CACHE_TTL', '3600')), maxsize=4096)
+        
+        # Bound concurrent queries from gather/TaskGroup fan-out so the pool is not starved
+        self._db_sem = asyncio.Semaphore(int(os.getenv('LEARNING_MAX_CONCURRENT_DB_OPS', '8')))
+        
+        # Student rows are read several times per progression turn; keep them briefly
+        self._student_cache = TTLCache(ttl=int(os.getenv('LEARNING_STUDENT_CACHE_TTL', '60')))
+        
     async def get_student_current_phase(self, student_id: int) -> Tuple[int, LearningPhase, Dict[str, Any]]:
         """
         Get student's current learning phase and week
         Returns: (current_week, phase, phase_data)
         """
-        student = await self.db.get_student_by_id(student_id)
-        if not student:
+        # Actual week (a student who is behind resumes at completed_weeks + 1)
+        # and its completion flags come back in a single query
+        state = await self.db.get_student_phase_state(student_id)
+        if not state:
             raise ValueError("Student not found")
-            
-        current_week = student.get('current_week', 1)
-        completed_weeks = student.get('completed_weeks', 0)
         
-        # Determine current phase
-        if current_week > completed_weeks + 1:
-            # Student is behind - need to complete previous content
-            actual_week = completed_weeks + 1
-        else:
-            actual_week = current_week
-            
-        phase_data = await self._determine_phase_for_week(student_id, actual_week)
+        actual_week = state['week']
+        phase_data = self._phase_for_week(
+            actual_week,
+            state['content_completed'],
+            state['weekly_quiz_completed'],
+            state['cumulative_quiz_completed']
+        )
+        
+        if phase_data is None:
+            # All requirements met - advance to next week
+            await self._advance_student_week(student_id)
+            phase_data = await self._determine_phase_for_week(student_id, actual_week + 1)
         
         return actual_week, phase_data['phase'], phase_data
     
     async def _determine_phase_for_week(self, student_id: int, week: int) -> Dict[str, Any]:
         """Determine what phase the student should be in for a given week"""
-        
-        # Check if content for this week has been consumed
-        content_completed = await self._is_week_content_completed(student_id, week)
-        
-        # Check if weekly quiz has been taken
-        weekly_quiz_completed = await self._is_weekly_quiz_completed(student_id, week)
-        
-        # Check if it's a cumulative quiz week (every 3rd week)
-        is_cumulative_week = week % self.WEEKS_PER_CYCLE == 0
-        
+        while True:
+            # Check if it's a cumulative quiz week (every 3rd week)
+            is_cumulative_week = self._is_cumulative_week(week)
+            
+            # Content, weekly quiz and cumulative quiz checks are independent - run them together
+            content_completed, weekly_quiz_completed, cumulative_completed = await asyncio.gather(
+                self._is_week_content_completed(student_id, week),
+                self._is_weekly_quiz_completed(student_id, week),
+                self._is_cumulative_quiz_completed(student_id, week) if is_cumulative_week else _false()
+            )
+            
+            phase_data = self._phase_for_week(week, content_completed, weekly_quiz_completed, cumulative_completed)
+            if phase_data is not None:
+                return phase_data
+            
+            # All requirements met - advance to next week and check it
+            await self._advance_student_week(student_id)
+            week += 1
+    
+    def _phase_for_week(self, week: int, content_completed: bool, weekly_quiz_completed: bool,
+                        cumulative_completed: bool) -> Optional[Dict[str, Any]]:
+        """Pick the phase for a week from its completion flags; None when the week is done"""
         if not content_completed:
             return {
                 'phase': LearningPhase.CONTENT,
                 'week': week,
-                'description': f'مراجعة محتوى الأسبوع {week}'
+                'description': _describe(self._DESC_CONTENT, week)
             }
             
         elif not weekly_quiz_completed:
             return {
                 'phase': LearningPhase.WEEKLY_QUIZ,
                 'week': week,
-                'description': f'اختبار الأسبوع {week} (سؤال واحد)'
+                'description': _describe(self._DESC_WEEKLY, week)
             }
             
-        elif is_cumulative_week:
-            cumulative_completed = await self._is_cumulative_quiz_completed(student_id, week)
-            if not cumulative_completed:
-                start_week = week - self.WEEKS_PER_CYCLE + 1
-                return {
-                    'phase': LearningPhase.CUMULATIVE_QUIZ,
-                    'week': week,
-                    'start_week': start_week,
-                    'end_week': week,
-                    'description': f'اختبار شامل للأسابيع {start_week}-{week} ({self.CUMULATIVE_QUIZ_MIN_QUESTIONS}-{self.CUMULATIVE_QUIZ_MAX_QUESTIONS} أسئلة)'
-                }
+        elif not cumulative_completed and self._is_cumulative_week(week):
+            start_week = week - self.WEEKS_PER_CYCLE + 1
+            return {
+                'phase': LearningPhase.CUMULATIVE_QUIZ,
+                'week': week,
+                'start_week': start_week,
+                'end_week': week,
+                'description': _describe(
+                    self._DESC_CUMULATIVE, start_week, week,
+                    self.CUMULATIVE_QUIZ_MIN_QUESTIONS, self.CUMULATIVE_QUIZ_MAX_QUESTIONS
+                )
+            }
         
-        # All requirements met - advance to next week
-        await self._advance_student_week(student_id)
-        return await self._determine_phase_for_week(student_id, week + 1)
+        return None
     
     async def get_week_content(self, student_id: int, week: int) -> List[Dict[str, Any]]:
         """Get content materials for a specific week"""
-        student = await self.db.get_student_by_id(student_id)
+        student = await self._get_student(student_id)
         section = student.get('section', 'الصف الأول')
         
         materials = await self.db.get_materials_by_section_and_week(section, week)
@@ -124,7 +226,7 @@ class LearningProgressionService:
             return [{
                 'id': f'placeholder_{week}',
                 'title': f'محتوى الأسبوع {week}',
-                'description': f'المحتوى التعليمي للأسبوع {week} - سيتم إضافته قريباً',
+                'description': _describe(self._DESC_PLACEHOLDER, week),
                 'content': f'هذا الأسبوع سنتعلم مواضيع مهمة في الأسبوع {week}',
                 'week_number': week,
                 'section': section,
@@ -135,7 +237,7 @@ class LearningProgressionService:
     
     async def generate_weekly_quiz(self, student_id: int, week: int) -> Dict[str, Any]:
         """Generate or get weekly quiz (single question)"""
-        student = await self.db.get_student_by_id(student_id)
+        student = await self._get_student(student_id)
         section = student.get('section', 'الصف الأول')
         
         # Try to find existing weekly quiz
@@ -157,39 +259,25 @@ class LearningProgressionService:
             'difficulty_level': self._calculate_difficulty_for_week(week)
         }
         
-        quiz_id = await self.db.create_quiz(quiz_data)
-        
         # Generate single question
         question_data = {
-            'quiz_id': quiz_id,
             'question_text': f'سؤال حول محتوى الأسبوع {week}',
             'question_type': 'multiple_choice',
-            'options': {
-                'A': 'الخيار الأول',
-                'B': 'الخيار الثاني', 
-                'C': 'الخيار الثالث',
-                'D': 'الخيار الرابع'
-            },
+            'options': self._WEEKLY_OPTIONS_JSON,
             'correct_answer': 'A',
             'explanation': f'شرح الإجابة للأسبوع {week}',
             'points': 1,
             'order_index': 1
         }
         
-        await self.db.create_question(question_data)
-        
-        # Update quiz totals
-        async with self.db.get_connection() as conn:
-            await conn.execute('''
-                UPDATE quizzes SET total_questions = 1, total_points = 1 
-                WHERE id = $1
-            ''', quiz_id)
-        
-        return await self.db.get_quiz_by_id(quiz_id)
+        # Quiz, question and totals are written in one statement
+        quiz = await self.db.create_quiz_bundle(quiz_data, [question_data])
+        self._quiz_cache.set((QuizType.WEEKLY.value, section, week), quiz)
+        return quiz
     
     async def generate_cumulative_quiz(self, student_id: int, end_week: int) -> Dict[str, Any]:
         """Generate cumulative quiz for a 3-week cycle"""
-        student = await self.db.get_student_by_id(student_id)
+        student = await self._get_student(student_id)
         section = student.get('section', 'الصف الأول')
         
         start_week = end_week - self.WEEKS_PER_CYCLE + 1
@@ -219,49 +307,34 @@ class LearningProgressionService:
             'difficulty_level': self._calculate_difficulty_for_week(end_week)
         }
         
-        quiz_id = await self.db.create_quiz(quiz_data)
-        
         # Generate questions covering the week range
-        total_points = 0
+        questions = []
         for i in range(num_questions):
             week_focus = start_week + (i % self.WEEKS_PER_CYCLE)
             points = 1 + (i // 5)  # Increase points for later questions
             
-            question_data = {
-                'quiz_id': quiz_id,
+            questions.append({
                 'question_text': f'سؤال رقم {i+1} - محتوى الأسبوع {week_focus}',
                 'question_type': 'multiple_choice',
-                'options': {
-                    'A': f'الخيار الأول للأسبوع {week_focus}',
-                    'B': f'الخيار الثاني للأسبوع {week_focus}',
-                    'C': f'الخيار الثالث للأسبوع {week_focus}',
-                    'D': f'الخيار الرابع للأسبوع {week_focus}'
-                },
+                'options': _cumulative_options_json(week_focus),
                 'correct_answer': ['A', 'B', 'C', 'D'][i % 4],
                 'explanation': f'شرح السؤال {i+1} للأسبوع {week_focus}',
                 'points': points,
                 'order_index': i + 1,
                 'difficulty': self._calculate_difficulty_for_week(week_focus)
-            }
-            
-            await self.db.create_question(question_data)
-            total_points += points
+            })
         
-        # Update quiz totals
-        async with self.db.get_connection() as conn:
-            await conn.execute('''
-                UPDATE quizzes SET total_questions = $1, total_points = $2 
-                WHERE id = $3
-            ''', num_questions, total_points, quiz_id)
-        
-        return await self.db.get_quiz_by_id(quiz_id)
+        # Quiz, questions and totals are written in one statement
+        quiz = await self.db.create_quiz_bundle(quiz_data, questions)
+        self._quiz_cache.set((QuizType.CUMULATIVE.value, section, start_week, end_week), quiz)
+        return quiz
     
     async def mark_content_completed(self, student_id: int, week: int):
         """Mark weekly content as completed for student"""
         await self.db.log_activity(
             student_id, 
             'content_completed', 
-            {'week': week, 'timestamp': datetime.now().isoformat()}
+            {'week': week, 'timestamp': _now_iso()}
         )
     
     async def mark_quiz_completed(self, student_id: int, quiz_id: int, quiz_type: str):
@@ -276,83 +349,117 @@ class LearningProgressionService:
                 'quiz_id': quiz_id,
                 'week': week,
                 'quiz_type': quiz_type,
-                'timestamp': datetime.now().isoformat()
+                'timestamp': _now_iso()
             }
         )
         
         # Check if student should advance
         if quiz_type == QuizType.CUMULATIVE.value or (
-            quiz_type == QuizType.WEEKLY.value and week % self.WEEKS_PER_CYCLE != 0
+            quiz_type == QuizType.WEEKLY.value and not self._is_cumulative_week(week)
         ):
             await self._advance_student_week(student_id)
     
     async def get_student_progress_summary(self, student_id: int) -> Dict[str, Any]:
         """Get comprehensive progress summary for student"""
-        student = await self.db.get_student_by_id(student_id)
+        # Student row and recent activities are independent - fetch them on separate pool connections
+        async with asyncio.TaskGroup() as tg:
+            student_task = tg.create_task(self._get_student(student_id))
+            activities_task = tg.create_task(self._guarded(self.db.get_student_recent_activities(student_id, days=7)))
+        student = student_task.result()
+        recent_activities = activities_task.result()
+        
         current_week = student.get('current_week', 1)
         completed_weeks = student.get('completed_weeks', 0)
         
         # Calculate progress metrics
-        total_progress = (completed_weeks / self.MAX_WEEKS) * 100
-        current_cycle = (current_week - 1) // self.WEEKS_PER_CYCLE + 1
-        week_in_cycle = ((current_week - 1) % self.WEEKS_PER_CYCLE) + 1
-        
-        # Get recent activities
-        recent_activities = await self.db.get_student_recent_activities(student_id, days=7)
+        total_progress = completed_weeks * self._percent_scale
+        cycle_index, week_index = divmod(current_week - 1, self.WEEKS_PER_CYCLE)
         
         return {
             'student_id': student_id,
             'current_week': current_week,
             'completed_weeks': completed_weeks,
             'total_progress_percent': round(total_progress, 1),
-            'current_cycle': current_cycle,
-            'week_in_cycle': week_in_cycle,
+            'current_cycle': cycle_index + 1,
+            'week_in_cycle': week_index + 1,
             'weeks_remaining': self.MAX_WEEKS - current_week,
             'recent_activities': recent_activities[:5],  # Last 5 activities
-            'next_milestone': self._get_next_milestone(current_week)
+            'next_milestone': self._get_next_milestone(current_week, week_index)
         }
     
+    async def get_cohort_week_status(self, student_ids: List[int], week: int) -> Dict[int, Dict[str, Any]]:
+        """
+        Get the phase for a week for many students (e.g. a whole section) in one query
+        Students who finished the week map to {'week': week, 'completed': True}; nobody is advanced
+        """
+        completion = await self.db.get_week_completion_bulk(student_ids, week) if student_ids else {}
+        
+        status = {}
+        for student_id in student_ids:
+            flags = completion.get(student_id, {})
+            phase_data = self._phase_for_week(
+                week,
+                flags.get('content_completed', False),
+                flags.get('weekly_quiz_completed', False),
+                flags.get('cumulative_quiz_completed', False)
+            )
+            status[student_id] = phase_data or {'week': week, 'completed': True}
+        return status
+    
+    def invalidate_student(self, student_id: Optional[int] = None):
+        """Drop one cached student row, or all of them (e.g. after a section change)"""
+        if student_id is None:
+            self._student_cache.invalidate()
+        else:
+            self._student_cache.invalidate(student_id)
+    
     # Private helper methods
     
+    async def _guarded(self, awaitable):
+        """Await a DB call while holding one of the service's DB slots"""
+        async with self._db_sem:
+            return await awaitable
+    
+    async def _get_student(self, student_id: int) -> Optional[Dict[str, Any]]:
+        """Get a student row through the short-lived cache (treat as read-only)"""
+        student = self._student_cache.get(student_id)
+        if student is None:
+            student = await self._guarded(self.db.get_student_by_id(student_id))
+            if student:
+                self._student_cache.set(student_id, student)
+        return student
+    
     async def _is_week_content_completed(self, student_id: int, week: int) -> bool:
         """Check if student has completed content for a specific week"""
-        activities = await self.db.get_student_activities_by_type(
-            student_id, 'content_completed'
-        )
-        return any(
-            activity.get('metadata', {}).get('week') == week 
-            for activity in activities
-        )
+        return await self._guarded(self.db.student_activity_exists(student_id, 'content_completed', week))
     
     async def _is_weekly_quiz_completed(self, student_id: int, week: int) -> bool:
         """Check if student has completed weekly quiz"""
-        activities = await self.db.get_student_activities_by_type(
-            student_id, 'weekly_quiz_completed'
-        )
-        return any(
-            activity.get('metadata', {}).get('week') == week 
-            for activity in activities
-        )
+        return await self._guarded(self.db.student_activity_exists(student_id, 'weekly_quiz_completed', week))
     
     async def _is_cumulative_quiz_completed(self, student_id: int, end_week: int) -> bool:
         """Check if student has completed cumulative quiz for cycle"""
-        activities = await self.db.get_student_activities_by_type(
-            student_id, 'cumulative_quiz_completed'
-        )
-        return any(
-            activity.get('metadata', {}).get('week') == end_week 
-            for activity in activities
-        )
+        return await self._guarded(self.db.student_activity_exists(student_id, 'cumulative_quiz_completed', end_week))
     
     async def _find_weekly_quiz(self, section: str, week: int) -> Optional[Dict[str, Any]]:
         """Find existing weekly quiz"""
-        # Implementation depends on your quiz storage structure
-        return None  # Placeholder
+        cache_key = (QuizType.WEEKLY.value, section, week)
+        quiz = self._quiz_cache.get(cache_key)
+        if quiz is None:
+            quiz = await self.db.get_quiz_by_type_and_week(section, QuizType.WEEKLY.value, week)
+            if quiz:
+                self._quiz_cache.set(cache_key, quiz)
+        return quiz
     
     async def _find_cumulative_quiz(self, section: str, start_week: int, end_week: int) -> Optional[Dict[str, Any]]:
         """Find existing cumulative quiz"""
-        # Implementation depends on your quiz storage structure  
-        return None  # Placeholder
+        cache_key = (QuizType.CUMULATIVE.value, section, start_week, end_week)
+        quiz = self._quiz_cache.get(cache_key)
+        if quiz is None:
+            quiz = await self.db.get_cumulative_quiz(section, start_week, end_week)
+            if quiz:
+                self._quiz_cache.set(cache_key, quiz)
+        return quiz
     
     async def _advance_student_week(self, student_id: int):
         """Advance student to next week"""
@@ -364,31 +471,21 @@ class LearningProgressionService:
                     last_activity = CURRENT_TIMESTAMP
                 WHERE id = $1
             ''', student_id)
+        self._student_cache.invalidate(student_id)
+    
+    def _is_cumulative_week(self, week: int) -> bool:
+        """Check if a week ends a cycle and carries a cumulative quiz"""
+        if 0 <= week <= self.MAX_WEEKS + 1:
+            return self._cumulative_weeks[week]
+        return week % self.WEEKS_PER_CYCLE == 0
     
     def _calculate_difficulty_for_week(self, week: int) -> str:
         """Calculate appropriate difficulty level for week"""
-        if week <= 10:
-            return 'easy'
-        elif week <= 30:
-            return 'medium'
-        elif week <= 60:
-            return 'hard'
-        else:
-            return 'expert'
+        return self._difficulty_for_week[max(0, min(week, self.MAX_WEEKS))]
     
-    def _get_next_milestone(self, current_week: int) -> Dict[str, Any]:
-        """Get information about the next learning milestone"""
-        if current_week % self.WEEKS_PER_CYCLE == 0:
-            return {
-                'type': 'cumulative_quiz',
-                'description': f'اختبار شامل للأسابيع {current_week - 2}-{current_week}',
-                'weeks_away': 0
-            }
-        else:
-            weeks_to_cumulative = self.WEEKS_PER_CYCLE - (current_week % self.WEEKS_PER_CYCLE)
-            target_week = current_week + weeks_to_cumulative
-            return {
-                'type': 'cumulative_quiz',
-                'description': f'اختبار شامل قادم في الأسبوع {target_week}',
-                'weeks_away': weeks_to_cumulative
-            }
\ No newline at end of file
+    def _get_next_milestone(self, current_week: int, week_index: Optional[int] = None) -> Dict[str, Any]:
+        """Get information about the next learning milestone (week_index: 0-based week in cycle)"""
+        if week_index is None:
+            week_index = (current_week - 1) % self.WEEKS_PER_CYCLE
+        # Copy so callers cannot mutate the memoized entry
+        return dict(_next_milestone(current_week, week_index, self.WEEKS_PER_CYCLE))
@@ -1,26 +1,130 @@
 import logging
-from typing import Dict, List, Optional, Any, Union
+from typing import Dict, List, Optional, Any, Tuple, Union
 from datetime import datetime, timedelta
 import asyncio
+import io
 import json
+import os
 import random
+import re
+import tempfile
+from dataclasses import dataclass
 from pathlib import Path
 import aiofiles
 import openpyxl
 
+# Rust-based xlsx reader; openpyxl is used when it is not installed
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+# Streaming xlsx writer; openpyxl's write-only mode is used when it is not installed
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+# C++ string similarity; _indel_ratio below computes the same scores when it is not installed
+try:
+    from rapidfuzz import fuzz
+except ImportError:
+    fuzz = None
+
+# Rust JSON encoder for question options; stdlib json is used when it is not installed
+try:
+    import orjson
+
+    def _dumps(value: Any) -> str:
+        return orjson.dumps(value).decode()
+except ImportError:
+    def _dumps(value: Any) -> str:
+        return json.dumps(value)
+
 from models import get_database_manager
+from utils.ttl_cache import TTLCache, invalidate_local, register_invalidator
 
 logger = logging.getLogger(__name__)
 
 # Fixed pandas import issue - service v2.1
 
+# Directories already created by this process
+_created_dirs = set()
+
+
+def _ensure_dir(path: Path):
+    """Create a directory once per process rather than once per service instance"""
+    if path not in _created_dirs:
+        path.mkdir(exist_ok=True)
+        _created_dirs.add(path)
+
+
+def _indel_ratio(a: str, b: str) -> float:
+    """Normalized indel similarity 0-100, the score rapidfuzz's fuzz.ratio returns"""
+    total = len(a) + len(b)
+    if not total:
+        return 100.0
+    # Longest common subsequence, one row at a time
+    previous = [0] * (len(b) + 1)
+    for char in a:
+        current = [0]
+        for j, other in enumerate(b):
+            current.append(previous[j] + 1 if char == other else max(previous[j + 1], current[j]))
+        previous = current
+    return 100.0 * (1 - (total - 2 * previous[-1]) / total)
+
+
+@dataclass(slots=True)
+class AnswerKey:
+    """The parts of a question row that grading needs, with the correct answer pre-normalized"""
+    quiz_id: int
+    question_type: str
+    correct_answer: str
+    points: float
+    
+    @classmethod
+    def from_row(cls, question: Dict[str, Any]) -> 'AnswerKey':
+        return cls(
+            question['quiz_id'],
+            question['question_type'],
+            (question.get('correct_answer') or '').strip().lower(),
+            question['points']
+        )
+
 class QuizService:
     """Service for managing quizzes and Excel parsing functionality"""
     
+    # Excel parsing constants
+    EMPTY_CELL_VALUES = frozenset({'nan', 'none', ''})
+    TRUE_FALSE_RE = re.compile(r'صح\s*[أ/]\s*م?\s*خطأ|true\s*or\s*false', re.IGNORECASE)
+    TRUE_ANSWER_VALUES = frozenset({'true', 'صح', 'صحيح', '1', 'yes', 'نعم'})
+    DIFFICULTY_ALIASES = {
+        'easy': 'easy', 'medium': 'medium', 'hard': 'hard',
+        'سهل': 'easy', 'متوسط': 'medium', 'صعب': 'hard'
+    }
+    _TRUE_FALSE_OPTIONS_JSON = json.dumps({'A': 'صح', 'B': 'خطأ'})
+    
+    # Column order of the quiz results export
+    RESULTS_EXPORT_COLUMNS = (
+        'Student Name', 'Attempt', 'Score (%)', 'Points', 'Status', 'Time Taken (min)', 'Completion Date'
+    )
+    
+    # Arabic diacritics/tatweel and runs of whitespace or underscores, ignored when matching headers
+    _HEADER_NOISE_RE = re.compile(r'[\u064B-\u0652\u0640]')
+    _HEADER_SPACE_RE = re.compile(r'[\s_]+')
+    
     def __init__(self, db_manager):
         self.db = db_manager
+        
+        # Quiz rows are re-read on every answer submission; keep them briefly
+        self._quiz_cache = TTLCache(ttl=int(os.getenv('QUIZ_CACHE_TTL', '60')), maxsize=512)
+        self._answer_key_cache = TTLCache(ttl=int(os.getenv('QUIZ_CACHE_TTL', '60')), maxsize=8192)
+        register_invalidator('quiz', self.invalidate_quiz)
+        
+        # Uploads above this size are parsed from a temporary file instead of an in-memory buffer
+        self.excel_spool_threshold = int(os.getenv('QUIZ_EXCEL_SPOOL_BYTES', str(10 * 1024 * 1024)))
         self.quiz_templates_dir = Path("quiz_templates")
-        self.quiz_templates_dir.mkdir(exist_ok=True)
+        _ensure_dir(self.quiz_templates_dir)
         
         # Supported question types
         self.question_types = {
@@ -31,6 +135,14 @@ class QuizService:
             'essay': 'مقال'
         }
         
+        # Answer matchers by question type, as (normalized student answer, normalized correct answer)
+        self._answer_evaluators = {
+            'multiple_choice': self._match_choice,
+            'true_false': self._match_true_false,
+            'fill_in_blank': self._match_blank,
+            'short_answer': self._fuzzy_match
+        }
+        
         # Excel column mappings for quiz import
         self.excel_column_mappings = {
             'question': ['question', 'سؤال', 'Question', 'السؤال'],
@@ -43,6 +155,13 @@ class QuizService:
             'difficulty': ['difficulty', 'صعوبة', 'مستوى', 'Difficulty'],
             'points': ['points', 'نقاط', 'درجة', 'Points', 'Score']
         }
+        
+        # Normalized alias -> field, so header mapping is one lookup per column
+        self._alias_to_field = {
+            self._normalize_header(alias): field
+            for field, aliases in self.excel_column_mappings.items()
+            for alias in aliases
+        }
 
     async def create_quiz(self, quiz_data: Dict[str, Any]) -> int:
         """Create a new quiz"""
@@ -64,18 +183,23 @@ class QuizService:
             quiz_data.setdefault('created_date', datetime.now())
             quiz_data.setdefault('difficulty_level', 'medium')
             
-            # Calculate total points if not provided
-            if 'questions' in quiz_data and 'total_points' not in quiz_data:
-                total_points = sum(q.get('points', 1) for q in quiz_data['questions'])
-                quiz_data['total_points'] = total_points
+            # Validate questions up front so a bad one does not leave an empty quiz behind
+            questions = quiz_data.get('questions')
+            if questions is not None:
+                for question_data in questions:
+                    self._prepare_question(question_data)
+                
+                # Calculate totals if not provided
+                quiz_data.setdefault('total_points', sum(q['points'] for q in questions))
+                quiz_data.setdefault('total_questions', len(questions))
             
             quiz_id = await self.db.create_quiz(quiz_data)
             
-            # Add questions if provided
-            if 'questions' in quiz_data:
-                for question_data in quiz_data['questions']:
+            # Add questions if provided, in one batched insert
+            if questions:
+                for question_data in questions:
                     question_data['quiz_id'] = quiz_id
-                    await self.create_question(question_data)
+                await self.db.bulk_create_questions(questions)
             
             logger.info(f"Created quiz: {quiz_data['title']} (ID: {quiz_id})")
             return quiz_id
@@ -87,35 +211,14 @@ class QuizService:
     async def create_question(self, question_data: Dict[str, Any]) -> int:
         """Create a new quiz question"""
         try:
-            # Validate required fields
-            required_fields = ['quiz_id', 'question_text', 'question_type']
-            for field in required_fields:
-                if field not in question_data:
-                    raise ValueError(f"Missing required field: {field}")
+            if 'quiz_id' not in question_data:
+                raise ValueError("Missing required field: quiz_id")
             
-            # Set default values
-            question_data.setdefault('points', 1)
-            question_data.setdefault('order_index', 0)
-            question_data.setdefault('is_required', True)
-            
-            # Validate question type
-            if question_data['question_type'] not in self.question_types:
-                raise ValueError(f"Invalid question type: {question_data['question_type']}")
-            
-            # Process options for multiple choice questions
-            if question_data['question_type'] == 'multiple_choice':
-                if 'options' not in question_data or len(question_data['options']) < 2:
-                    raise ValueError("Multiple choice questions must have at least 2 options")
-                
-                # Ensure options are properly formatted
-                options = question_data['options']
-                if isinstance(options, dict):
-                    question_data['options'] = json.dumps(options)
-                elif isinstance(options, list):
-                    options_dict = {chr(65 + i): option for i, option in enumerate(options)}
-                    question_data['options'] = json.dumps(options_dict)
+            self._prepare_question(question_data)
             
             question_id = await self.db.create_question(question_data)
+            # The cached quiz row no longer matches its question set (in every service instance)
+            invalidate_local('quiz', question_data['quiz_id'])
             
             logger.info(f"Created question for quiz {question_data['quiz_id']} (ID: {question_id})")
             return question_id
@@ -124,41 +227,63 @@ class QuizService:
             logger.error(f"Error creating question: {e}")
             raise
 
+    def _prepare_question(self, question_data: Dict[str, Any]):
+        """Validate question data, fill defaults and serialize options in place"""
+        # Validate required fields
+        required_fields = ['question_text', 'question_type']
+        for field in required_fields:
+            if field not in question_data:
+                raise ValueError(f"Missing required field: {field}")
+        
+        # Set default values
+        question_data.setdefault('points', 1)
+        question_data.setdefault('order_index', 0)
+        question_data.setdefault('is_required', True)
+        
+        # Validate question type
+        if question_data['question_type'] not in self.question_types:
+            raise ValueError(f"Invalid question type: {question_data['question_type']}")
+        
+        # Process options for multiple choice questions
+        if question_data['question_type'] == 'multiple_choice':
+            if 'options' not in question_data or len(question_data['options']) < 2:
+                raise ValueError("Multiple choice questions must have at least 2 options")
+            
+            # Ensure options are properly formatted
+            options = question_data['options']
+            if isinstance(options, dict):
+                question_data['options'] = _dumps(options)
+            elif isinstance(options, list):
+                options_dict = {chr(65 + i): option for i, option in enumerate(options)}
+                question_data['options'] = _dumps(options_dict)
+
     async def import_quiz_from_excel(self, excel_data: bytes, quiz_metadata: Dict[str, Any]) -> int:
         """Import quiz questions from Excel file"""
         try:
             # Read Excel data
-            df = pd.read_excel(io.BytesIO(excel_data), engine='openpyxl')
+            columns, rows = await self._load_excel_rows(excel_data)
             
             # Map column names
-            column_mapping = self._map_excel_columns(df.columns.tolist())
+            column_mapping = self._map_excel_columns(columns)
             
             if 'question' not in column_mapping:
                 raise ValueError("Excel file must contain a question column")
             
-            # Create the quiz first
-            quiz_id = await self.create_quiz(quiz_metadata)
-            
-            # Process each row as a question
-            questions_created = 0
-            for index, row in df.iterrows():
+            # Parse the sheet column by column, then validate each question
+            questions = []
+            for index, question_data in enumerate(self._parse_excel_rows(columns, rows, column_mapping)):
                 try:
-                    question_data = await self._parse_excel_row(row, column_mapping, quiz_id)
-                    if question_data:
-                        await self.create_question(question_data)
-                        questions_created += 1
+                    self._prepare_question(question_data)
+                    questions.append(question_data)
                 except Exception as e:
-                    logger.error(f"Error processing row {index + 1}: {e}")
+                    logger.error(f"Error processing question {index + 1}: {e}")
                     continue
             
-            # Update quiz with total questions and points
-            total_points = await self.db.get_quiz_total_points(quiz_id)
-            await self.db.update_quiz(quiz_id, {
-                'total_questions': questions_created,
-                'total_points': total_points
-            })
+            # Create the quiz with its totals, then insert all questions in one batch
+            quiz_metadata['questions'] = questions
+            quiz_id = await self.create_quiz(quiz_metadata)
             
-            logger.info(f"Imported {questions_created} questions from Excel for quiz {quiz_id}")
+            logger.info(f"Imported {len(questions)} questions from Excel for quiz {quiz_id}")
             return quiz_id
             
         except Exception as e:
@@ -170,13 +295,8 @@ class QuizService:
         try:
             quizzes = await self.db.get_active_quizzes_by_section(section)
             
-            # Enrich quiz data
-            enriched_quizzes = []
-            for quiz in quizzes:
-                enriched_quiz = await self._enrich_quiz_data(quiz)
-                enriched_quizzes.append(enriched_quiz)
-            
-            return enriched_quizzes
+            # Enrich quiz data concurrently
+            return list(await asyncio.gather(*(self._enrich_quiz_data(quiz) for quiz in quizzes)))
             
         except Exception as e:
             logger.error(f"Error fetching available quizzes: {e}")
@@ -230,8 +350,8 @@ class QuizService:
                                student_answer: str) -> bool:
         """Submit an answer for a quiz question"""
         try:
-            # Validate attempt is still active
-            attempt = await self.db.get_quiz_attempt(attempt_id)
+            # Validate attempt is still active (the quiz's time limit comes joined onto the attempt)
+            attempt = await self.db.get_attempt_context(attempt_id)
             if not attempt or attempt['status'] != 'in_progress':
                 return False
             
@@ -241,12 +361,12 @@ class QuizService:
                 return False
             
             # Get question details
-            question = await self.db.get_question_by_id(question_id)
-            if not question or question['quiz_id'] != attempt['quiz_id']:
+            answer_key = await self._get_answer_key(question_id)
+            if not answer_key or answer_key.quiz_id != attempt['quiz_id']:
                 return False
             
             # Evaluate answer
-            is_correct, points_earned = await self._evaluate_answer(question, student_answer)
+            is_correct, points_earned = await self._evaluate_answer(answer_key, student_answer)
             
             # Save answer
             answer_data = {
@@ -289,8 +409,9 @@ class QuizService:
             
             await self.db.update_quiz_attempt(attempt_id, attempt_updates)
             
-            # Update student progress
+            # Update student progress; cached analytics stats no longer hold
             await self._update_student_progress(attempt['student_id'], attempt['quiz_id'], results)
+            invalidate_local('student_stats', attempt['student_id'])
             
             logger.info(f"Completed quiz attempt {attempt_id} with score {results['score_percentage']}%")
             return results
@@ -304,15 +425,12 @@ class QuizService:
         try:
             results = await self.db.get_student_quiz_results(student_id, quiz_id)
             
-            # Enrich with additional data
-            enriched_results = []
+            # Quiz title and subject come joined onto each result row
             for result in results:
-                quiz_info = await self.db.get_quiz_by_id(result['quiz_id'])
-                result['quiz_title'] = quiz_info['title'] if quiz_info else 'Unknown Quiz'
-                result['quiz_subject'] = quiz_info['subject'] if quiz_info else 'Unknown'
-                enriched_results.append(result)
+                result['quiz_title'] = result.get('quiz_title') or 'Unknown Quiz'
+                result['quiz_subject'] = result.get('quiz_subject') or 'Unknown'
             
-            return enriched_results
+            return results
             
         except Exception as e:
             logger.error(f"Error fetching quiz results: {e}")
@@ -338,101 +456,204 @@ class QuizService:
             logger.error(f"Error fetching quiz analytics: {e}")
             return {}
 
+    async def _load_excel_rows(self, excel_data: bytes) -> Tuple[List[str], List[tuple]]:
+        """Parse an uploaded workbook off the event loop, spooling large uploads to disk"""
+        if len(excel_data) <= self.excel_spool_threshold:
+            return await asyncio.to_thread(self._read_excel_rows, excel_data)
+        
+        tmp_path = await asyncio.to_thread(self._spool_to_file, excel_data)
+        try:
+            return await asyncio.to_thread(self._read_excel_rows, tmp_path)
+        finally:
+            await asyncio.to_thread(os.unlink, tmp_path)
+    
+    @staticmethod
+    def _spool_to_file(data: bytes) -> str:
+        """Write data to a named temporary .xlsx file and return its path"""
+        with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as tmp:
+            tmp.write(data)
+            return tmp.name
+    
+    def _read_excel_rows(self, source: Union[bytes, str]) -> Tuple[List[str], List[tuple]]:
+        """Read the first sheet of a workbook (bytes or file path) as its header and value rows"""
+        if CalamineWorkbook is not None:
+            if isinstance(source, str):
+                workbook = CalamineWorkbook.from_path(source)
+            else:
+                workbook = CalamineWorkbook.from_filelike(io.BytesIO(source))
+            sheet_rows = iter(workbook.get_sheet_by_index(0).to_python(skip_empty_area=False))
+            return self._rows_from_sheet(sheet_rows)
+        
+        # Read-only mode streams rows instead of loading the whole cell tree
+        workbook = openpyxl.load_workbook(
+            source if isinstance(source, str) else io.BytesIO(source),
+            read_only=True, data_only=True, keep_links=False
+        )
+        try:
+            return self._rows_from_sheet(workbook.active.iter_rows(values_only=True))
+        finally:
+            workbook.close()
+    
+    def _rows_from_sheet(self, sheet_rows) -> Tuple[List[str], List[tuple]]:
+        """Split an iterator of row tuples into the header and the value rows"""
+        header = next(sheet_rows, None)
+        if not header:
+            raise ValueError("Excel file is empty")
+        columns = ['' if name is None else str(name) for name in header]
+        return columns, list(sheet_rows)
+
+    @classmethod
+    def _normalize_header(cls, name: str) -> str:
+        """Header text without diacritics, case or spacing differences"""
+        name = cls._HEADER_NOISE_RE.sub('', name)
+        return cls._HEADER_SPACE_RE.sub(' ', name).strip().lower()
+
     def _map_excel_columns(self, excel_columns: List[str]) -> Dict[str, str]:
         """Map Excel columns to expected field names"""
         column_mapping = {}
         
-        for field, possible_names in self.excel_column_mappings.items():
-            for col in excel_columns:
-                if col.strip().lower() in [name.lower() for name in possible_names]:
-                    column_mapping[field] = col
-                    break
+        for col in excel_columns:
+            field = self._alias_to_field.get(self._normalize_header(col))
+            # The first matching column wins for each field
+            if field is not None and field not in column_mapping:
+                column_mapping[field] = col
         
         return column_mapping
 
-    async def _parse_excel_row(self, row: Any, column_mapping: Dict[str, str], quiz_id: int) -> Optional[Dict[str, Any]]:
-        """Parse a single Excel row into question data"""
-        try:
-            question_text = str(row[column_mapping['question']]).strip()
-            if not question_text or question_text.lower() in ['nan', 'none', '']:
-                return None
-            
+    @classmethod
+    def _clean_cell(cls, value: Any) -> Optional[str]:
+        """Stripped cell text, or None for empty cells"""
+        if value is None or value == '':
+            return None
+        text = str(value).strip()
+        return None if text.lower() in cls.EMPTY_CELL_VALUES else text
+
+    def _parse_excel_rows(self, columns: List[str], rows: List[tuple],
+                          column_mapping: Dict[str, str]) -> List[Dict[str, Any]]:
+        """Parse sheet rows into question data, cleaning each mapped column in one pass"""
+        # Drop rows without question text before touching any other column
+        question_index = columns.index(column_mapping['question'])
+        question_texts = []
+        kept_rows = []
+        for row in rows:
+            question_text = self._clean_cell(row[question_index]) if question_index < len(row) else None
+            if question_text is not None:
+                question_texts.append(question_text)
+                kept_rows.append(row)
+        rows = kept_rows
+        
+        # Extract and clean every other mapped column once
+        cells = {}
+        for field, column in column_mapping.items():
+            if field == 'question':
+                continue
+            index = columns.index(column)
+            cells[field] = [
+                self._clean_cell(row[index]) if index < len(row) else None
+                for row in rows
+            ]
+        
+        missing = [None] * len(rows)
+        option_columns = [
+            (option_key[-1].upper(), cells[option_key])
+            for option_key in ('option_a', 'option_b', 'option_c', 'option_d')
+            if option_key in cells
+        ]
+        correct_answers = cells.get('correct_answer', missing)
+        explanations = cells.get('explanation', missing)
+        difficulties = cells.get('difficulty', missing)
+        points_values = cells.get('points', missing)
+        
+        questions = []
+        for i, question_text in enumerate(question_texts):
             question_data = {
-                'quiz_id': quiz_id,
                 'question_text': question_text,
                 'question_type': 'multiple_choice',  # Default type
                 'points': 1
             }
             
             # Check if it's a true/false question
-            if any(word in question_text.lower() for word in ['صح أم خطأ', 'true or false', 'صح/خطأ']):
+            if self.TRUE_FALSE_RE.search(question_text):
                 question_data['question_type'] = 'true_false'
-                question_data['options'] = json.dumps({'A': 'صح', 'B': 'خطأ'})
+                question_data['options'] = self._TRUE_FALSE_OPTIONS_JSON
             else:
                 # Handle multiple choice options
-                options = {}
-                for option_key in ['option_a', 'option_b', 'option_c', 'option_d']:
-                    if option_key in column_mapping:
-                        option_value = str(row[column_mapping[option_key]]).strip()
-                        if option_value and option_value.lower() not in ['nan', 'none', '']:
-                            options[option_key[-1].upper()] = option_value
-                
+                options = {letter: values[i] for letter, values in option_columns if values[i] is not None}
                 if len(options) >= 2:
-                    question_data['options'] = json.dumps(options)
+                    question_data['options'] = _dumps(options)
                 else:
                     question_data['question_type'] = 'short_answer'
             
-            # Set correct answer
-            if 'correct_answer' in column_mapping:
-                correct_answer = str(row[column_mapping['correct_answer']]).strip()
-                if correct_answer and correct_answer.lower() not in ['nan', 'none', '']:
-                    question_data['correct_answer'] = correct_answer
-            
-            # Set explanation
-            if 'explanation' in column_mapping:
-                explanation = str(row[column_mapping['explanation']]).strip()
-                if explanation and explanation.lower() not in ['nan', 'none', '']:
-                    question_data['explanation'] = explanation
+            # Set correct answer and explanation
+            if correct_answers[i] is not None:
+                question_data['correct_answer'] = correct_answers[i]
+            if explanations[i] is not None:
+                question_data['explanation'] = explanations[i]
             
             # Set difficulty
-            if 'difficulty' in column_mapping:
-                difficulty = str(row[column_mapping['difficulty']]).strip().lower()
-                if difficulty in ['easy', 'medium', 'hard', 'سهل', 'متوسط', 'صعب']:
-                    difficulty_map = {'سهل': 'easy', 'متوسط': 'medium', 'صعب': 'hard'}
-                    question_data['difficulty'] = difficulty_map.get(difficulty, difficulty)
+            if difficulties[i] is not None:
+                difficulty = self.DIFFICULTY_ALIASES.get(difficulties[i].lower())
+                if difficulty:
+                    question_data['difficulty'] = difficulty
             
             # Set points
-            if 'points' in column_mapping:
+            if points_values[i] is not None:
                 try:
-                    points = float(row[column_mapping['points']])
+                    points = float(points_values[i])
                     if points > 0:
                         question_data['points'] = points
-                except (ValueError, TypeError):
+                except ValueError:
                     pass
             
-            return question_data
-            
-        except Exception as e:
-            logger.error(f"Error parsing Excel row: {e}")
-            return None
+            questions.append(question_data)
+        
+        return questions
+
+    def invalidate_quiz(self, quiz_id: Optional[int] = None):
+        """Drop cached quiz rows and answer keys after a quiz is edited (all quizzes when no id is given)"""
+        if quiz_id is None:
+            self._quiz_cache.invalidate()
+        else:
+            self._quiz_cache.invalidate(quiz_id)
+        # Answer keys are cached by question id; drop them all rather than track quiz membership
+        self._answer_key_cache.invalidate()
+
+    async def _get_quiz_cached(self, quiz_id: int) -> Optional[Dict[str, Any]]:
+        """Get a quiz row through the short-lived cache (treat as read-only)"""
+        quiz = self._quiz_cache.get(quiz_id)
+        if quiz is None:
+            quiz = await self.db.get_quiz_by_id(quiz_id)
+            if quiz:
+                self._quiz_cache.set(quiz_id, quiz)
+        return quiz
+
+    async def _get_answer_key(self, question_id: int) -> Optional[AnswerKey]:
+        """Get a question's grading key through the short-lived cache"""
+        answer_key = self._answer_key_cache.get(question_id)
+        if answer_key is None:
+            question = await self.db.get_question_by_id(question_id)
+            if not question:
+                return None
+            answer_key = AnswerKey.from_row(question)
+            self._answer_key_cache.set(question_id, answer_key)
+        return answer_key
 
     async def _can_student_take_quiz(self, student_id: int, quiz_id: int) -> Dict[str, Any]:
         """Check if student can take the quiz"""
         try:
-            quiz = await self.db.get_quiz_by_id(quiz_id)
+            quiz = await self._get_quiz_cached(quiz_id)
             if not quiz or not quiz['is_active']:
                 return {'allowed': False, 'reason': 'Quiz not available'}
             
-            # Check previous attempts
-            attempts = await self.db.get_student_quiz_attempts(student_id, quiz_id)
-            attempt_count = len(attempts)
+            # Check previous attempts (count and in-progress flag only)
+            attempt_stats = await self.db.get_student_attempt_stats(student_id, quiz_id)
+            attempt_count = attempt_stats['attempt_count']
             
             if attempt_count >= quiz['max_attempts']:
                 return {'allowed': False, 'reason': 'Maximum attempts reached'}
             
             # Check if there's an active attempt
-            active_attempt = next((a for a in attempts if a['status'] == 'in_progress'), None)
-            if active_attempt:
+            if attempt_stats['has_active']:
                 return {'allowed': False, 'reason': 'Active attempt in progress'}
             
             return {
@@ -445,38 +666,18 @@ class QuizService:
             logger.error(f"Error checking quiz eligibility: {e}")
             return {'allowed': False, 'reason': 'System error'}
 
-    async def _evaluate_answer(self, question: Dict[str, Any], student_answer: str) -> tuple[bool, float]:
+    async def _evaluate_answer(self, answer_key: AnswerKey, student_answer: str) -> tuple[bool, float]:
         """Evaluate a student's answer"""
         try:
-            question_type = question['question_type']
-            correct_answer = question.get('correct_answer', '').strip().lower()
-            student_answer = student_answer.strip().lower()
+            # Essays and unknown types are not auto-graded
+            evaluator = self._answer_evaluators.get(answer_key.question_type)
+            if evaluator is None:
+                return False, 0
             
-            is_correct = False
-            
-            if question_type == 'multiple_choice':
-                # For multiple choice, compare the selected option
-                is_correct = student_answer == correct_answer
-            
-            elif question_type == 'true_false':
-                # Handle Arabic and English true/false
-                true_values = ['true', 'صح', 'صحيح', '1', 'yes', 'نعم']
-                false_values = ['false', 'خطأ', 'خاطئ', '0', 'no', 'لا']
-                
-                student_bool = student_answer in true_values
-                correct_bool = correct_answer in true_values
-                is_correct = student_bool == correct_bool
-            
-            elif question_type == 'fill_in_blank':
-                # More flexible matching for fill-in-the-blank
-                is_correct = self._fuzzy_match(student_answer, correct_answer)
-            
-            elif question_type == 'short_answer':
-                # Fuzzy matching for short answers
-                is_correct = self._fuzzy_match(student_answer, correct_answer)
+            is_correct = evaluator(student_answer.strip().lower(), answer_key.correct_answer)
             
             # Calculate points earned
-            points_earned = question['points'] if is_correct else 0
+            points_earned = answer_key.points if is_correct else 0
             
             return is_correct, points_earned
             
@@ -484,33 +685,50 @@ class QuizService:
             logger.error(f"Error evaluating answer: {e}")
             return False, 0
 
-    def _fuzzy_match(self, student_answer: str, correct_answer: str, threshold: float = 0.8) -> bool:
-        """Fuzzy string matching for answers"""
+    @staticmethod
+    def _match_choice(student_answer: str, correct_answer: str) -> bool:
+        """Multiple choice: the selected option must equal the correct one"""
+        return student_answer == correct_answer
+
+    def _match_true_false(self, student_answer: str, correct_answer: str) -> bool:
+        """Arabic and English true/false (anything not a true value counts as false)"""
+        return (student_answer in self.TRUE_ANSWER_VALUES) == (correct_answer in self.TRUE_ANSWER_VALUES)
+
+    def _match_blank(self, student_answer: str, correct_answer: str) -> bool:
+        """Fill-in-the-blank: character edit distance"""
+        return self._fuzzy_match(student_answer, correct_answer, by_words=False)
+
+    def _fuzzy_match(self, student_answer: str, correct_answer: str, threshold: float = 0.8,
+                     by_words: bool = True) -> bool:
+        """Fuzzy string matching for answers (word-order-insensitive, or plain edit distance)"""
         if not student_answer or not correct_answer:
             return False
         
-        # Simple similarity check (you can use more sophisticated libraries like fuzzywuzzy)
-        student_words = set(student_answer.split())
-        correct_words = set(correct_answer.split())
-        
-        if len(correct_words) == 0:
-            return False
-        
-        intersection = len(student_words.intersection(correct_words))
-        similarity = intersection / len(correct_words)
+        # Sorted-token similarity rather than token-set: a lone shared word or a list of
+        # candidate words must not score as a full match
+        if fuzz is not None:
+            scorer = fuzz.token_sort_ratio if by_words else fuzz.ratio
+            return scorer(student_answer, correct_answer) >= threshold * 100
         
-        return similarity >= threshold
+        if by_words:
+            student_answer = ' '.join(sorted(student_answer.split()))
+            correct_answer = ' '.join(sorted(correct_answer.split()))
+        return _indel_ratio(student_answer, correct_answer) >= threshold * 100
 
     async def _calculate_quiz_results(self, attempt_id: int) -> Dict[str, Any]:
         """Calculate quiz results for an attempt"""
         try:
-            attempt = await self.db.get_quiz_attempt(attempt_id)
-            quiz = await self.db.get_quiz_by_id(attempt['quiz_id'])
-            answers = await self.db.get_quiz_attempt_answers(attempt_id)
-            
-            total_questions = len(answers)
-            correct_answers = sum(1 for answer in answers if answer['is_correct'])
-            points_earned = sum(answer['points_earned'] for answer in answers)
+            # The attempt and its answer summary are independent; the quiz needs the attempt
+            # (answer counts and points are reduced in the database, not row by row here)
+            attempt, summary = await asyncio.gather(
+                self.db.get_quiz_attempt(attempt_id),
+                self.db.get_attempt_summary(attempt_id)
+            )
+            quiz = await self._get_quiz_cached(attempt['quiz_id'])
+            
+            total_questions = summary['total_questions']
+            correct_answers = summary['correct_answers']
+            points_earned = summary['points_earned']
             total_points = quiz['total_points']
             
             score_percentage = (points_earned / total_points * 100) if total_points > 0 else 0
@@ -531,8 +749,7 @@ class QuizService:
                 'score_percentage': round(score_percentage, 2),
                 'passed': passed,
                 'passing_score': quiz['passing_score'],
-                'time_taken_minutes': round(time_taken, 2),
-                'answers': answers
+                'time_taken_minutes': round(time_taken, 2)
             }
             
         except Exception as e:
@@ -542,12 +759,12 @@ class QuizService:
     async def _enrich_quiz_data(self, quiz: Dict[str, Any]) -> Dict[str, Any]:
         """Enrich quiz data with additional information"""
         try:
-            # Add question count
-            question_count = await self.db.get_quiz_question_count(quiz['id'])
+            # Question count and attempt statistics are independent
+            question_count, attempt_stats = await asyncio.gather(
+                self.db.get_quiz_question_count(quiz['id']),
+                self.db.get_quiz_attempt_stats(quiz['id'])
+            )
             quiz['question_count'] = question_count
-            
-            # Add attempt statistics
-            attempt_stats = await self.db.get_quiz_attempt_stats(quiz['id'])
             quiz['total_attempts'] = attempt_stats.get('total_attempts', 0)
             quiz['average_score'] = attempt_stats.get('average_score', 0)
             
@@ -567,12 +784,15 @@ class QuizService:
         if not attempt.get('start_time'):
             return False
         
-        quiz = await self.db.get_quiz_by_id(attempt['quiz_id'])
-        if not quiz or quiz['time_limit'] <= 0:
+        time_limit = attempt.get('time_limit')
+        if time_limit is None:
+            quiz = await self._get_quiz_cached(attempt['quiz_id'])
+            time_limit = quiz['time_limit'] if quiz else 0
+        if not time_limit or time_limit <= 0:
             return False
         
         elapsed_minutes = (datetime.now() - attempt['start_time']).total_seconds() / 60
-        return elapsed_minutes > quiz['time_limit']
+        return elapsed_minutes > time_limit
 
     async def _timeout_attempt(self, attempt_id: int):
         """Mark attempt as timed out"""
@@ -602,30 +822,51 @@ class QuizService:
         """Export quiz results to Excel"""
         try:
             results = await self.db.get_all_quiz_results(quiz_id)
-            quiz = await self.db.get_quiz_by_id(quiz_id)
-            
-            # Create DataFrame
-            df_data = []
-            for result in results:
-                df_data.append({
-                    'Student Name': result.get('student_name', ''),
-                    'Attempt': result.get('attempt_number', 1),
-                    'Score (%)': result.get('total_score', 0),
-                    'Points': f"{result.get('points_earned', 0)}/{quiz.get('total_points', 0)}",
-                    'Status': 'Passed' if result.get('passed') else 'Failed',
-                    'Time Taken (min)': result.get('completion_time_minutes', 0),
-                    'Completion Date': result.get('end_time', '').strftime('%Y-%m-%d %H:%M') if result.get('end_time') else ''
-                })
-            
-            df = pd.DataFrame(df_data)
-            
-            # Export to Excel bytes
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Quiz Results')
-            
-            return output.getvalue()
+            quiz = await self._get_quiz_cached(quiz_id)
+            
+            # Build rows directly in RESULTS_EXPORT_COLUMNS order
+            points_suffix = f"/{quiz.get('total_points', 0)}"
+            rows = [
+                (
+                    result.get('student_name', ''),
+                    result.get('attempt_number', 1),
+                    result.get('total_score', 0),
+                    f"{result.get('points_earned', 0)}{points_suffix}",
+                    'Passed' if result.get('passed') else 'Failed',
+                    result.get('completion_time_minutes', 0),
+                    result['end_time'].strftime('%Y-%m-%d %H:%M') if result.get('end_time') else ''
+                )
+                for result in results
+            ]
+            
+            # Export to Excel bytes off the event loop
+            return await asyncio.to_thread(self._write_results_workbook, list(self.RESULTS_EXPORT_COLUMNS), rows)
             
         except Exception as e:
             logger.error(f"Error exporting quiz results: {e}")
-            return b''
\ No newline at end of file
+            return b''
+
+    def _write_results_workbook(self, headers: List[str], rows: List[tuple]) -> bytes:
+        """Write a single-sheet results workbook, streaming rows instead of keeping cell objects"""
+        output = io.BytesIO()
+        
+        if xlsxwriter is not None:
+            workbook = xlsxwriter.Workbook(output, {
+                'constant_memory': True,
+                'strings_to_formulas': False,
+                'strings_to_urls': False
+            })
+            worksheet = workbook.add_worksheet('Quiz Results')
+            worksheet.write_row(0, 0, headers)
+            for row_index, row in enumerate(rows, start=1):
+                worksheet.write_row(row_index, 0, row)
+            workbook.close()
+        else:
+            workbook = openpyxl.Workbook(write_only=True)
+            worksheet = workbook.create_sheet('Quiz Results')
+            worksheet.append(headers)
+            for row in rows:
+                worksheet.append(row)
+            workbook.save(output)
+        
+        return output.getvalue()
@@ -1,18 +1,18 @@
 #!/usr/bin/env python3
 """
 Simple test bot to diagnose connection issues
-Forces polling mode and basic logging with health endpoint
+Receives updates by webhook when PUBLIC_URL is set (long polling otherwise),
+with basic logging and a health endpoint
 """
 
 import os
 import logging
 import asyncio
+import signal
+import hmac
+import secrets
 from telegram import Bot, Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
-import uvicorn
-import threading
 
 # Setup logging
 logging.basicConfig(
@@ -29,6 +29,21 @@ if not BOT_TOKEN:
 
 logger.info(f"Bot token starts with: {BOT_TOKEN[:10]}...")
 
+# Seconds Telegram holds each getUpdates call open when there is nothing to deliver
+LONG_POLL_TIMEOUT = int(os.getenv('LONG_POLL_TIMEOUT', '30'))
+
+# Public base URL for webhook mode (Railway exposes the bare domain as RAILWAY_STATIC_URL)
+PUBLIC_URL = os.getenv('PUBLIC_URL') or (
+    f"https://{os.getenv('RAILWAY_STATIC_URL')}" if os.getenv('RAILWAY_STATIC_URL') else None
+)
+# Fixed path (a token in the URL would end up in access logs); Telegram proves itself
+# with the secret header instead, a fresh one per process unless WEBHOOK_SECRET is set
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+# The test bot only handles /start and text echo, so only messages are requested
+ALLOWED_UPDATES = [Update.MESSAGE]
+
 async def start_command(update: Update, context):
     """Handle /start command"""
     logger.info(f"Received /start from user {update.effective_user.id}")
@@ -50,8 +65,20 @@ async def echo_handler(update: Update, context):
     except Exception as e:
         logger.error(f"Error sending echo message: {e}")
 
-def start_health_server():
-    """Start health server in background"""
+async def start_health_server(telegram_app: Application):
+    """Start health (and webhook) server as a task on the running loop; returns the server and its task"""
+    # Web stack is imported here so module import stays light
+    from fastapi import FastAPI, Request
+    from fastapi.responses import Response
+    import uvicorn
+    
+    # orjson-backed responses when installed; stdlib json otherwise
+    try:
+        import orjson  # noqa: F401
+        from fastapi.responses import ORJSONResponse as JSONResponse
+    except ImportError:
+        from fastapi.responses import JSONResponse
+    
     health_app = FastAPI()
     
     @health_app.get("/health")
@@ -59,9 +86,20 @@ def start_health_server():
         return JSONResponse({
             "status": "healthy",
             "message": "Simple test bot running",
-            "mode": "polling"
+            "mode": "webhook" if PUBLIC_URL else "polling"
         })
     
+    if PUBLIC_URL:
+        @health_app.post(WEBHOOK_PATH)
+        async def telegram_webhook(request: Request):
+            """Hand updates pushed by Telegram to the application"""
+            received = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            if not hmac.compare_digest(received, WEBHOOK_SECRET):
+                return Response(status_code=403)
+            update = Update.de_json(await request.json(), telegram_app.bot)
+            await telegram_app.update_queue.put(update)
+            return Response()
+    
     @health_app.get("/")
     async def root():
         return JSONResponse({
@@ -74,57 +112,90 @@ def start_health_server():
     
     config = uvicorn.Config(health_app, host="0.0.0.0", port=port, log_level="info")
     server = uvicorn.Server(config)
+    # main() owns the signal handlers and stops the server explicitly
+    server.install_signal_handlers = lambda: None
     
-    def run_server():
-        asyncio.run(server.serve())
-    
-    thread = threading.Thread(target=run_server, daemon=True)
-    thread.start()
+    task = asyncio.create_task(server.serve())
     logger.info("Health server started in background")
+    return server, task
 
 async def main():
     """Main function"""
     logger.info("Starting simple test bot...")
     
+    # Create application
+    builder = Application.builder().token(BOT_TOKEN)
+    if PUBLIC_URL:
+        # Updates arrive through the health server's webhook route; no updater needed
+        builder = builder.updater(None)
+    else:
+        # Client read timeout must outlast the long-poll hold below
+        builder = builder.get_updates_read_timeout(LONG_POLL_TIMEOUT + 5)
+    app = builder.build()
+    
     # Start health server first
-    start_health_server()
+    health_server, health_task = await start_health_server(app)
     
     try:
-        # Create application
-        app = Application.builder().token(BOT_TOKEN).build()
-        
         # Add handlers
         app.add_handler(CommandHandler("start", start_command))
         app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo_handler))
         
         logger.info("Handlers added successfully")
         
-        # Initialize and start
-        await app.initialize()
-        await app.start()
-        logger.info("Bot initialized and started")
-        
-        # Force polling mode (ignore PORT environment variable)
-        logger.info("Starting polling mode...")
-        await app.updater.start_polling(drop_pending_updates=True)
-        logger.info("Polling started successfully")
-        
-        # Keep running
-        logger.info("Bot is now running in polling mode...")
-        while True:
-            await asyncio.sleep(10)
-            logger.info("Bot still running...")
+        # async with runs initialize()/shutdown(); start()/stop() bracket the running phase
+        async with app:
+            await app.start()
+            logger.info("Bot initialized and started")
+            try:
+                if PUBLIC_URL:
+                    # Telegram pushes updates to the health server; nothing is polled
+                    logger.info("Starting webhook mode...")
+                    await app.bot.set_webhook(
+                        url=f"{PUBLIC_URL}{WEBHOOK_PATH}",
+                        secret_token=WEBHOOK_SECRET,
+                        allowed_updates=ALLOWED_UPDATES,
+                        drop_pending_updates=True
+                    )
+                    logger.info("Webhook registered successfully")
+                else:
+                    logger.info("Starting polling mode...")
+                    # Long polling: each getUpdates waits on Telegram's side until updates arrive
+                    await app.updater.start_polling(
+                        timeout=LONG_POLL_TIMEOUT,
+                        poll_interval=0.0,
+                        allowed_updates=ALLOWED_UPDATES,
+                        drop_pending_updates=True
+                    )
+                    logger.info("Polling started successfully")
+                
+                # Keep running until SIGINT/SIGTERM; the loop stays idle in between
+                logger.info(f"Bot is now running in {'webhook' if PUBLIC_URL else 'polling'} mode...")
+                stop_event = asyncio.Event()
+                loop = asyncio.get_running_loop()
+                for sig in (signal.SIGINT, signal.SIGTERM):
+                    loop.add_signal_handler(sig, stop_event.set)
+                await stop_event.wait()
+            finally:
+                logger.info("Shutting down bot...")
+                if app.updater and app.updater.running:
+                    await app.updater.stop()
+                await app.stop()
             
     except Exception as e:
         logger.error(f"Error in main: {e}")
         import traceback
         logger.error(f"Traceback: {traceback.format_exc()}")
     finally:
-        logger.info("Shutting down bot...")
-        try:
-            await app.stop()
-        except:
-            pass
+        health_server.should_exit = True
+        await health_task
 
 if __name__ == "__main__":
+    # Use uvloop's libuv-based event loop when installed; stdlib loop otherwise
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    
     asyncio.run(main())
\ No newline at end of file
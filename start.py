@@ -7,16 +7,17 @@ Handles Railway deployment and ensures proper startup sequence
 import os
 import sys
 import asyncio
+import hashlib
 import logging
 from dotenv import load_dotenv
 
 # Load environment variables first
 load_dotenv()
 
-# Ensure logs directory exists
-os.makedirs('logs', exist_ok=True)
-os.makedirs('uploads', exist_ok=True)
-os.makedirs('content', exist_ok=True)
+# Ensure runtime directories exist
+_REQ_DIRS = ('logs', 'uploads', 'content')
+for _dir in _REQ_DIRS:
+    os.makedirs(_dir, exist_ok=True)
 
 # Set up basic logging for startup
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +26,24 @@ logger = logging.getLogger(__name__)
 # Railway deployment marker
 DEPLOYMENT_VERSION = "v2.0"
 
+# Set RUN_DB_INIT=0 to skip startup table creation here and in the bot's database
+# manager (BotConfig.RUN_DB_INIT), e.g. when another replica owns migrations
+RUN_DB_INIT = os.getenv('RUN_DB_INIT', '1') == '1'
+
+# Database manager whose connection pool is shared by table setup and the bot
+_db_manager = None
+
+async def get_pool():
+    """Get the shared PostgreSQL pool, opening it on first use (None without PostgreSQL)"""
+    global _db_manager
+    if _db_manager is None:
+        from models import get_database_manager, PostgreSQLManager
+        db_manager = get_database_manager()
+        if not isinstance(db_manager, PostgreSQLManager):
+            return None
+        _db_manager = db_manager
+    return await _db_manager.open_pool()
+
 async def main():
     """Main startup function"""
     try:
@@ -68,11 +87,16 @@ async def main():
             
         # Initialize database tables first
         try:
-            await initialize_database_tables()
+            if RUN_DB_INIT:
+                await initialize_database_tables()
+            else:
+                logger.info("⏭️ Database table initialization disabled (RUN_DB_INIT=0)")
             # Test database connection before starting bot
             await test_database_connection()
         except Exception as db_error:
             logger.error(f"❌ Database initialization failed: {db_error}")
+            if _db_manager is not None:
+                await _db_manager.close()
             logger.error("Starting health server due to database failure")
             await start_health_server()
             return
@@ -81,7 +105,7 @@ async def main():
         try:
             from main import main as run_bot
             logger.info("✅ Main module imported successfully")
-            await run_bot()
+            await run_bot(db_manager=_db_manager)
         except Exception as main_error:
             logger.error(f"❌ Failed to start main bot: {main_error}")
             import traceback
@@ -106,7 +130,14 @@ async def main():
 async def test_database_connection():
     """Test database connection before starting bot"""
     try:
-        logger.info("✅ Database connection test skipped - tables already created successfully")
+        # Ping over the shared pool; the warmed connection is handed on to the bot
+        pool = await get_pool()
+        if pool is None:
+            logger.info("Database connection test skipped - not using PostgreSQL")
+            return
+        
+        await pool.fetchval("SELECT 1")
+        logger.info("✅ Database connection test passed")
         
     except Exception as e:
         logger.error(f"❌ Database connection failed: {e}")
@@ -124,159 +155,172 @@ async def initialize_database_tables():
             logger.warning("DATABASE_URL not set, skipping database initialization")
             return
             
-        # Use the same logic as init_db.py but inline
+        # Use the same logic as init_db.py but inline, on a connection from the shared pool
+        pool = await get_pool()
+        if pool is None:
+            logger.warning("DATABASE_URL is not PostgreSQL, skipping database initialization")
+            return
+        
         import asyncpg
         
-        # Ensure proper format
-        if database_url.startswith('postgres://'):
-            database_url = database_url.replace('postgres://', 'postgresql://', 1)
+        async with pool.acquire() as conn:
+            logger.info("✅ Connected to PostgreSQL for table creation")
             
-        # Connect and create tables
-        conn = await asyncpg.connect(database_url)
-        logger.info("✅ Connected to PostgreSQL for table creation")
-        
-        # Create essential tables
-        tables = [
-            ("students", '''
-                CREATE TABLE IF NOT EXISTS students (
-                    id SERIAL PRIMARY KEY,
-                    telegram_id BIGINT UNIQUE NOT NULL,
-                    username VARCHAR(255),
-                    name VARCHAR(255) NOT NULL,
-                    phone VARCHAR(50),
-                    section VARCHAR(100),
-                    registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    notification_enabled BOOLEAN DEFAULT TRUE,
-                    current_week INTEGER DEFAULT 1,
-                    completed_weeks INTEGER DEFAULT 0,
-                    engagement_score FLOAT DEFAULT 50.0
-                )
-            '''),
-            ("materials", '''
-                CREATE TABLE IF NOT EXISTS materials (
-                    id SERIAL PRIMARY KEY,
-                    title VARCHAR(500) NOT NULL,
-                    description TEXT,
-                    content TEXT,
-                    section VARCHAR(100) NOT NULL,
-                    subject VARCHAR(100) NOT NULL,
-                    week_number INTEGER NOT NULL,
-                    date_published TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    content_type VARCHAR(50) DEFAULT 'text',
-                    difficulty_level VARCHAR(20) DEFAULT 'medium',
-                    estimated_duration INTEGER DEFAULT 30,
-                    content_hash VARCHAR(64),
-                    has_files BOOLEAN DEFAULT FALSE,
-                    last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    view_count INTEGER DEFAULT 0
-                )
-            '''),
-            ("quizzes", '''
-                CREATE TABLE IF NOT EXISTS quizzes (
-                    id SERIAL PRIMARY KEY,
-                    title VARCHAR(500) NOT NULL,
-                    description TEXT,
-                    section VARCHAR(100) NOT NULL,
-                    subject VARCHAR(100) NOT NULL,
-                    time_limit INTEGER DEFAULT 30,
-                    max_attempts INTEGER DEFAULT 3,
-                    passing_score INTEGER DEFAULT 60,
-                    total_points FLOAT DEFAULT 0,
-                    total_questions INTEGER DEFAULT 0,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    randomize_questions BOOLEAN DEFAULT FALSE,
-                    show_results_immediately BOOLEAN DEFAULT TRUE,
-                    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    difficulty_level VARCHAR(20) DEFAULT 'medium',
-                    available_from_week INTEGER DEFAULT 1,
-                    quiz_type VARCHAR(20) DEFAULT 'regular',
-                    week_number INTEGER,
-                    start_week INTEGER,
-                    end_week INTEGER
-                )
-            '''),
-            ("questions", '''
-                CREATE TABLE IF NOT EXISTS questions (
-                    id SERIAL PRIMARY KEY,
-                    quiz_id INTEGER REFERENCES quizzes(id) ON DELETE CASCADE,
-                    question_text TEXT NOT NULL,
-                    question_type VARCHAR(50) NOT NULL,
-                    options JSONB,
-                    correct_answer TEXT,
-                    explanation TEXT,
-                    points FLOAT DEFAULT 1,
-                    order_index INTEGER DEFAULT 0,
-                    is_required BOOLEAN DEFAULT TRUE,
-                    difficulty VARCHAR(20) DEFAULT 'medium'
-                )
-            '''),
-            ("quiz_attempts", '''
-                CREATE TABLE IF NOT EXISTS quiz_attempts (
-                    id SERIAL PRIMARY KEY,
-                    student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
-                    quiz_id INTEGER REFERENCES quizzes(id) ON DELETE CASCADE,
-                    start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    end_time TIMESTAMP,
-                    status VARCHAR(20) DEFAULT 'in_progress',
-                    total_score FLOAT DEFAULT 0,
-                    points_earned FLOAT DEFAULT 0,
-                    passed BOOLEAN DEFAULT FALSE,
-                    attempt_number INTEGER DEFAULT 1,
-                    answers_data JSONB
-                )
-            '''),
-            ("student_activities", '''
-                CREATE TABLE IF NOT EXISTS student_activities (
-                    id SERIAL PRIMARY KEY,
-                    student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
-                    activity_type VARCHAR(50) NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    metadata JSONB,
-                    session_id VARCHAR(100)
-                )
-            ''')
-        ]
-        
-        for table_name, sql in tables:
-            await conn.execute(sql)
-            logger.info(f"✅ {table_name} table created")
+            # Create essential tables
+            tables = [
+                ("students", '''
+                    CREATE TABLE IF NOT EXISTS students (
+                        id SERIAL PRIMARY KEY,
+                        telegram_id BIGINT UNIQUE NOT NULL,
+                        username VARCHAR(255),
+                        name VARCHAR(255) NOT NULL,
+                        phone VARCHAR(50),
+                        section VARCHAR(100),
+                        registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        is_active BOOLEAN DEFAULT TRUE,
+                        notification_enabled BOOLEAN DEFAULT TRUE,
+                        current_week INTEGER DEFAULT 1,
+                        completed_weeks INTEGER DEFAULT 0,
+                        engagement_score FLOAT DEFAULT 50.0
+                    )
+                '''),
+                ("materials", '''
+                    CREATE TABLE IF NOT EXISTS materials (
+                        id SERIAL PRIMARY KEY,
+                        title VARCHAR(500) NOT NULL,
+                        description TEXT,
+                        content TEXT,
+                        section VARCHAR(100) NOT NULL,
+                        subject VARCHAR(100) NOT NULL,
+                        week_number INTEGER NOT NULL,
+                        date_published TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        is_active BOOLEAN DEFAULT TRUE,
+                        content_type VARCHAR(50) DEFAULT 'text',
+                        difficulty_level VARCHAR(20) DEFAULT 'medium',
+                        estimated_duration INTEGER DEFAULT 30,
+                        content_hash VARCHAR(64),
+                        has_files BOOLEAN DEFAULT FALSE,
+                        last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        view_count INTEGER DEFAULT 0
+                    )
+                '''),
+                ("quizzes", '''
+                    CREATE TABLE IF NOT EXISTS quizzes (
+                        id SERIAL PRIMARY KEY,
+                        title VARCHAR(500) NOT NULL,
+                        description TEXT,
+                        section VARCHAR(100) NOT NULL,
+                        subject VARCHAR(100) NOT NULL,
+                        time_limit INTEGER DEFAULT 30,
+                        max_attempts INTEGER DEFAULT 3,
+                        passing_score INTEGER DEFAULT 60,
+                        total_points FLOAT DEFAULT 0,
+                        total_questions INTEGER DEFAULT 0,
+                        is_active BOOLEAN DEFAULT TRUE,
+                        randomize_questions BOOLEAN DEFAULT FALSE,
+                        show_results_immediately BOOLEAN DEFAULT TRUE,
+                        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        difficulty_level VARCHAR(20) DEFAULT 'medium',
+                        available_from_week INTEGER DEFAULT 1,
+                        quiz_type VARCHAR(20) DEFAULT 'regular',
+                        week_number INTEGER,
+                        start_week INTEGER,
+                        end_week INTEGER
+                    )
+                '''),
+                ("questions", '''
+                    CREATE TABLE IF NOT EXISTS questions (
+                        id SERIAL PRIMARY KEY,
+                        quiz_id INTEGER REFERENCES quizzes(id) ON DELETE CASCADE,
+                        question_text TEXT NOT NULL,
+                        question_type VARCHAR(50) NOT NULL,
+                        options JSONB,
+                        correct_answer TEXT,
+                        explanation TEXT,
+                        points FLOAT DEFAULT 1,
+                        order_index INTEGER DEFAULT 0,
+                        is_required BOOLEAN DEFAULT TRUE,
+                        difficulty VARCHAR(20) DEFAULT 'medium'
+                    )
+                '''),
+                ("quiz_attempts", '''
+                    CREATE TABLE IF NOT EXISTS quiz_attempts (
+                        id SERIAL PRIMARY KEY,
+                        student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
+                        quiz_id INTEGER REFERENCES quizzes(id) ON DELETE CASCADE,
+                        start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        end_time TIMESTAMP,
+                        status VARCHAR(20) DEFAULT 'in_progress',
+                        total_score FLOAT DEFAULT 0,
+                        points_earned FLOAT DEFAULT 0,
+                        passed BOOLEAN DEFAULT FALSE,
+                        attempt_number INTEGER DEFAULT 1,
+                        answers_data JSONB
+                    )
+                '''),
+                ("student_activities", '''
+                    CREATE TABLE IF NOT EXISTS student_activities (
+                        id SERIAL PRIMARY KEY,
+                        student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
+                        activity_type VARCHAR(50) NOT NULL,
+                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        metadata JSONB,
+                        session_id VARCHAR(100),
+                        week INTEGER
+                    )
+                ''')
+            ]
             
-        # Create essential indexes - Production optimized for 7000+ users
-        indexes = [
-            # Core user lookups (most frequent)
-            'CREATE INDEX IF NOT EXISTS idx_students_telegram_id ON students(telegram_id)',
-            'CREATE INDEX IF NOT EXISTS idx_students_section_active ON students(section, is_active, last_activity DESC)',
+            # Create essential indexes - Production optimized for 7000+ users
+            indexes = [
+                # Core user lookups (most frequent)
+                'CREATE INDEX IF NOT EXISTS idx_students_telegram_id ON students(telegram_id)',
+                'CREATE INDEX IF NOT EXISTS idx_students_section_active ON students(section, is_active, last_activity DESC)',
             
-            # Material queries (frequent - weekly access)
-            'CREATE INDEX IF NOT EXISTS idx_materials_section_week ON materials(section, week_number)',
-            'CREATE INDEX IF NOT EXISTS idx_materials_active_section ON materials(is_active, section, week_number) WHERE is_active = true',
-            'CREATE INDEX IF NOT EXISTS idx_materials_view_count ON materials(view_count DESC) WHERE is_active = true',
+                # Material queries (frequent - weekly access)
+                'CREATE INDEX IF NOT EXISTS idx_materials_section_week ON materials(section, week_number)',
+                'CREATE INDEX IF NOT EXISTS idx_materials_active_section ON materials(is_active, section, week_number) WHERE is_active = true',
+                'CREATE INDEX IF NOT EXISTS idx_materials_view_count ON materials(view_count DESC) WHERE is_active = true',
             
-            # Quiz performance (high volume)
-            'CREATE INDEX IF NOT EXISTS idx_quizzes_type_week ON quizzes(quiz_type, week_number)',
-            'CREATE INDEX IF NOT EXISTS idx_quiz_attempts_student_quiz ON quiz_attempts(student_id, quiz_id)',
-            'CREATE INDEX IF NOT EXISTS idx_quiz_attempts_status_time ON quiz_attempts(status, start_time DESC)',
-            'CREATE INDEX IF NOT EXISTS idx_quiz_attempts_student_time ON quiz_attempts(student_id, start_time DESC)',
+                # Quiz performance (high volume)
+                'CREATE INDEX IF NOT EXISTS idx_quizzes_type_week ON quizzes(quiz_type, week_number)',
+                'CREATE INDEX IF NOT EXISTS idx_quiz_attempts_student_quiz ON quiz_attempts(student_id, quiz_id)',
+                'CREATE INDEX IF NOT EXISTS idx_quiz_attempts_status_time ON quiz_attempts(status, start_time DESC)',
+                'CREATE INDEX IF NOT EXISTS idx_quiz_attempts_student_time ON quiz_attempts(student_id, start_time DESC)',
             
-            # Analytics queries (heavy load expected)
-            'CREATE INDEX IF NOT EXISTS idx_student_activities_student_time ON student_activities(student_id, timestamp DESC)',
-            'CREATE INDEX IF NOT EXISTS idx_student_activities_type_time ON student_activities(activity_type, timestamp DESC)',
-            'CREATE INDEX IF NOT EXISTS idx_student_activities_session ON student_activities(session_id) WHERE session_id IS NOT NULL',
+                # Analytics queries (heavy load expected)
+                'CREATE INDEX IF NOT EXISTS idx_student_activities_student_time ON student_activities(student_id, timestamp DESC)',
+                'CREATE INDEX IF NOT EXISTS idx_student_activities_type_time ON student_activities(activity_type, timestamp DESC)',
+                'CREATE INDEX IF NOT EXISTS idx_student_activities_session ON student_activities(session_id) WHERE session_id IS NOT NULL',
+                'ALTER TABLE student_activities ADD COLUMN IF NOT EXISTS week INTEGER',
+                'CREATE INDEX IF NOT EXISTS idx_activities_student_type_week_col ON student_activities(student_id, activity_type, week) WHERE week IS NOT NULL',
             
-            # Questions for quiz display
-            'CREATE INDEX IF NOT EXISTS idx_questions_quiz_order ON questions(quiz_id, order_index)',
-            'CREATE INDEX IF NOT EXISTS idx_questions_difficulty ON questions(difficulty, question_type)',
-        ]
-        
-        for idx_sql in indexes:
-            await conn.execute(idx_sql)
+                # Questions for quiz display
+                'CREATE INDEX IF NOT EXISTS idx_questions_quiz_order ON questions(quiz_id, order_index)',
+                'CREATE INDEX IF NOT EXISTS idx_questions_difficulty ON questions(difficulty, question_type)',
+            ]
+            
+            # Tables and indexes go to the server as one multi-statement script, applied atomically
+            ddl = ";\n".join([sql for _, sql in tables] + indexes)
+            
+            # Skip the script entirely when this exact DDL was already applied
+            digest = hashlib.sha256(ddl.encode()).hexdigest()
+            try:
+                applied = await conn.fetchval('SELECT 1 FROM schema_version WHERE hash = $1', digest)
+            except asyncpg.UndefinedTableError:
+                applied = None
             
-        logger.info("✅ Database indexes created")
+            if applied:
+                logger.info("✅ Schema unchanged since last deploy, skipping table creation")
+            else:
+                async with conn.transaction():
+                    await conn.execute(ddl)
+                    await conn.execute('CREATE TABLE IF NOT EXISTS schema_version (hash TEXT PRIMARY KEY)')
+                    await conn.execute('INSERT INTO schema_version VALUES ($1) ON CONFLICT DO NOTHING', digest)
+            
+                logger.info(f"✅ {len(tables)} tables and {len(indexes)} indexes created/verified")
         
-        await conn.close()
         logger.info("✅ Database initialization completed successfully!")
         
     except Exception as e:
@@ -369,4 +413,11 @@ async def start_minimal_health_server():
         logger.info("Minimal health server still running...")
 
 if __name__ == "__main__":
+    # Use uvloop's libuv-based event loop when installed; stdlib loop otherwise
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    
     asyncio.run(main())
\ No newline at end of file
@@ -12,6 +12,8 @@ import os
 from functools import wraps
 import hashlib
 
+from utils.ttl_cache import invalidate_local
+
 logger = logging.getLogger(__name__)
 
 class CacheManager:
@@ -199,5 +201,7 @@ async def invalidate_materials_cache(section: str = None, week: int = None):
 async def invalidate_quiz_cache(quiz_id: int = None):
     """Invalidate quiz cache"""
     pattern = f"quiz_*{quiz_id}*" if quiz_id else "quiz_*"
+    # In-process quiz caches (QuizService) first; they do not depend on Redis being up
+    invalidate_local('quiz', quiz_id)
     cleared = await cache_manager.clear_pattern(pattern)
     logger.info(f"Invalidated {cleared} quiz cache entries")
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""
+In-process TTL cache for hot read paths
+Complements the Redis layer in utils.cache for data that every worker can
+recompute cheaply but that is requested far more often than it changes
+"""
+
+import time
+import weakref
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+_MISSING = object()
+
+# Invalidation callbacks for in-process caches, by namespace, held as weak references
+# so registering services are not kept alive; write paths and utils.cache fire them
+_invalidators: Dict[str, List[Callable[[], Optional[Callable]]]] = {}
+
+
+class TTLCache:
+    """
+    Small dict-backed cache whose entries expire after a fixed TTL
+    Values are returned by reference - callers must not mutate them
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: Dict[Hashable, Tuple[float, Any]] = {}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a live value or the default"""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        if entry[0] <= time.monotonic():
+            del self._data[key]
+            return default
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value for ttl seconds (defaults to the cache TTL)"""
+        now = time.monotonic()
+        if key not in self._data and len(self._data) >= self.maxsize:
+            self._evict(now)
+        self._data[key] = (now + (self.ttl if ttl is None else ttl), value)
+
+    def invalidate(self, key: Hashable = _MISSING):
+        """Drop one key, or everything when called without a key"""
+        if key is _MISSING:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _evict(self, now: float):
+        """Drop expired entries, then the oldest one if still full"""
+        self._data = {k: v for k, v in self._data.items() if v[0] > now}
+        if len(self._data) >= self.maxsize:
+            del self._data[next(iter(self._data))]
+
+
+def register_invalidator(namespace: str, callback: Callable):
+    """Have invalidate_local(namespace, ...) call callback with the same arguments"""
+    # Bound methods are held weakly; plain functions live as long as their module anyway
+    if hasattr(callback, '__self__'):
+        ref = weakref.WeakMethod(callback)
+    else:
+        ref = lambda: callback
+    _invalidators.setdefault(namespace, []).append(ref)
+
+
+def invalidate_local(namespace: str, *args: Any):
+    """Run every live invalidation callback registered for a namespace"""
+    refs = _invalidators.get(namespace)
+    if not refs:
+        return
+    live = []
+    for ref in refs:
+        callback = ref()
+        if callback is not None:
+            callback(*args)
+            live.append(ref)
+    refs[:] = live
+
+
+def ttl_cached(ttl: float, maxsize: int = 1024):
+    """
+    Cache an async function's results in-process for ttl seconds
+    Exceptions are not cached; the cache is exposed as wrapper.cache
+    """
+    def decorator(func: Callable):
+        cache = TTLCache(ttl, maxsize)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+            result = cache.get(key, _MISSING)
+            if result is _MISSING:
+                result = await func(*args, **kwargs)
+                cache.set(key, result)
+            return result
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator